@@ -0,0 +1,143 @@
+"""
+Compares the streaming BackgroundEstimator against averaging lists of frames, as
+Clip.calculate_background used to, and checks both give the same background.
+
+python -m benchmark.background training-testclips
+"""
+
+import argparse
+import logging
+import os
+import time
+import tracemalloc
+
+import numpy as np
+from cptv import CPTVReader
+
+from track_extraction.load.clip import BackgroundEstimator
+from track_extraction.load.framestack import CPTVFrameStack
+from track_extraction.ml_tools.logs import init_logging
+from track_extraction.piclassifier.motiondetector import is_affected_by_ffc
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "source",
+        nargs="*",
+        default=["tests/clips"],
+        help="CPTV files or folders of CPTV files",
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=5, help="Times to calculate each background"
+    )
+    args = parser.parse_args()
+    return args
+
+
+def list_background(frames):
+    """The list based calculation, returns (background, initial frames, initial diff)"""
+    background = None
+    initial_frames = None
+    initial_diff = None
+    group = []
+    for frame in frames:
+        if is_affected_by_ffc(frame):
+            continue
+        group.append(frame.pix)
+        if len(group) == BackgroundEstimator.GROUP_SIZE:
+            background, initial_frames, initial_diff = add_average(
+                np.average(group, axis=0), background, initial_frames, initial_diff
+            )
+            group = []
+    if len(group) > 0:
+        background, initial_frames, initial_diff = add_average(
+            np.average(group, axis=0), background, initial_frames, initial_diff
+        )
+    return background, initial_frames, initial_diff
+
+
+def add_average(frame_average, background, initial_frames, initial_diff):
+    if background is None:
+        return frame_average, frame_average, np.zeros(frame_average.shape)
+    background = np.minimum(background, frame_average)
+    initial_diff = np.maximum(initial_diff, initial_frames - frame_average)
+    return background, initial_frames, initial_diff
+
+
+def streaming_background(frames):
+    estimator = BackgroundEstimator()
+    for frame in frames:
+        estimator.add_frame(frame.pix, is_affected_by_ffc(frame))
+    estimator.finish()
+    return estimator.background, estimator.initial_frames, estimator.initial_diff
+
+
+def time_background(calculate, frames, repeats):
+    start = time.time()
+    for _ in range(repeats):
+        result = calculate(frames)
+    took = (time.time() - start) / repeats
+    tracemalloc.start()
+    calculate(frames)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, took, peak
+
+
+def find_files(sources):
+    files = []
+    for source in sources:
+        if os.path.isfile(source):
+            files.append(source)
+            continue
+        for folder_path, _, names in os.walk(source):
+            for name in names:
+                if os.path.splitext(name)[1] == ".cptv":
+                    files.append(os.path.join(folder_path, name))
+    files.sort()
+    return files
+
+
+def main():
+    args = parse_args()
+    init_logging()
+    files = find_files(args.source)
+    logging.info("Calculating backgrounds for %s files", len(files))
+    totals = {"list": 0, "streaming": 0}
+    num_frames = 0
+    for filename in files:
+        with open(filename, "rb") as f:
+            frames = CPTVFrameStack(CPTVReader(f))
+        num_frames += len(frames)
+        results = {}
+        for name, calculate in [
+            ("list", list_background),
+            ("streaming", streaming_background),
+        ]:
+            result, took, peak = time_background(calculate, frames, args.repeats)
+            results[name] = result
+            totals[name] += took
+            logging.info(
+                "%s %s: %.2fms per frame, %.1fKB peak allocated",
+                filename,
+                name,
+                1000 * took / max(1, len(frames)),
+                peak / 1024,
+            )
+        for expected, actual in zip(results["list"], results["streaming"]):
+            if not np.array_equal(expected, actual):
+                logging.error("%s streaming background doesn't match", filename)
+        frames.close()
+
+    for name, took in totals.items():
+        logging.info(
+            "%s: %.2fs %.1f frames/s", name, took, num_frames / max(took, 1e-6)
+        )
+    logging.info(
+        "streaming speed up %.1fx", totals["list"] / max(totals["streaming"], 1e-6)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Compares get_track throughput when every call opens the database against
+reading all tracks inside a single TrackDatabase session.
+
+python -m benchmark.databaseread path/to/dataset.hdf5
+"""
+
+import argparse
+import logging
+import time
+
+from track_extraction.ml_tools.logs import init_logging
+from track_extraction.ml_tools.trackdatabase import TrackDatabase
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("database", help="Track database to read")
+    parser.add_argument(
+        "--limit", type=int, default=None, help="Only read this many tracks"
+    )
+    parser.add_argument(
+        "--read-only",
+        action="store_true",
+        help="Open the database read only, so no lock is taken",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def read_tracks(db, track_ids):
+    start = time.time()
+    frames = 0
+    for clip_id, track_id in track_ids:
+        frames += len(db.get_track(clip_id, track_id))
+    return time.time() - start, frames
+
+
+def main():
+    args = parse_args()
+    init_logging()
+    db = TrackDatabase(args.database, read_only=args.read_only)
+    track_ids = db.get_all_track_ids()
+    if args.limit is not None:
+        track_ids = track_ids[: args.limit]
+    logging.info("Reading %s tracks from %s", len(track_ids), args.database)
+
+    per_call, frames = read_tracks(db, track_ids)
+    with db.session() as s:
+        session, _ = read_tracks(s, track_ids)
+
+    for name, took in [("per call", per_call), ("session", session)]:
+        logging.info(
+            "%s: %.2fs %.1f tracks/s %.1f frames/s",
+            name,
+            took,
+            len(track_ids) / max(took, 1e-6),
+            frames / max(took, 1e-6),
+        )
+    logging.info("session speed up %.1fx", per_call / max(session, 1e-6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Times calculating forest features for every track of a dataset, one track at a time
+and with the tracks of each clip together as the thermal writer does, and checks
+both give the same features.
+
+python -m benchmark.forestfeatures path/to/dataset.hdf5
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from track_extraction.ml_tools.forestmodel import (
+    batch_forest_features,
+    forest_features,
+)
+from track_extraction.ml_tools.frame import TrackChannels
+from track_extraction.ml_tools.logs import init_logging
+from track_extraction.ml_tools.trackdatabase import TrackDatabase
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("database", help="Track database to load tracks from")
+    parser.add_argument(
+        "--repeats", type=int, default=3, help="Times to calculate each track"
+    )
+    args = parser.parse_args()
+    return args
+
+
+def load_clips(db):
+    """Returns a list of tracks for each clip, as forest_features arguments"""
+    clips = []
+    with db.session():
+        for clip_id in db.get_all_clip_ids():
+            background = db.get_clip_background(clip_id)
+            frame_temp_median = db.get_clip_meta(clip_id)["frame_temp_median"]
+            tracks = []
+            for track_meta in db.get_clip_tracks(clip_id):
+                track_frames = db.get_track(
+                    clip_id,
+                    track_meta["id"],
+                    original=False,
+                    channels=[TrackChannels.thermal],
+                )
+                regions = [f.region for f in track_frames]
+                tracks.append((track_frames, background, frame_temp_median, regions))
+            clips.append(tracks)
+    return clips
+
+
+def main():
+    args = parse_args()
+    init_logging()
+    db = TrackDatabase(args.database, read_only=True)
+    clips = load_clips(db)
+    num_tracks = sum(len(tracks) for tracks in clips)
+    num_frames = sum(len(track[0]) for tracks in clips for track in tracks)
+    logging.info("Calculating features of %s tracks %s frames", num_tracks, num_frames)
+
+    start = time.time()
+    for _ in range(args.repeats):
+        per_track = [[forest_features(*track) for track in tracks] for tracks in clips]
+    track_time = time.time() - start
+
+    start = time.time()
+    for _ in range(args.repeats):
+        per_clip = [batch_forest_features(tracks) for tracks in clips]
+    clip_time = time.time() - start
+
+    mismatches = 0
+    for expected, actual in zip(per_track, per_clip):
+        for e, a in zip(expected, actual):
+            if (e is None) != (a is None) or (
+                e is not None and not np.allclose(e, a, equal_nan=True)
+            ):
+                mismatches += 1
+    if mismatches > 0:
+        logging.error("%s tracks features don't match", mismatches)
+    for name, took in [("per track", track_time), ("per clip", clip_time)]:
+        logging.info(
+            "%s: %.3fs %.1f tracks/s",
+            name,
+            took,
+            args.repeats * num_tracks / max(took, 1e-6),
+        )
+
+
+if __name__ == "__main__":
+    main()
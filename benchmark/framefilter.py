@@ -0,0 +1,134 @@
+"""
+Times filtering and detecting objects in a single frame, with the clip workspace
+against the original allocating implementation, and checks both find the same regions.
+Uses synthetic frames of warm moving blobs, 160x120 thermal and 640x360 IR sized.
+
+python -m benchmark.framefilter --frames 500
+"""
+
+import argparse
+import logging
+import time
+
+import cv2
+import numpy as np
+
+from track_extraction.config.config import Config
+from track_extraction.load.clip import Clip
+from track_extraction.load.cliptrackextractor import ClipTrackExtractor
+from track_extraction.ml_tools.imageprocessing import detect_objects, normalize
+from track_extraction.ml_tools.logs import init_logging
+
+RESOLUTIONS = {"thermal": (120, 160), "ir": (360, 640)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--frames", type=int, default=300, help="Frames to process at each size"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for frames")
+    parser.add_argument(
+        "--no-denoise",
+        action="store_true",
+        help="Time without denoising, which takes most of the frame time when enabled",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def make_frames(shape, num_frames, seed):
+    rng = np.random.default_rng(seed)
+    background = 3000 + rng.normal(0, 10, shape)
+    y, x = np.mgrid[0 : shape[0], 0 : shape[1]]
+    frames = []
+    for i in range(num_frames):
+        frame = background + rng.normal(0, 5, shape)
+        for blob in range(3):
+            centre_x = (i * (blob + 1) * 2 + blob * shape[1] // 3) % shape[1]
+            centre_y = (blob + 1) * shape[0] // 4
+            radius = shape[0] / 12
+            frame += 200 * np.exp(
+                -((x - centre_x) ** 2 + (y - centre_y) ** 2) / (2 * radius**2)
+            )
+        frames.append(np.uint16(frame))
+    return np.float64(background), frames
+
+
+def allocating_filter(tracker, clip, thermal):
+    """The filtering and detection before the workspace was added"""
+    filtered = np.float32(thermal.copy())
+    avg_change = int(round(np.average(thermal) - clip.stats.mean_background_value))
+    np.clip(filtered - clip.background - avg_change, 0, None, out=filtered)
+    filtered, stats = normalize(filtered, new_max=255)
+    if tracker.config.denoise:
+        filtered = cv2.fastNlMeansDenoising(np.uint8(filtered), None)
+    if stats[1] == stats[2]:
+        threshold = clip.background_thresh
+    else:
+        threshold = clip.background_thresh / (stats[1] - stats[2]) * 255
+    detected = detect_objects(
+        filtered.copy(), otsus=False, threshold=threshold, kernel=(5, 5)
+    )
+    return filtered, detected
+
+
+def workspace_filter(tracker, clip, thermal):
+    filtered, threshold = tracker._get_filtered_frame(clip, thermal)
+    detected = detect_objects(
+        filtered,
+        otsus=False,
+        threshold=threshold,
+        kernel=(5, 5),
+        workspace=clip.workspace,
+    )
+    return filtered, detected
+
+
+def same_result(expected, actual):
+    if not np.array_equal(expected[0], actual[0]):
+        return False
+    return all(np.array_equal(e, a) for e, a in zip(expected[1], actual[1]))
+
+
+def main():
+    args = parse_args()
+    init_logging()
+    config = Config.get_defaults()
+    tracker = ClipTrackExtractor(config.tracking, False, keep_frames=False)
+    if args.no_denoise:
+        tracker.config.denoise = False
+    for name, shape in RESOLUTIONS.items():
+        background, frames = make_frames(shape, args.frames, args.seed)
+        clip = Clip(config.tracking["thermal"], None, background=background)
+        clip.stats.mean_background_value = np.average(background)
+        clip.background_thresh = 20
+
+        allocating_time = 0
+        workspace_time = 0
+        mismatches = 0
+        for frame in frames:
+            start = time.time()
+            expected = allocating_filter(tracker, clip, frame)
+            allocating_time += time.time() - start
+            start = time.time()
+            actual = workspace_filter(tracker, clip, frame)
+            workspace_time += time.time() - start
+            if not same_result(expected, actual):
+                mismatches += 1
+        if mismatches > 0:
+            logging.error("%s %s frames don't match", name, mismatches)
+        logging.info(
+            "%s %sx%s denoise %s: allocating %.3fms per frame, workspace %.3fms per frame, speed up %.2fx",
+            name,
+            shape[1],
+            shape[0],
+            tracker.config.denoise,
+            1000 * allocating_time / len(frames),
+            1000 * workspace_time / len(frames),
+            allocating_time / workspace_time,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Times re-segmenting every track of a dataset with each segment type.
+
+python -m benchmark.segments path/to/dataset.hdf5
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from benchmark.topmass import load_tracks
+from track_extraction.config.config import Config
+from track_extraction.ml_tools.dataset import Dataset
+from track_extraction.ml_tools.datasetstructures import SegmentType
+from track_extraction.ml_tools.logs import init_logging
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("database", help="Track database to load tracks from")
+    parser.add_argument("-c", "--config-file", help="Path to config file to use")
+    parser.add_argument(
+        "--repeats", type=int, default=5, help="Times to segment each track"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_args()
+    init_logging()
+    if args.config_file:
+        config = Config.load_from_file(args.config_file)
+    else:
+        config = Config.get_defaults()
+    dataset = Dataset(args.database, "benchmark", config)
+    tracks = load_tracks(dataset)
+    logging.info("Segmenting %s tracks", len(tracks))
+    np.random.seed(args.seed)
+    for segment_type in SegmentType:
+        num_segments = 0
+        start = time.time()
+        for _ in range(args.repeats):
+            for track in tracks:
+                segment_frame_spacing = int(
+                    round(dataset.segment_spacing * track.frames_per_second)
+                )
+                track.calculate_segments(
+                    segment_frame_spacing,
+                    dataset.segment_length,
+                    segment_type,
+                    segment_min_mass=dataset.segment_min_avg_mass,
+                )
+                num_segments += len(track.segments)
+        took = time.time() - start
+        logging.info(
+            "%s: %s segments %.3fs %.1f tracks/s",
+            segment_type.name,
+            num_segments // args.repeats,
+            took,
+            args.repeats * len(tracks) / max(took, 1e-6),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Times reading batches of thermal tf records, with the original pipeline which
+augments and tiles each record in its map function and with the pipeline of
+thermaldataset which augments and tiles whole batches, and checks both give the
+same images without augmentation.
+
+python -m benchmark.tfdata path/to/training-data/train --labels 7
+"""
+
+import argparse
+import logging
+import time
+from functools import partial
+
+import numpy as np
+import tensorflow as tf
+
+from track_extraction.ml_tools import thermaldataset
+from track_extraction.ml_tools.logs import init_logging
+from track_extraction.ml_tools.shardindex import UINT8_ENCODING, load_schema
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("records", help="Directory of thermal tf records")
+    parser.add_argument(
+        "--labels", type=int, required=True, help="Number of labels of the records"
+    )
+    parser.add_argument("--batch-size", type=int, default=32, help="Batch size")
+    parser.add_argument(
+        "--batches", type=int, default=200, help="Batches to time each pipeline over"
+    )
+    args = parser.parse_args()
+    return args
+
+
+def per_record_read(example, num_labels, augment, encoding):
+    """The original thermaldataset.read_tfrecord of images and labels"""
+    if encoding == UINT8_ENCODING:
+        image_feature = tf.io.FixedLenFeature((), tf.string)
+    else:
+        image_feature = tf.io.FixedLenFeature([25 * 32 * 32], dtype=tf.float32)
+    tfrecord_format = {
+        "image/class/label": tf.io.FixedLenFeature((), tf.int64, -1),
+        "image/thermalencoded": image_feature,
+        "image/filteredencoded": image_feature,
+    }
+    example = tf.io.parse_single_example(example, tfrecord_format)
+    thermalencoded = example["image/thermalencoded"]
+    filteredencoded = example["image/filteredencoded"]
+    if encoding == UINT8_ENCODING:
+        thermalencoded = tf.cast(tf.io.decode_raw(thermalencoded, tf.uint8), tf.float32)
+        filteredencoded = tf.cast(
+            tf.io.decode_raw(filteredencoded, tf.uint8), tf.float32
+        )
+    thermals = tf.reshape(thermalencoded, [25, 32, 32, 1])
+    filtered = tf.reshape(filteredencoded, [25, 32, 32, 1])
+    rgb_images = tf.concat((thermals, thermals, filtered), axis=3)
+    rotation_augmentation = tf.keras.Sequential(
+        [
+            tf.keras.layers.RandomRotation(0.1, fill_mode="nearest", fill_value=0),
+        ]
+    )
+    if augment:
+        rgb_images = rotation_augmentation(rgb_images)
+    image = per_record_tile(rgb_images)
+    if augment:
+        data_augmentation = tf.keras.Sequential(
+            [
+                tf.keras.layers.RandomFlip("horizontal"),
+                tf.keras.layers.RandomBrightness(0.2),
+                tf.keras.layers.RandomContrast(0.5),
+            ]
+        )
+        image = data_augmentation(image)
+    label = tf.cast(example["image/class/label"], tf.int32)
+    return image, tf.one_hot(label, num_labels)
+
+
+def per_record_tile(images):
+    """The original thermaldataset.tile_images"""
+    index = 0
+    image = None
+    for x in range(5):
+        t_row = tf.concat(tf.unstack(images[index : index + 5]), axis=1)
+        if image is None:
+            image = t_row
+        else:
+            image = tf.concat([image, t_row], 0)
+        index += 5
+    return image
+
+
+def per_record_dataset(filenames, args, augment):
+    encoding, compression = load_schema(filenames)
+    dataset = tf.data.TFRecordDataset(filenames, compression_type=compression)
+    dataset = dataset.map(
+        partial(
+            per_record_read,
+            num_labels=args.labels,
+            augment=augment,
+            encoding=encoding,
+        ),
+        num_parallel_calls=AUTOTUNE,
+        deterministic=True,
+    )
+    dataset = dataset.batch(args.batch_size)
+    return dataset.prefetch(buffer_size=AUTOTUNE)
+
+
+def per_batch_dataset(filenames, args, augment):
+    dataset = thermaldataset.load_dataset(
+        filenames,
+        args.labels,
+        {"image_size": (160, 160), "deterministic": True},
+    )
+    dataset = dataset.batch(args.batch_size)
+    augmentation = thermaldataset.augmentation_layers() if augment else None
+    dataset = thermaldataset.prepare_dataset(dataset, True, False, augmentation)
+    return dataset.prefetch(buffer_size=AUTOTUNE)
+
+
+def time_dataset(dataset, batches):
+    """Returns records per second read from dataset, after a batch to warm up"""
+    iterator = iter(dataset.repeat())
+    next(iterator)
+    records = 0
+    start = time.time()
+    for _ in range(batches):
+        x, y = next(iterator)
+        records += len(y)
+    return records / max(time.time() - start, 1e-6)
+
+
+def main():
+    args = parse_args()
+    init_logging()
+    filenames = tf.io.gfile.glob(f"{args.records}/*.tfrecord")
+    # labels are read unchanged
+    thermaldataset.remapped_y = tf.lookup.StaticHashTable(
+        initializer=tf.lookup.KeyValueTensorInitializer(
+            keys=tf.range(args.labels), values=tf.range(args.labels)
+        ),
+        default_value=tf.constant(-1),
+    )
+    logging.info("Reading %s shards in batches of %s", len(filenames), args.batch_size)
+
+    expected, _ = next(iter(per_record_dataset(filenames, args, False)))
+    actual, _ = next(iter(per_batch_dataset(filenames, args, False)))
+    if not np.array_equal(expected.numpy(), actual.numpy()):
+        logging.error("Tiled images don't match")
+
+    for augment in [False, True]:
+        for name, get_dataset in [
+            ("per record", per_record_dataset),
+            ("per batch", per_batch_dataset),
+        ]:
+            rate = time_dataset(get_dataset(filenames, args, augment), args.batches)
+            logging.info(
+                "%s augment %s: %.1f records/s",
+                name,
+                augment,
+                rate,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Times get_top_mass_segments for every track of a dataset against the original
+per window implementation, and checks both choose the same segments.
+
+python -m benchmark.topmass path/to/dataset.hdf5
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from track_extraction.config.config import Config
+from track_extraction.ml_tools.dataset import Dataset
+from track_extraction.ml_tools.datasetstructures import (
+    get_movement_data,
+    get_top_mass_segments,
+    TrackHeader,
+)
+from track_extraction.ml_tools.logs import init_logging
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("database", help="Track database to load tracks from")
+    parser.add_argument("-c", "--config-file", help="Path to config file to use")
+    parser.add_argument(
+        "--repeats", type=int, default=5, help="Times to choose each track's segments"
+    )
+    args = parser.parse_args()
+    return args
+
+
+def window_top_mass(
+    segment_width,
+    segment_frame_spacing,
+    mass_history,
+    ffc_frames,
+    regions,
+    start_frame,
+    lower_mass,
+    segment_min_mass,
+    ignore_mass=False,
+):
+    """The original selection, returns (start index, mass, best mass) of each segment"""
+    segments = []
+    segment_mass = []
+    for i in range(max(1, len(mass_history) - segment_width)):
+        contains_ffc = False
+        for z in range(segment_width):
+            if (z + i + start_frame) in ffc_frames:
+                contains_ffc = True
+                break
+        if contains_ffc:
+            continue
+        mass = np.sum(mass_history[i : i + segment_width])
+        segment_mass.append((i, mass))
+
+    sorted_mass = sorted(segment_mass, key=lambda x: x[1], reverse=True)
+    best_mass = True
+    segment_count = max(1, len(regions) // segment_frame_spacing)
+    segment_count = int(min(len(sorted_mass), segment_count))
+
+    for _ in range(segment_count):
+        segment_info = sorted_mass[0]
+        index = segment_info[0]
+        avg_mass = segment_info[1] / segment_width
+        if not best_mass and (
+            ignore_mass or (avg_mass < lower_mass or avg_mass < segment_min_mass)
+        ):
+            break
+        get_movement_data(regions[index : index + segment_width])
+        segments.append((index, segment_info[1], best_mass))
+        best_mass = False
+        sorted_mass = [
+            mass_info
+            for mass_info in sorted_mass
+            if mass_info[0] <= (index - segment_width / 3 * 2)
+            or mass_info[0] >= (index + segment_width / 3 * 2)
+        ]
+        if len(segments) == segment_count or len(sorted_mass) == 0:
+            break
+    return segments
+
+
+def load_tracks(dataset):
+    tracks = []
+    db = dataset.db
+    with db.session():
+        for clip_id in db.get_all_clip_ids():
+            clip_meta = db.get_clip_meta(clip_id)
+            for track_meta in db.get_clip_tracks(clip_id):
+                if not dataset.filter_track(clip_meta, track_meta):
+                    tracks.append(TrackHeader.from_meta(clip_id, clip_meta, track_meta))
+    return tracks
+
+
+def main():
+    args = parse_args()
+    init_logging()
+    if args.config_file:
+        config = Config.load_from_file(args.config_file)
+    else:
+        config = Config.get_defaults()
+    dataset = Dataset(args.database, "benchmark", config)
+    tracks = load_tracks(dataset)
+    segment_width = dataset.segment_length
+    segment_min_mass = dataset.segment_min_avg_mass or 1
+    logging.info("Choosing top mass segments for %s tracks", len(tracks))
+
+    window_time = 0
+    vectorised_time = 0
+    mismatches = 0
+    num_segments = 0
+    for track in tracks:
+        segment_frame_spacing = int(
+            round(dataset.segment_spacing * track.frames_per_second)
+        )
+        regions = np.array(track.bounds_history)
+        mass_history = np.uint16([region.mass for region in regions])
+        shared = (
+            segment_width,
+            segment_frame_spacing,
+            mass_history,
+            track.ffc_frames,
+            regions,
+            track.start_frame,
+        )
+        start = time.time()
+        for _ in range(args.repeats):
+            expected = window_top_mass(*shared, track.lower_mass, segment_min_mass)
+        window_time += time.time() - start
+
+        start = time.time()
+        for _ in range(args.repeats):
+            segments, _ = get_top_mass_segments(
+                track.clip_id,
+                track.track_id,
+                track.label,
+                track.frame_temp_median,
+                track.camera,
+                segment_width,
+                segment_frame_spacing,
+                mass_history,
+                track.ffc_frames,
+                regions,
+                track.start_frame,
+                track.start_time,
+                track.lower_mass,
+                segment_min_mass,
+            )
+        vectorised_time += time.time() - start
+
+        actual = [
+            (
+                segment.frame_indices[0] - track.start_frame,
+                segment.mass,
+                segment.best_mass,
+            )
+            for segment in segments
+        ]
+        num_segments += len(actual)
+        if actual != expected:
+            mismatches += 1
+            logging.error("Track %s segments don't match", track.unique_id)
+
+    logging.info("%s segments, %s tracks didn't match", num_segments, mismatches)
+    for name, took in [("per window", window_time), ("vectorised", vectorised_time)]:
+        logging.info(
+            "%s: %.3fs %.1f tracks/s",
+            name,
+            took,
+            args.repeats * len(tracks) / max(took, 1e-6),
+        )
+    logging.info("vectorised speed up %.1fx", window_time / max(vectorised_time, 1e-6))
+
+
+if __name__ == "__main__":
+    main()
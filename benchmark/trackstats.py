@@ -0,0 +1,80 @@
+"""
+Tracks cptv clips then times calculating the movement statistics of every track,
+one track at a time with the original per frame implementation and for all tracks
+of a clip with track_movement_statistics, and checks both give the same statistics.
+
+python -m benchmark.trackstats tests/clips/*.cptv
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from track_extraction.config.config import Config
+from track_extraction.load.clip import Clip
+from track_extraction.load.cliptrackextractor import ClipTrackExtractor
+from track_extraction.ml_tools.logs import init_logging
+from track_extraction.track.test_track import frame_stats
+from track_extraction.track.track import track_movement_statistics
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("clips", nargs="+", help="CPTV files to track")
+    parser.add_argument("-c", "--config-file", help="Path to config file to use")
+    parser.add_argument(
+        "--repeats", type=int, default=20, help="Times to calculate each clip's stats"
+    )
+    args = parser.parse_args()
+    return args
+
+
+def load_tracks(config, filename):
+    """Tracks a clip and returns every trimmed track, including filtered ones"""
+    extractor = ClipTrackExtractor(config.tracking, False, keep_frames=False)
+    clip = Clip(config.tracking["thermal"], filename)
+    extractor.parse_clip(clip)
+    return clip.tracks + [track for _, track in clip.filtered_tracks]
+
+
+def main():
+    args = parse_args()
+    init_logging()
+    if args.config_file:
+        config = Config.load_from_file(args.config_file)
+    else:
+        config = Config.get_defaults()
+    clips = [load_tracks(config, filename) for filename in args.clips]
+    num_tracks = sum(len(tracks) for tracks in clips)
+    logging.info("Calculating stats of %s tracks", num_tracks)
+
+    start = time.time()
+    for _ in range(args.repeats):
+        per_frame = [[frame_stats(track) for track in tracks] for tracks in clips]
+    frame_time = time.time() - start
+
+    start = time.time()
+    for _ in range(args.repeats):
+        per_clip = [track_movement_statistics(tracks) for tracks in clips]
+    clip_time = time.time() - start
+
+    mismatches = 0
+    for expected, actual in zip(per_frame, per_clip):
+        for e, a in zip(expected, actual):
+            if not np.allclose(e, a, rtol=1e-12, atol=0, equal_nan=True):
+                mismatches += 1
+                logging.error("Stats don't match %s %s", e, a)
+    logging.info("%s tracks stats didn't match", mismatches)
+    for name, took in [("per frame", frame_time), ("per clip", clip_time)]:
+        logging.info(
+            "%s: %.3fs %.1f tracks/s",
+            name,
+            took,
+            args.repeats * num_tracks / max(took, 1e-6),
+        )
+
+
+if __name__ == "__main__":
+    main()
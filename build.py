@@ -75,6 +75,24 @@ def parse_args():
         action="count",
         help="Balance labels so that they have are distributed as defined in config",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Processes used to load clips and write tf records (Default number of cpus)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed for shuffling and augmenting tf records, records are the same for a seed",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=["GZIP", "ZLIB"],
+        default=None,
+        help="Compress the tf records",
+    )
 
     args = parser.parse_args()
     if args.date:
@@ -101,10 +119,8 @@ def parse_args():
 
 def show_tracks_breakdown(dataset):
     print("Tracks breakdown:")
-    samples = dataset.samples
-
     for label in dataset.labels:
-        lbl_samples = dataset.samples_by_label.get(label, [])
+        lbl_samples = dataset.samples_for(label)
         tracks = [s.unique_track_id for s in lbl_samples]
         tracks = set(tracks)
         print("labels are", label)
@@ -134,7 +150,7 @@ def show_cameras_breakdown(dataset):
 def show_samples_breakdown(dataset):
     print("Samples breakdown:")
     for label in dataset.labels:
-        count = len(dataset.samples_by_label.get(label, []))
+        count = dataset.count_for(label)
         print("  {:<20} {} Samples".format(label, count))
 
 
@@ -173,7 +189,7 @@ def print_counts(dataset, train, validation, test):
 
 def split_label(dataset, label, existing_test_count=0, max_samples=None):
     # split a label from dataset such that vlaidation is 15% or MIN_TRACKS
-    samples = dataset.samples_by_label.get(label, [])
+    samples = dataset.samples_for(label)
     if max_samples is not None:
         samples = np.random.choice(
             samples, min(len(samples), max_samples), replace=False
@@ -277,8 +293,8 @@ def get_test_set_camera(dataset, test_clips, after_date):
         or after_date is not None
         and sample.start_time.replace(tzinfo=pytz.utc) > after_date
     ]
+    dataset.remove_samples(test_samples)
     for sample in test_samples:
-        dataset.remove_sample(sample)
         test_c.add_sample(sample)
     return test_c
 
@@ -297,13 +313,13 @@ def split_randomly(db_file, dataset, config, args, test_clips=[], balance_bins=T
     train_cameras = []
     min_label = None
     for label in dataset.labels:
-        label_count = len(dataset.samples_by_label.get(label, []))
+        label_count = dataset.count_for(label)
         if label not in ["insect", "false-positive"]:
             continue
         if min_label is None or label_count < min_label[1]:
             min_label = (label, label_count)
     for label in dataset.labels:
-        existing_test_count = len(test.samples_by_label.get(label, []))
+        existing_test_count = test.count_for(label)
         train_c, validate_c, test_c = split_label(
             dataset,
             label,
@@ -348,7 +364,7 @@ def validate_datasets(datasets, test_clips, date):
             assert track.start_time < date
 
     for i, dataset in enumerate(datasets):
-        clips = set([sample.clip_id for sample in dataset.samples])
+        clips = set(dataset.sample_table.rows["clip_id"])
         if test_clips is not None and dataset.name != "test":
             assert (
                 len(clips.intersection(set(test_clips))) == 0
@@ -358,7 +374,7 @@ def validate_datasets(datasets, test_clips, date):
         for other in datasets[(i + 1) :]:
             if dataset.name == other.name:
                 continue
-            other_clips = set([sample.clip_id for sample in other.samples])
+            other_clips = set(other.sample_table.rows["clip_id"])
             # other_tracks = set([track.track_id for track in other.tracks])
 
             assert clips != other_clips, "clips should only be in one set"
@@ -377,12 +393,12 @@ def main():
         db_file, "dataset", config, consecutive_segments=args.consecutive_segments
     )
 
-    tracks_loaded, total_tracks = dataset.load_clips()
+    tracks_loaded, total_tracks = dataset.load_clips(workers=args.workers)
     # return
     dataset.labels.sort()
     print(
         "Loaded {}/{} tracks, found {:.1f}k samples".format(
-            tracks_loaded, total_tracks, len(dataset.samples) / 1000
+            tracks_loaded, total_tracks, dataset.sample_count / 1000
         )
     )
     for key, value in dataset.filtered_stats.items():
@@ -444,11 +460,19 @@ def main():
     for dataset in datasets:
         dir = os.path.join(record_dir, dataset.name)
         create_tf_records(
-            dataset, dir, datasets[0].labels, threshold, num_shards=100, by_label=False
+            dataset,
+            dir,
+            datasets[0].labels,
+            threshold,
+            num_shards=100,
+            by_label=False,
+            workers=args.workers,
+            seed=args.seed,
+            compression=args.compression,
         )
         counts = {}
         for label in dataset.labels:
-            count = len(dataset.samples_by_label.get(label, []))
+            count = dataset.count_for(label)
             counts[label] = count
         dataset_counts[dataset.name] = counts
         # dataset.saveto_numpy(os.path.join(base_dir))
@@ -1,12 +1,14 @@
-import gc
+import itertools
 import json
 import logging
 import os.path
 import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
 import numpy as np
 
 import cv2
+from classify.modelcache import ModelCache
 from classify.trackprediction import Predictions
 from load.clip import Clip
 from load.cliptrackextractor import ClipTrackExtractor, is_affected_by_ffc
@@ -45,20 +47,24 @@ class ClipClassifier:
 
         self.previewer = Previewer.create_if_required(config, config.classify.preview)
 
-        self.models = {}
+        # loaded classifiers stay resident between clips
+        self.models = ModelCache(
+            config.classify.max_resident_models, config.classify.max_model_memory
+        )
 
     def load_models(self):
         for model in self.config.classify.models:
-            classifier = self.get_classifier(model)
-            self.models[model.id] = classifier
+            self.get_classifier(model)
 
     def get_classifier(self, model):
         """
         Returns a classifier object, which is created on demand.
         This means if the ClipClassifier is copied to a new process a new Classifier instance will be created.
         """
-        if model.id in self.models:
-            return self.models[model.id]
+        classifier, _ = self.models.get(model.id, lambda: self.load_classifier(model))
+        return classifier
+
+    def load_classifier(self, model):
         load_start = time.time()
         logging.info("classifier loading %s", model.model_file)
         if model.type == ForestModel.TYPE:
@@ -68,8 +74,6 @@ class ClipClassifier:
             classifier.load_model(model.model_file, weights=model.model_weights)
             classifier.model.summary()
         logging.info("classifier loaded (%s)", time.time() - load_start)
-        self.models[model.id] = classifier
-
         return classifier
 
     def get_meta_data(self, filename):
@@ -100,16 +104,86 @@ class ClipClassifier:
         else:
             return None
 
-    def process(self, source, cache=None, reuse_frames=None):
+    def process(self, source, cache=None, reuse_frames=None, workers=None):
         # IF passed a dir extract all cptv files, if a cptv just extract this cptv file
-        if os.path.isfile(source):
-            self.process_file(source, cache=cache, reuse_frames=reuse_frames)
-            return
-        for folder_path, _, files in os.walk(source):
-            for name in files:
-                if os.path.splitext(name)[1] in [".mp4", ".cptv", ".avi"]:
-                    full_path = os.path.join(folder_path, name)
-                    self.process_file(full_path, cache=cache, reuse_frames=reuse_frames)
+        try:
+            if os.path.isfile(source):
+                self.process_file(source, cache=cache, reuse_frames=reuse_frames)
+                return
+            file_paths = []
+            for folder_path, _, files in os.walk(source):
+                for name in files:
+                    if os.path.splitext(name)[1] in [".mp4", ".cptv", ".avi"]:
+                        file_paths.append(os.path.join(folder_path, name))
+            if workers is not None and workers > 1:
+                self.process_parallel(
+                    file_paths, workers, cache=cache, reuse_frames=reuse_frames
+                )
+                return
+            for full_path in file_paths:
+                self.process_file(full_path, cache=cache, reuse_frames=reuse_frames)
+        finally:
+            logging.info(
+                "Loaded models %s times, reused %s times, load seconds per model %s",
+                self.models.loads,
+                self.models.hits,
+                self.models.load_times,
+            )
+            self.models.clear()
+
+    def process_parallel(self, file_paths, workers, cache=None, reuse_frames=None):
+        """
+        Tracks files in worker processes while this process classifies them.  Tracked
+        clips are classified together once batch_size tracks or workers clips are waiting,
+        and each clip's results are saved as soon as it is classified
+        """
+        stats = ProcessStats()
+        tracked = []
+        files = iter(file_paths)
+        with ProcessPoolExecutor(
+            workers, initializer=init_worker, initargs=(self.config, cache)
+        ) as pool:
+            # keep a few files queued per worker, so tracked clips don't pile up in
+            # memory when classifying is slower than tracking
+            pending = set(
+                pool.submit(track_job, filename)
+                for filename in itertools.islice(files, workers * 2)
+            )
+            while len(pending) > 0:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    filename = next(files, None)
+                    if filename is not None:
+                        pending.add(pool.submit(track_job, filename))
+                    result, tracking_time = future.result()
+                    stats.tracking_time += tracking_time
+                    if result is None:
+                        continue
+                    tracked.append(result)
+                    stats.clips += 1
+                    stats.frames += result[0].current_frame + 1
+                    waiting_tracks = sum(len(clip.tracks) for clip, _ in tracked)
+                    if (
+                        len(tracked) >= workers
+                        or waiting_tracks >= self.config.classify.batch_size
+                    ):
+                        self.classify_tracked(tracked, stats, reuse_frames)
+                        tracked = []
+            if len(tracked) > 0:
+                self.classify_tracked(tracked, stats, reuse_frames)
+        stats.log(workers)
+
+    def classify_tracked(self, tracked, stats, reuse_frames=None):
+        start = time.time()
+        predictions_per_clip = self.classify_clips(tracked, reuse_frames=reuse_frames)
+        stats.classify_time += time.time() - start
+        stats.tracks += sum(len(clip.tracks) for clip, _ in tracked)
+        start = time.time()
+        for (clip, meta_data), predictions_per_model in zip(
+            tracked, predictions_per_clip
+        ):
+            self.save_results(clip, meta_data, predictions_per_model)
+        stats.save_time += time.time() - start
 
     def process_file(self, filename, cache=None, reuse_frames=None):
         """
@@ -117,6 +191,20 @@ class ClipClassifier:
         :param filename: filename to process
         :param enable_preview: if true an MPEG preview file is created.
         """
+        tracked = self.track_file(filename, cache)
+        if tracked is None:
+            return False
+        clip, meta_data = tracked
+        predictions_per_model = self.classify_clips(
+            [tracked], reuse_frames=reuse_frames
+        )[0]
+        return self.save_results(clip, meta_data, predictions_per_model)
+
+    def track_file(self, filename, cache=None):
+        """
+        Extracts tracks from a file
+        :return: (clip, meta_data) or None if the file can't be tracked
+        """
         _, ext = os.path.splitext(filename)
         cache_to_disk = (
             cache if cache is not None else self.config.classify.cache_to_disk
@@ -132,39 +220,30 @@ class ClipClassifier:
             logging.info("Using ir extractor")
         else:
             logging.error("Unknown extention %s", ext)
-            return False
-        base_filename = os.path.splitext(os.path.basename(filename))[0]
-        meta_file = os.path.join(os.path.dirname(filename), base_filename + ".txt")
+            return None
+        meta_file = get_meta_file(filename)
         if not os.path.exists(filename):
             logging.error("File %s not found.", filename)
-            return False
+            return None
         if not os.path.exists(meta_file):
             logging.error("File %s not found.", meta_file)
-            return False
+            return None
         meta_data = tools.load_clip_metadata(meta_file)
 
         logging.info("Processing file '{}'".format(filename))
 
-        start = time.time()
         clip = Clip(track_extractor.config, filename)
         clip.load_metadata(
             meta_data,
             self.config.load.tag_precedence,
         )
         track_extractor.parse_clip(clip)
+        return clip, meta_data
 
-        predictions_per_model = {}
-        if self.model:
-            prediction = self.classify_clip(
-                clip, self.model, meta_data, reuse_frames=reuse_frames
-            )
-            predictions_per_model[self.model.id] = prediction
-        else:
-            for model in self.config.classify.models:
-                prediction = self.classify_clip(
-                    clip, model, meta_data, reuse_frames=reuse_frames
-                )
-                predictions_per_model[model.id] = prediction
+    def save_results(self, clip, meta_data, predictions_per_model):
+        filename = clip.source_file
+        base_filename = os.path.splitext(os.path.basename(filename))[0]
+        meta_file = get_meta_file(filename)
         destination_folder = os.path.dirname(filename)
         dirname = destination_folder
 
@@ -185,57 +264,104 @@ class ClipClassifier:
             predictions_per_model,
             models,
         )
-        if cache_to_disk:
-            clip.frame_buffer.remove_cache()
+        clip.frame_buffer.remove_cache()
         return meta_data
 
-    def classify_clip(self, clip, model, meta_data, reuse_frames=None):
-        start = time.time()
-        classifier = self.get_classifier(model)
-        predictions = Predictions(classifier.labels, model)
-        predictions.model_load_time = time.time() - start
+    def classify_clips(self, clips, reuse_frames=None):
+        """
+        Classifies tracked clips with each model
+        :param clips: list of (clip, meta_data)
+        :return: a dictionary of model id to Predictions for each clip
+        """
+        models = [self.model] if self.model else self.config.classify.models
+        predictions_per_clip = [{} for _ in clips]
+        for model in models:
+            model_predictions = self.classify_model_clips(clips, model, reuse_frames)
+            for predictions_per_model, predictions in zip(
+                predictions_per_clip, model_predictions
+            ):
+                predictions_per_model[model.id] = predictions
+        return predictions_per_clip
 
-        for i, track in enumerate(clip.tracks):
+    def classify_clip(self, clip, model, meta_data, reuse_frames=None):
+        return self.classify_model_clips([(clip, meta_data)], model, reuse_frames)[0]
 
-            segment_frames = None
-            if reuse_frames and classifier.type == "thermal":
-                tracks = meta_data.get("tracks")
-                meta_track = next(
-                    (x for x in tracks if x["id"] == track.get_id()), None
-                )
-                previous_predictions = meta_track.get("predictions")
-                if previous_predictions is not None:
-                    previous_prediction = next(
-                        (x for x in previous_predictions if x["model_id"] == model.id),
-                        None,
-                    )
-                    if previous_prediction is not None:
-                        logging.info("Reusing previous prediction frames %s", model)
-
-                        segment_frames = previous_prediction.get("prediction_frames")
-                        if segment_frames is not None:
-                            segment_frames = np.uint16(segment_frames)
-            prediction = classifier.classify_track(
-                clip, track, segment_frames=segment_frames
+    def classify_model_clips(self, clips, model, reuse_frames=None):
+        """
+        Classifies the tracks of clips with model, keras models predict on the segments
+        of all tracks together
+        :param clips: list of (clip, meta_data)
+        :return: Predictions for each clip
+        """
+        # other threads can't release keras memory while the model predicts
+        with self.models.job():
+            classifier, load_time = self.models.get(
+                model.id, lambda: self.load_classifier(model)
             )
-            if prediction is not None:
-                predictions.prediction_per_track[track.get_id()] = prediction
-                description = prediction.description()
-                logging.info(
-                    " - [{}/{}] prediction: {}".format(
-                        i + 1, len(clip.tracks), description
+            start = time.time()
+            clip_tracks = []
+            for clip, meta_data in clips:
+                for track in clip.tracks:
+                    segment_frames = None
+                    if reuse_frames and classifier.type == "thermal":
+                        segment_frames = self.previous_segment_frames(
+                            meta_data, track, model
+                        )
+                    clip_tracks.append((clip, track, segment_frames))
+            if model.type == ForestModel.TYPE:
+                track_predictions = [
+                    classifier.classify_track(
+                        clip, track, segment_frames=segment_frames
                     )
+                    for clip, track, segment_frames in clip_tracks
+                ]
+            else:
+                track_predictions = classifier.classify_tracks(
+                    clip_tracks, batch_size=self.config.classify.batch_size
                 )
+
+        track_predictions = iter(track_predictions)
+        clip_predictions = []
+        for clip, _ in clips:
+            predictions = Predictions(classifier.labels, model)
+            # only the first clip waited for the model to load
+            predictions.model_load_time = load_time
+            load_time = 0
+            for i, track in enumerate(clip.tracks):
+                prediction = next(track_predictions)
+                if prediction is not None:
+                    predictions.prediction_per_track[track.get_id()] = prediction
+                    description = prediction.description()
+                    logging.info(
+                        " - [{}/{}] prediction: {}".format(
+                            i + 1, len(clip.tracks), description
+                        )
+                    )
+            clip_predictions.append(predictions)
         if self.config.verbose:
-            ms_per_frame = (
-                (time.time() - start) * 1000 / max(1, len(clip.frame_buffer.frames))
-            )
+            frames = sum(len(clip.frame_buffer.frames) for clip, _ in clips)
+            ms_per_frame = (time.time() - start) * 1000 / max(1, frames)
             logging.info("Took {:.1f}ms per frame".format(ms_per_frame))
-        tools.clear_session()
-        del classifier
-        gc.collect()
+        return clip_predictions
 
-        return predictions
+    def previous_segment_frames(self, meta_data, track, model):
+        """Segment frames this model predicted on last time, from the clip's metadata"""
+        tracks = meta_data.get("tracks")
+        meta_track = next((x for x in tracks if x["id"] == track.get_id()), None)
+        previous_predictions = meta_track.get("predictions")
+        if previous_predictions is None:
+            return None
+        previous_prediction = next(
+            (x for x in previous_predictions if x["model_id"] == model.id),
+            None,
+        )
+        if previous_prediction is None:
+            return None
+        logging.info("Reusing previous prediction frames %s", model)
+        segment_frames = previous_prediction.get("prediction_frames")
+        if segment_frames is not None:
+            segment_frames = np.uint16(segment_frames)
+        return segment_frames
 
     def save_metadata(
         self,
@@ -271,6 +397,7 @@ class ClipClassifier:
             model_dic["classify_time"] = round(
                 model_predictions.classify_time + model_predictions.model_load_time, 1
             )
+            model_dic["model_load_time"] = round(model_predictions.model_load_time, 1)
             model_dictionaries.append(model_dic)
 
         meta_data["models"] = model_dictionaries
@@ -280,3 +407,69 @@ class ClipClassifier:
             with open(meta_filename, "w") as f:
                 json.dump(meta_data, f, indent=4, cls=tools.CustomJSONEncoder)
         return meta_data
+
+
+class ProcessStats:
+    """Throughput of each stage when classifying files in parallel"""
+
+    def __init__(self):
+        self.start = time.time()
+        self.clips = 0
+        self.frames = 0
+        self.tracks = 0
+        self.tracking_time = 0
+        self.classify_time = 0
+        self.save_time = 0
+
+    def log(self, workers):
+        total_time = time.time() - self.start
+        logging.info(
+            "Tracking: %s clips %s frames in %.1fs worker time, %.1f frames/s per worker",
+            self.clips,
+            self.frames,
+            self.tracking_time,
+            self.frames / max(self.tracking_time, 1e-6),
+        )
+        logging.info(
+            "Classifying: %s tracks in %.1fs, %.1f tracks/s",
+            self.tracks,
+            self.classify_time,
+            self.tracks / max(self.classify_time, 1e-6),
+        )
+        logging.info("Saving: %s clips in %.1fs", self.clips, self.save_time)
+        logging.info(
+            "Processed %s clips with %s workers in %.1fs, %.2f clips/s",
+            self.clips,
+            workers,
+            total_time,
+            self.clips / max(total_time, 1e-6),
+        )
+
+
+def get_meta_file(filename):
+    return os.path.splitext(filename)[0] + ".txt"
+
+
+worker_classifier = None
+worker_cache = None
+
+
+def init_worker(config, cache):
+    global worker_classifier
+    global worker_cache
+    worker_classifier = ClipClassifier(config)
+    worker_cache = cache
+
+
+def track_job(filename):
+    """Tracks a file in a worker process, returns ((clip, meta_data), seconds taken)"""
+    start = time.time()
+    try:
+        tracked = worker_classifier.track_file(filename, worker_cache)
+    except:
+        logging.error("Error tracking %s", filename, exc_info=True)
+        tracked = None
+    if tracked is not None:
+        # open files can't be sent back to the main process
+        tracked[0].frame_buffer.close_cache()
+    return tracked, time.time() - start
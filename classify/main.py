@@ -70,6 +70,12 @@ def main():
         default=None,
         help="Dont keep video frames in memory for classification later, but cache them to disk (Best for large videos, but slower)",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Track files in this many worker processes when classifying a folder",
+    )
     args = parser.parse_args()
     config = Config.load_from_file(args.config_file)
     config.validate()
@@ -99,6 +105,7 @@ def main():
         args.source,
         cache=args.cache,
         reuse_frames=args.reuse_prediction_frames,
+        workers=args.workers,
     )
 
 
@@ -0,0 +1,131 @@
+import gc
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import psutil
+
+from ml_tools import tools
+
+
+class ModelCache:
+    """
+    Keeps loaded classifiers resident between clips.  Least recently used models are
+    unloaded once more than max_models are resident, or when the process memory
+    goes over max_memory_mb after loading a model.
+    Memory freed by unloading a model isn't always given back to the os, so the
+    process memory is taken to drop by what the model added when it was loaded.
+    The cache can be shared by threads, unloaded models are only released from keras
+    once no thread is running a job with the models.
+    """
+
+    def __init__(self, max_models=None, max_memory_mb=None):
+        self.max_models = max_models
+        self.max_memory_mb = max_memory_mb
+        self.models = OrderedDict()
+        self.loads = 0
+        self.hits = 0
+        # seconds spent loading each model, across all of its loads
+        self.load_times = {}
+        # MB the process memory grew by loading each resident model
+        self.model_memory = {}
+        self.lock = threading.Lock()
+        # number of jobs using models and if models were unloaded while they ran
+        self.jobs = 0
+        self.release_pending = False
+
+    @contextmanager
+    def job(self):
+        """Marks that models are in use, so unloaded models aren't released meanwhile"""
+        with self.lock:
+            self.jobs += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.jobs -= 1
+                self._release_if_idle()
+
+    def get(self, model_id, load):
+        """
+        Returns the classifier for model_id, calling load() to create it if it isn't resident
+        :return: (classifier, seconds spent loading it on this call)
+        """
+        with self.lock:
+            return self._get(model_id, load)
+
+    def _get(self, model_id, load):
+        if model_id in self.models:
+            self.models.move_to_end(model_id)
+            self.hits += 1
+            return self.models[model_id], 0
+        memory_start = memory_mb()
+        load_start = time.time()
+        classifier = load()
+        load_time = time.time() - load_start
+        self.loads += 1
+        self.load_times[model_id] = self.load_times.get(model_id, 0) + load_time
+        self.model_memory[model_id] = max(0, memory_mb() - memory_start)
+        self.models[model_id] = classifier
+        self._evict(keep=model_id)
+        return classifier, load_time
+
+    def evict(self, keep=None):
+        """Unloads least recently used models until within max_models and max_memory_mb"""
+        with self.lock:
+            self._evict(keep)
+
+    def _evict(self, keep=None):
+        memory = memory_mb()
+        unloaded = False
+        while len(self.models) > 1 and self.over_limit(memory):
+            model_id = next(iter(self.models))
+            if model_id == keep:
+                self.models.move_to_end(model_id)
+                model_id = next(iter(self.models))
+            logging.info("Unloading model %s", model_id)
+            del self.models[model_id]
+            memory -= self.model_memory.pop(model_id, 0)
+            unloaded = True
+        if unloaded:
+            self.release_pending = True
+            self._release_if_idle()
+
+    def over_limit(self, memory):
+        if self.max_models is not None and len(self.models) > self.max_models:
+            return True
+        return self.max_memory_mb is not None and memory > self.max_memory_mb
+
+    def clear(self):
+        with self.lock:
+            if len(self.models) == 0:
+                return
+            self.models.clear()
+            self.model_memory.clear()
+            self.release_pending = True
+            self._release_if_idle()
+
+    def _release_if_idle(self):
+        if self.release_pending and self.jobs == 0:
+            self.release_pending = False
+            self.release()
+
+    def release(self):
+        """Frees the memory of unloaded models, including keras' graph memory"""
+        tools.clear_session()
+        gc.collect()
+
+    def __contains__(self, model_id):
+        return model_id in self.models
+
+    def __len__(self):
+        return len(self.models)
+
+    def __getitem__(self, model_id):
+        return self.models[model_id]
+
+
+def memory_mb():
+    return psutil.Process().memory_info().rss / (1024 * 1024)
@@ -0,0 +1,80 @@
+import threading
+
+from classify import modelcache
+from classify.modelcache import ModelCache
+
+
+class TestModelCache:
+    def test_least_recently_used_unloaded(self, monkeypatch):
+        monkeypatch.setattr(modelcache.tools, "clear_session", lambda: None)
+        cache = ModelCache(max_models=2)
+        for model_id in [1, 2, 1, 3, 1]:
+            cache.get(model_id, object)
+        assert list(cache.models) == [3, 1]
+        assert cache.loads == 3
+        assert cache.hits == 2
+
+    def test_memory_ceiling_keeps_latest(self, monkeypatch):
+        monkeypatch.setattr(modelcache.tools, "clear_session", lambda: None)
+        cache = ModelCache(max_memory_mb=1)
+        for model_id in [1, 2]:
+            _, load_time = cache.get(model_id, object)
+            assert load_time >= 0
+        assert list(cache.models) == [2]
+        assert set(cache.load_times) == {1, 2}
+
+    def test_memory_not_returned_to_os(self, monkeypatch):
+        # each model adds 100MB, which the process keeps after it is unloaded
+        memory = [100]
+        releases = []
+
+        def load():
+            memory[0] += 100
+            return object()
+
+        monkeypatch.setattr(modelcache, "memory_mb", lambda: memory[0])
+        monkeypatch.setattr(
+            modelcache.tools, "clear_session", lambda: releases.append(1)
+        )
+        cache = ModelCache(max_memory_mb=350)
+        for model_id in [1, 2, 3]:
+            cache.get(model_id, load)
+        assert list(cache.models) == [2, 3]
+        assert len(releases) == 1
+
+    def test_release_waits_for_jobs(self, monkeypatch):
+        releases = []
+        monkeypatch.setattr(
+            modelcache.tools, "clear_session", lambda: releases.append(1)
+        )
+        cache = ModelCache(max_models=1)
+        with cache.job():
+            cache.get(1, object)
+            with cache.job():
+                # another job unloads the model the first is using
+                cache.get(2, object)
+            assert list(cache.models) == [2]
+            assert releases == []
+        assert releases == [1]
+        cache.clear()
+        assert releases == [1, 1]
+
+    def test_threads_share_cache(self, monkeypatch):
+        monkeypatch.setattr(modelcache.tools, "clear_session", lambda: None)
+        cache = ModelCache(max_models=2)
+
+        def run(model_ids):
+            for model_id in model_ids:
+                with cache.job():
+                    cache.get(model_id, object)
+
+        threads = [
+            threading.Thread(target=run, args=([1, 2, 3] * 200,)) for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(cache) == 2
+        assert cache.loads + cache.hits == 4 * 600
+        assert cache.jobs == 0
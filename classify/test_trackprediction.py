@@ -0,0 +1,49 @@
+import numpy as np
+
+from classify.trackprediction import TrackPrediction
+
+LABELS = ["bird", "cat", "false-positive", "rodent"]
+
+
+def scan_scores(prediction, frame_number):
+    """Scores of every prediction starting at or before frame_number"""
+    started = [
+        smoothed
+        for frames, smoothed in zip(
+            prediction.prediction_frames, prediction.smoothed_predictions
+        )
+        if np.amin(frames) <= frame_number
+    ]
+    if len(started) == 0:
+        return None
+    scores = np.sum(started, axis=0)
+    return scores / np.sum(scores)
+
+
+class TestTrackPrediction:
+    def test_scores_at_time_match_scan(self):
+        rng = np.random.default_rng(3)
+        prediction = TrackPrediction(1, LABELS, start_frame=10)
+        for frame in rng.permutation(np.arange(10, 60, 3)):
+            prediction.classified_frames(
+                list(range(frame, frame + 5)), rng.random(len(LABELS)), 20
+            )
+        for frame in range(0, 70):
+            expected = scan_scores(prediction, frame)
+            if expected is None:
+                assert prediction.score_at_time(frame) == 0
+                assert prediction.label_at_time(frame) == 0
+                continue
+            for n in [1, 2]:
+                assert np.isclose(
+                    prediction.score_at_time(frame, n), np.sort(expected)[-n]
+                )
+                assert prediction.label_at_time(frame, n) == np.argsort(expected)[-n]
+
+    def test_adding_prediction_resets_timeline(self):
+        prediction = TrackPrediction(1, LABELS, start_frame=0)
+        prediction.classified_frame(5, np.array([0.1, 0.7, 0.1, 0.1]), 10)
+        assert prediction.label_at_time(5) == 1
+        prediction.classified_frame(6, np.array([0.9, 0.0, 0.1, 0.0]), 100)
+        assert prediction.label_at_time(5) == 1
+        assert prediction.label_at_time(6) == 0
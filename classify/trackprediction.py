@@ -81,6 +81,8 @@ class TrackPrediction:
         self.labels = labels
         self.classify_time = None
         self.tracking = False
+        # index for scores at a frame, reset when predictions are added
+        self.timeline = None
 
     def classified_clip(
         self,
@@ -88,6 +90,7 @@ class TrackPrediction:
         smoothed_predictions,
         prediction_frames,
     ):
+        self.timeline = None
         self.num_frames_classified = len(predictions)
         self.smoothed_predictions = smoothed_predictions
         self.predictions = predictions
@@ -107,6 +110,7 @@ class TrackPrediction:
             )
 
     def classified_frames(self, frame_numbers, prediction, mass):
+        self.timeline = None
         self.num_frames_classified += len(frame_numbers)
         smoothed_prediction = prediction**2 * mass
         if self.keep_all:
@@ -124,6 +128,7 @@ class TrackPrediction:
             self.class_best_score += smoothed_prediction
 
     def classified_frame(self, frame_number, prediction, mass):
+        self.timeline = None
         self.prediction_frames.append([frame_number])
         self.last_frame_classified = frame_number
         self.num_frames_classified += 1
@@ -137,7 +142,7 @@ class TrackPrediction:
             self.smoothed_predictions = [smoothed_prediction]
 
         if self.class_best_score is None:
-            self.class_best_score = smoothed_prediction
+            self.class_best_score = smoothed_prediction.copy()
         else:
             self.class_best_score += smoothed_prediction
 
@@ -278,51 +283,54 @@ class TrackPrediction:
             return None
         return float(sorted(self.class_best_score)[-n])
 
-    def label_at_time(self, frame_number, n=1):
-        """class label of nth best guess at a point in time."""
-        if n is None:
+    def prediction_timeline(self):
+        """
+        First frame of each prediction in frame order, with the cumulative sum of the
+        smoothed predictions up to and including each.  Built when first needed after
+        the predictions change.
+        """
+        if self.timeline is None:
+            first_frames = np.array(
+                [np.amin(frames) for frames in self.prediction_frames]
+            )
+            order = np.argsort(first_frames, kind="stable")
+            cumulative = np.cumsum(
+                np.asarray(self.smoothed_predictions, dtype=np.float64)[order], axis=0
+            )
+            self.timeline = (first_frames[order], cumulative)
+        return self.timeline
+
+    def scores_at_time(self, frame_number):
+        """normalized class scores of predictions starting at or before frame_number"""
+        if len(self.smoothed_predictions) == 0:
+            return None
+        first_frames, cumulative = self.prediction_timeline()
+        if frame_number is None:
+            count = len(first_frames)
+        else:
+            count = np.searchsorted(first_frames, frame_number, side="right")
+        if count == 0:
             return None
-        frames_per_prediction = len(self.smoothed_predictions) / self.num_frames
-        prediction_index = int(frame_number / frames_per_prediction) + 1
-        average = np.mean(self.smoothed_predictions[:prediction_index], axis=0)
-        return int(np.argsort(average)[-n])
+        class_best_score = cumulative[count - 1]
+        return class_best_score / np.sum(class_best_score)
 
     def label_at_time(self, frame_number, n=1):
-        """class prediction of nth best at a point in time."""
+        """class label of nth best guess at a point in time."""
         if n is None:
             return None
-        predictions = []
-        class_best_score = None
-        for i, frames in enumerate(self.prediction_frames):
-            a_min = np.amin(frames)
-            a_max = np.amax(frames)
-
-            if a_min <= frame_number:
-                predictions.append(self.smoothed_predictions[i])
-        class_best_score = np.sum(predictions, axis=0)
-        if len(predictions) == 0:
+        class_best_score = self.scores_at_time(frame_number)
+        if class_best_score is None:
             return 0
-        class_best_score = class_best_score / np.sum(class_best_score)
         return int(np.argsort(class_best_score)[-n])
 
     def score_at_time(self, frame_number, n=1):
         """class prediction of nth best at a point in time."""
         if n is None:
             return None
-        predictions = []
-        class_best_score = None
-        for i, frames in enumerate(self.prediction_frames):
-            a_min = np.amin(frames)
-            a_max = np.amax(frames)
-
-            if a_min <= frame_number:
-                predictions.append(self.smoothed_predictions[i])
-        class_best_score = np.sum(predictions, axis=0)
-        if len(predictions) == 0:
+        class_best_score = self.scores_at_time(frame_number)
+        if class_best_score is None:
             return 0
-
-        class_best_score = class_best_score / np.sum(class_best_score)
-        return float(sorted(class_best_score)[-n])
+        return float(np.sort(class_best_score)[-n])
 
     def print_prediction(self):
         logging.info(
@@ -58,7 +58,7 @@ class ClassifyService:
         sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         sock.bind(self.config.classify.service_socket)
         sock.listen(1)
-        self.clip_classifier.models = {}
+        self.clip_classifier.models.clear()
         self.clip_classifier.load_models()
 
         while True:
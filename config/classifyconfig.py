@@ -34,6 +34,9 @@ class ClassifyConfig(DefaultConfig):
     preview = attr.ib()
     cache_to_disk = attr.ib()
     service_socket = attr.ib()
+    max_resident_models = attr.ib()
+    max_model_memory = attr.ib()
+    batch_size = attr.ib()
 
     @classmethod
     def load(cls, classify):
@@ -45,6 +48,9 @@ class ClassifyConfig(DefaultConfig):
             ),
             cache_to_disk=classify["cache_to_disk"],
             service_socket=classify["service_socket"],
+            max_resident_models=classify["max_resident_models"],
+            max_model_memory=classify["max_model_memory"],
+            batch_size=classify["batch_size"],
         )
 
     def load_models(raw):
@@ -65,6 +71,9 @@ class ClassifyConfig(DefaultConfig):
             preview="none",
             cache_to_disk=False,
             service_socket="/etc/cacophony/classifier",
+            max_resident_models=4,
+            max_model_memory=None,
+            batch_size=32,
         )
 
     def validate(self):
@@ -172,6 +172,8 @@ class TrackingConfig(DefaultConfig):
                 "max_blanks": 18,
                 "velocity_multiplier": 2,
                 "base_velocity": 2,
+                # greedy or optimal matching of tracks to regions
+                "assignment": "greedy",
             },
             filter_regions_pre_match=True,
         )
@@ -196,6 +198,7 @@ class TrackingConfig(DefaultConfig):
                 "max_blanks": 18,
                 "velocity_multiplier": 8,
                 "base_velocity": 10,
+                "assignment": "greedy",
             }
         return default_tracking
 
@@ -3,6 +3,17 @@ import numpy as np
 
 
 class Kalman:
+    STATE = [
+        "statePre",
+        "statePost",
+        "errorCovPre",
+        "errorCovPost",
+        "transitionMatrix",
+        "measurementMatrix",
+        "processNoiseCov",
+        "measurementNoiseCov",
+    ]
+
     def __init__(self):
         self.reset_kalman()
 
@@ -24,3 +35,12 @@ class Kalman:
             [np.float32(rect.centroid[0]), np.float32(rect.centroid[1])], np.float32
         )
         self.kalman.correct(pts)
+
+    def __getstate__(self):
+        # cv2 filters can't be pickled, so save their matrices instead
+        return {name: getattr(self.kalman, name) for name in Kalman.STATE}
+
+    def __setstate__(self, state):
+        self.reset_kalman()
+        for name, value in state.items():
+            setattr(self.kalman, name, value)
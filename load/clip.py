@@ -25,7 +25,11 @@ import os
 import pytz
 import cv2
 
-from track_extraction.ml_tools.imageprocessing import normalize, detect_objects
+from track_extraction.ml_tools.imageprocessing import (
+    normalize,
+    detect_objects,
+    FrameWorkspace,
+)
 from track_extraction.ml_tools.tools import Rectangle
 from track_extraction.track.framebuffer import FrameBuffer
 from track_extraction.track.track import Track
@@ -36,6 +40,68 @@ RES_X = 160
 RES_Y = 120
 
 
+class BackgroundEstimator:
+    """
+    Streams frames into the clip background calculation.  Frames are summed in groups
+    of group_size, the background is the minimum of the group averages and initial_diff
+    the maximum amount each group average is below the first.  Buffers are allocated
+    on the first frame and updated in place after that.
+    """
+
+    GROUP_SIZE = 9
+
+    def __init__(self, group_size=GROUP_SIZE):
+        # None averages all frames as one group
+        self.group_size = group_size
+        self.groups = 0
+        self.count = 0
+        self.last_frame = None
+        self.sum = None
+        self.average = None
+        self.background = None
+        self.initial_frames = None
+        self.initial_diff = None
+        self.diff = None
+
+    def _allocate(self, shape):
+        # 9 uint16 frames sum exactly in float32, an unbounded group needs float64
+        self.sum = np.zeros(shape, np.float32 if self.group_size else np.float64)
+        self.average = np.empty(shape, np.float64)
+        self.background = np.empty(shape, np.float64)
+        self.initial_frames = np.empty(shape, np.float64)
+        self.initial_diff = np.zeros(shape, np.float64)
+        self.diff = np.empty(shape, np.float64)
+
+    def add_frame(self, frame, ffc_affected=False):
+        self.last_frame = frame
+        if ffc_affected:
+            return
+        if self.sum is None:
+            self._allocate(frame.shape)
+        np.add(self.sum, frame, out=self.sum)
+        self.count += 1
+        if self.count == self.group_size:
+            self._end_group()
+
+    def _end_group(self):
+        np.divide(self.sum, self.count, out=self.average, dtype=np.float64)
+        if self.groups == 0:
+            np.copyto(self.background, self.average)
+            np.copyto(self.initial_frames, self.average)
+        else:
+            np.minimum(self.background, self.average, out=self.background)
+            np.subtract(self.initial_frames, self.average, out=self.diff)
+            np.maximum(self.initial_diff, self.diff, out=self.initial_diff)
+        self.groups += 1
+        self.sum.fill(0)
+        self.count = 0
+
+    def finish(self):
+        """Adds any partial group, call once all frames have been added"""
+        if self.count > 0:
+            self._end_group()
+
+
 class Clip:
     PREVIEW = "preview"
     FRAMES_PER_SECOND = 9
@@ -94,6 +160,8 @@ class Clip:
         self.ffc_frames = []
         self.tags = None
         self.type = type
+        # buffers reused by the tracker for each frame
+        self.workspace = None
         # sets defaults
         self.set_model(model)
         if background is not None:
@@ -140,21 +208,6 @@ class Clip:
             self._background = np.minimum(self._background, frame)
         self.background_frames += 1
 
-    def calculate_initial_diff(self, frame, initial_frames, initial_diff):
-        """Compare this frame with the initial frames (to detect movement) and update the initial_diff
-        frame (such that it is the maximum difference). This is essentially creating a frame which has
-        all the warms moving parts from the initial frame
-        """
-        if initial_frames is None:
-            return np.zeros((frame.shape))
-        else:
-            diff = initial_frames - frame
-            if initial_diff is not None:
-                initial_diff = np.maximum(initial_diff, diff)
-            else:
-                initial_diff = diff
-        return initial_diff
-
     def calculate_background(self, frame_reader):
         """
         Calculate background by reading whole clip and grouping into sets of
@@ -163,60 +216,43 @@ class Clip:
         Also check for animals in the background by checking for connected components in
         the intital_diff frame - this is the maximum change between first average frame and all other average frames in the clip
         """
-        frames = []
         if frame_reader.background_frames > 0:
+            estimator = BackgroundEstimator(group_size=None)
             for frame in frame_reader:
                 if frame.background_frame:
-                    frames.append(frame.pix)
+                    estimator.add_frame(frame.pix)
                 else:
                     break
-            frame_average = np.average(frames, axis=0)
-            self.update_background(frame_average)
+            estimator.finish()
+            self.update_background(estimator.background)
             self._background_calculated()
             return
 
-        initial_frames = None
-        initial_diff = None
-        first_frame = None
+        estimator = BackgroundEstimator()
         for frame in frame_reader:
-            if first_frame is None:
-                first_frame = frame.pix
-            ffc_affected = is_affected_by_ffc(frame)
-            if ffc_affected:
-                continue
-            frames.append(frame.pix)
-            if len(frames) == 9:
-                frame_average = np.average(frames, axis=0)
-                self.update_background(frame_average)
-                initial_diff = self.calculate_initial_diff(
-                    frame_average, initial_frames, initial_diff
-                )
-                if initial_frames is None:
-                    initial_frames = frame_average
-
-                frames = []
-
-        if len(frames) > 0:
-            frame_average = np.average(frames, axis=0)
-            if initial_frames is None:
-                initial_frames = frame_average
-            self.update_background(frame_average)
-            initial_diff = self.calculate_initial_diff(
-                frame_average, initial_frames, initial_diff
-            )
+            estimator.add_frame(frame.pix, is_affected_by_ffc(frame))
+        self.finish_background(estimator)
 
-            if initial_frames is None:
-                initial_frames = frame_average
-        frames = []
-        if initial_diff is None:
-            if first_frame is not None:
+    def finish_background(self, estimator):
+        """
+        Sets the background from a BackgroundEstimator which has been given the clip's frames,
+        so the background can be calculated incrementally as frames arrive
+        """
+        estimator.finish()
+        if estimator.groups == 0:
+            if estimator.last_frame is not None:
                 # fall back if whole clip is ffc
-                self.update_background(frame.pix)
+                self.update_background(np.array(estimator.last_frame))
                 self._background_calculated()
             return
+        initial_diff = estimator.initial_diff
         np.clip(initial_diff, 0, None, out=initial_diff)
-        initial_frames = self.remove_background_animals(initial_frames, initial_diff)
-
+        initial_frames = self.remove_background_animals(
+            estimator.initial_frames, initial_diff
+        )
+        if estimator.groups > 1:
+            self.update_background(estimator.background)
+        # with one group the background is the initial frames, animals removed
         self.update_background(initial_frames)
         self._background_calculated()
 
@@ -389,6 +425,11 @@ class Clip:
         for track in self.tracks:
             track.crop_rectangle = self.crop_rectangle
 
+    def get_workspace(self, shape):
+        if self.workspace is None or self.workspace.shape != shape:
+            self.workspace = FrameWorkspace(shape)
+        return self.workspace
+
     def _set_crop_rectangle(self):
 
         edge = self.config.edge_pixels
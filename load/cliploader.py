@@ -115,6 +115,10 @@ class ClipLoader:
         # overwrite any old clips.
         # Note: we do this even if there are no tracks so there there will be a blank clip entry as a record
         # that we have processed it.
+        with self.database.session("a"):
+            self._write_tracks(clip)
+
+    def _write_tracks(self, clip):
         self.database.create_clip(clip)
         for track in clip.tracks:
             start_time, end_time = clip.start_and_end_time_absolute(
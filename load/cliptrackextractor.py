@@ -22,6 +22,7 @@ import time
 import yaml
 from cptv import CPTVReader
 from .clip import Clip
+from .framestack import CPTVFrameStack
 from track_extraction.piclassifier.motiondetector import is_affected_by_ffc
 from track_extraction.ml_tools.imageprocessing import detect_objects, normalize
 from track_extraction.track.cliptracker import ClipTracker
@@ -53,6 +54,7 @@ class ClipTrackExtractor(ClipTracker):
         high_quality_optical_flow=False,
         verbose=False,
         do_tracking=True,
+        single_pass=True,
     ):
         super().__init__(
             config,
@@ -64,6 +66,9 @@ class ClipTrackExtractor(ClipTracker):
         )
         self.use_opt_flow = use_opt_flow
         self.high_quality_optical_flow = high_quality_optical_flow
+        # decode the cptv once into a frame stack, rather than once for the
+        # background and again for tracking
+        self.single_pass = single_pass
         # self.cache_to_disk = cache_to_disk
         # self.max_tracks = config.max_tracks
         # # frame_padding < 3 causes problems when we get small areas...
@@ -111,14 +116,23 @@ class ClipTrackExtractor(ClipTracker):
 
             video_start_time = reader.timestamp.astimezone(Clip.local_tz)
             clip.set_video_stats(video_start_time)
-            clip.calculate_background(reader)
-
-        with open(clip.source_file, "rb") as f:
-            reader = CPTVReader(f)
-            for frame in reader:
-                if not process_background and frame.background_frame:
-                    continue
-                self.process_frame(clip, frame.pix, is_affected_by_ffc(frame))
+            if self.single_pass:
+                frames = CPTVFrameStack(reader, memmap=self.cache_to_disk)
+            else:
+                clip.calculate_background(reader)
+
+        if self.single_pass:
+            try:
+                clip.calculate_background(frames)
+                self._process_frames(clip, frames, process_background)
+            finally:
+                frames.close()
+        else:
+            with open(clip.source_file, "rb") as f:
+                reader = CPTVReader(f)
+                self._process_frames(clip, reader, process_background)
+        # only needed while tracking
+        clip.workspace = None
 
         if not clip.from_metadata and self.do_tracking:
             self.apply_track_filtering(clip)
@@ -128,6 +142,12 @@ class ClipTrackExtractor(ClipTracker):
         self._tracking_time = time.time() - start
         return True
 
+    def _process_frames(self, clip, frames, process_background=False):
+        for frame in frames:
+            if not process_background and frame.background_frame:
+                continue
+            self.process_frame(clip, frame.pix, is_affected_by_ffc(frame))
+
     @property
     def tracking_time(self):
         return self._tracking_time
@@ -150,7 +170,11 @@ class ClipTrackExtractor(ClipTracker):
         mask = None
         if self.do_tracking:
             _, mask, component_details, centroids = detect_objects(
-                filtered.copy(), otsus=False, threshold=threshold, kernel=(5, 5)
+                filtered,
+                otsus=False,
+                threshold=threshold,
+                kernel=(5, 5),
+                workspace=clip.workspace,
             )
         cur_frame = clip.add_frame(thermal, filtered, mask, ffc_affected)
         if not self.do_tracking:
@@ -0,0 +1,116 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import tempfile
+import numpy as np
+from cptv import Frame
+
+
+class CPTVFrameStack:
+    """
+    Decodes every frame of a cptv file once into a single uint16 array so that
+    background calculation and tracking can both iterate over the same frames.
+    Iterating yields cptv Frame objects whose pix is a view into the stack, so it
+    can be used anywhere a CPTVReader is iterated.
+    """
+
+    # frames to allocate when the cptv header doesn't specify the frame count
+    INITIAL_FRAMES = 256
+
+    def __init__(self, reader, memmap=False):
+        self.background_frames = reader.background_frames
+        self.frame_dim = reader.frame_dim
+        self.memmap_file = None
+        self.time_on = []
+        self.last_ffc_time = []
+        self.temp_c = []
+        self.last_ffc_temp_c = []
+        self.background_frame = []
+        if memmap:
+            try:
+                self._read_to_memmap(reader)
+            except:
+                self.close()
+                raise
+        else:
+            self._read_to_memory(reader)
+
+    def _add_meta(self, frame):
+        self.time_on.append(frame.time_on)
+        self.last_ffc_time.append(frame.last_ffc_time)
+        self.temp_c.append(frame.temp_c)
+        self.last_ffc_temp_c.append(frame.last_ffc_temp_c)
+        self.background_frame.append(frame.background_frame)
+
+    def _read_to_memory(self, reader):
+        capacity = reader.num_frames or CPTVFrameStack.INITIAL_FRAMES
+        frames = np.empty((capacity, *self.frame_dim), dtype=np.uint16)
+        num_frames = 0
+        for frame in reader:
+            if num_frames == len(frames):
+                grown = np.empty((len(frames) * 2, *self.frame_dim), dtype=np.uint16)
+                grown[:num_frames] = frames
+                frames = grown
+            frames[num_frames] = frame.pix
+            self._add_meta(frame)
+            num_frames += 1
+        self.frames = frames[:num_frames]
+
+    def _read_to_memmap(self, reader):
+        fd, self.memmap_file = tempfile.mkstemp(suffix=".frames")
+        num_frames = 0
+        with os.fdopen(fd, "wb") as f:
+            for frame in reader:
+                f.write(np.ascontiguousarray(frame.pix, dtype=np.uint16).tobytes())
+                self._add_meta(frame)
+                num_frames += 1
+        if num_frames == 0:
+            self.frames = np.empty((0, *self.frame_dim), dtype=np.uint16)
+            return
+        self.frames = np.memmap(
+            self.memmap_file,
+            dtype=np.uint16,
+            mode="r",
+            shape=(num_frames, *self.frame_dim),
+        )
+
+    def close(self):
+        """Releases the frames, and deletes the memmap file if one was used"""
+        self.frames = None
+        if self.memmap_file is not None:
+            os.remove(self.memmap_file)
+            self.memmap_file = None
+
+    def __len__(self):
+        return len(self.background_frame)
+
+    def __getitem__(self, i):
+        return Frame(
+            self.frames[i],
+            self.time_on[i],
+            self.last_ffc_time[i],
+            self.temp_c[i],
+            self.last_ffc_temp_c[i],
+            self.background_frame[i],
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
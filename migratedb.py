@@ -0,0 +1,44 @@
+"""
+Converts a track database to the current storage layout, writing the result
+to a new file.
+"""
+
+import argparse
+import os
+
+from ml_tools.logs import init_logging
+from ml_tools import tools
+from ml_tools.trackdatabase import migrate_database
+from config.config import Config
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config-file", help="Path to config file to use")
+    parser.add_argument(
+        "--source", help="Database to migrate, defaults to the config tracks folder"
+    )
+    parser.add_argument(
+        "--destination",
+        help="File to write the migrated database to, defaults to migrated.hdf5 next to the source",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_args()
+    init_logging()
+    config = Config.load_from_file(args.config_file)
+    source = args.source
+    if source is None:
+        source = os.path.join(config.tracks_folder, "dataset.hdf5")
+    destination = args.destination
+    if destination is None:
+        destination = os.path.join(os.path.dirname(source), "migrated.hdf5")
+    compression = tools.gzip_compression if config.load.enable_compression else None
+    migrate_database(source, destination, compression)
+
+
+if __name__ == "__main__":
+    main()
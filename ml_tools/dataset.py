@@ -6,19 +6,69 @@ Dataset used for training a tensorflow model from track data.
 
 Tracks are broken into segments.  Filtered, and then passed to the trainer using a weighted random sample.
 
+Samples are held in a SampleTable, lists of sample objects by label or bin are only
+made when asked for.  Frame samples are read into tables without making an object
+for each frame.
+
 """
 import logging
 import math
+import multiprocessing
 import os
 import time
 import numpy as np
 import gc
-from ml_tools.datasetstructures import TrackHeader, TrackingSample, SegmentType
+from ml_tools.datasetstructures import (
+    TrackHeader,
+    TrackingSample,
+    SegmentType,
+    frame_bin_id,
+)
+from ml_tools.sampletable import SampleTable
 from ml_tools.trackdatabase import TrackDatabase
 from ml_tools import tools
 from track.region import Region
 import json
 
+# set in each worker process by init_worker
+worker_dataset = None
+
+
+def init_worker(dataset):
+    global worker_dataset
+    worker_dataset = dataset
+
+
+def load_clip_samples(job):
+    """
+    Filters and samples the tracks of one clip with worker_dataset
+    :param job: ((clip_id, clip meta, list of track meta), seed)
+    :return: samples, number of tracks filtered, filtered stats
+    """
+    (clip_id, clip_meta, tracks), seed = job
+    # segments are chosen at random, seeding each clip means they don't depend on
+    # which process loads the clip
+    np.random.seed(seed)
+    worker_dataset.filtered_stats = empty_filtered_stats()
+    samples, filtered = worker_dataset.clip_samples(clip_id, clip_meta, tracks)
+    return samples, filtered, worker_dataset.filtered_stats
+
+
+def empty_filtered_stats():
+    return {
+        "confidence": 0,
+        "trap": 0,
+        "banned": 0,
+        "date": 0,
+        "tags": 0,
+        "segment_mass": 0,
+        "no_data": 0,
+        "not-confirmed": 0,
+        "tag_names": set(),
+        "notags": 0,
+        "bad_track_json": 0,
+    }
+
 
 class Dataset:
     """
@@ -45,10 +95,9 @@ class Dataset:
         # name of this dataset
         self.name = name
         # list of our tracks
-        self.samples_by_label = {}
-        self.samples_by_bin = {}
-        self.samples = []
-        self.sample_cdf = []
+        self.sample_table = SampleTable()
+        self.sample_cdf = np.empty(0)
+        self.sample_label_cdf = {}
         self.tracks = []
         self.tracks_by_label = {}
         self.tracks_by_bin = {}
@@ -90,19 +139,7 @@ class Dataset:
             self.segment_min_avg_mass = None
             self.min_frame_mass = 16
             self.segment_type = SegmentType.ALL_RANDOM
-        self.filtered_stats = {
-            "confidence": 0,
-            "trap": 0,
-            "banned": 0,
-            "date": 0,
-            "tags": 0,
-            "segment_mass": 0,
-            "no_data": 0,
-            "not-confirmed": 0,
-            "tag_names": set(),
-            "notags": 0,
-            "bad_track_json": 0,
-        }
+        self.filtered_stats = empty_filtered_stats()
         self.lbl_p = None
         self.numpy_data = None
 
@@ -115,7 +152,36 @@ class Dataset:
 
     @property
     def sample_count(self):
-        return len(self.samples)
+        return len(self.sample_table)
+
+    @property
+    def samples(self):
+        return self.sample_table.samples()
+
+    @samples.setter
+    def samples(self, samples):
+        self.set_samples(samples)
+
+    @property
+    def samples_by_label(self):
+        """
+        Lists of the samples of each label, made on every call so use samples_for or
+        count_for when only one label is needed
+        """
+        table = self.sample_table
+        labels, rows = table.group_rows("label")
+        return {
+            table.labels[label]: table.samples(label_rows)
+            for label, label_rows in zip(labels, rows)
+        }
+
+    @property
+    def samples_by_bin(self):
+        table = self.sample_table
+        bins, rows = table.group_rows("bin")
+        return {
+            table.bins[b]: table.samples(bin_rows) for b, bin_rows in zip(bins, rows)
+        }
 
     #
     # def samples(self):
@@ -124,25 +190,28 @@ class Dataset:
     #     return self.frame_samples
 
     def set_samples(self, samples):
-        self.samples = samples
+        self.sample_table = SampleTable()
+        self.sample_table.extend(samples)
 
     def set_samples_for(self, label, samples):
-        self.samples_by_label[label] = samples
+        table = self.sample_table
+        table.keep(table.label != table.label_index(label))
+        table.extend(samples)
 
     def get_label_caps(self, labels, remapped=False):
         counts = []
         for label in labels:
-            counts.append(len(self.samples_for(label, remapped=remapped)))
+            counts.append(self.count_for(label, remapped=remapped))
         index = math.floor(len(counts) * 0.40)
         counts.sort()
-        birds = self.samples_for("bird", remapped=remapped)
-        if len(birds) > 0:
-            return len(birds)
+        birds = self.count_for("bird", remapped=remapped)
+        if birds > 0:
+            return birds
 
         return counts[index]
 
-    def samples_for(self, label, remapped=False):
-        labels = []
+    def labels_for(self, label, remapped=False):
+        """Returns the labels of samples which are counted as label"""
         if remapped and self.label_mapping:
             labels = [
                 key
@@ -150,12 +219,22 @@ class Dataset:
                 if mapped.lower() == label.lower()
             ]
             labels.sort()
-        else:
-            labels.append(label)
-        samples = []
-        for l in labels:
-            samples.extend(self.samples_by_label.get(l, []))
-        return samples
+            return labels
+        return [label]
+
+    def rows_for(self, label, remapped=False):
+        """Returns the sample table rows of label"""
+        return self.sample_table.label_rows(self.labels_for(label, remapped=remapped))
+
+    def count_for(self, label, remapped=False):
+        """Returns the number of samples of label"""
+        return sum(
+            self.sample_table.label_count(key)
+            for key in self.labels_for(label, remapped=remapped)
+        )
+
+    def samples_for(self, label, remapped=False):
+        return self.sample_table.samples(self.rows_for(label, remapped=remapped))
 
     def get_counts(self, label):
         """
@@ -172,7 +251,7 @@ class Dataset:
                 if key == label or value == label:
                     label_tracks = self.tracks_by_label.get(key, [])
                     tracks += len(label_tracks)
-                    samples_count += len(self.samples_by_label.get(key, []))
+                    samples_count += self.count_for(key)
                     # segments += sum(len(track.segments) for track in label_tracks)
                     # frames += sum(
                     #     len(track.get_sample_frames())
@@ -187,11 +266,11 @@ class Dataset:
                     segments_count += len(segments)
                     frames += sum([segment.frames for segment in segments])
         else:
-            samples = self.samples_by_label.get(label, [])
-            tracks = len(set([sample.track_id for sample in samples]))
+            rows = self.sample_table.rows[self.rows_for(label)]
+            tracks = len(np.unique(rows["track_id"]))
             weight = self.get_label_weight(label)
-            bins = len(set([sample.bin_id for sample in samples]))
-            samples_count = len(samples)
+            bins = len(np.unique(rows["bin"]))
+            samples_count = len(rows)
         return samples_count, tracks, bins, weight
 
     def load_clips(
@@ -200,26 +279,101 @@ class Dataset:
         before_date=None,
         after_date=None,
         label=None,
+        workers=None,
     ):
         """
-        Loads track headers from track database with optional filter
+        Loads track headers from track database with optional filter.
+        The metadata of all clips is read with the database open once, and the
+        tracks of each clip are filtered and sampled by a pool of workers. Each clip is
+        sampled with its own seed drawn from np.random and samples are added in the
+        order of the clips, so they don't depend on the number of workers.
+        :param workers: number of worker processes, defaults to the number of cpus,
+        1 loads the clips in this process
         :return: [number of tracks added, total tracks].
         """
         counter = 0
         logging.info("Loading clips")
-        clip_ids = self.db.get_all_clip_ids(before_date, after_date, label)
+        clip_ids = list(self.db.get_all_clip_ids(before_date, after_date, label))
         if shuffle:
             np.random.shuffle(clip_ids)
-        for clip_id in clip_ids:
-            self.load_clip(clip_id)
-            counter += 1
-            if counter % 50 == 0:
-                logging.debug("Dataset loaded %s / %s", counter, len(clip_ids))
+        seeds = np.random.randint(2**31, size=len(clip_ids))
+        rng_state = np.random.get_state()
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = max(1, min(workers, len(clip_ids)))
+        start = time.time()
+        pool = None
+        if workers > 1:
+            # start workers before opening the database
+            pool = multiprocessing.Pool(
+                workers, initializer=init_worker, initargs=(self,)
+            )
+        filtered_stats = self.filtered_stats
+        try:
+            with self.db.session():
+                jobs = zip(self.db.get_clips_meta(clip_ids), seeds)
+                if pool is None:
+                    init_worker(self)
+                    results = map(load_clip_samples, jobs)
+                else:
+                    results = pool.imap(load_clip_samples, jobs, chunksize=8)
+                for samples, _, stats in results:
+                    self.merge_filtered_stats(filtered_stats, stats)
+                    # ids made in the worker processes aren't unique
+                    renumber = pool is not None
+                    if isinstance(samples, SampleTable):
+                        self.add_sample_table(samples, renumber=renumber)
+                        continue
+                    for sample in samples:
+                        if renumber:
+                            sample.renumber()
+                        self.add_clip_sample_mappings(sample)
+                    counter += 1
+                    if counter % 50 == 0:
+                        logging.debug("Dataset loaded %s / %s", counter, len(clip_ids))
+        finally:
+            # load_clip_samples counts the stats of each clip on its own
+            self.filtered_stats = filtered_stats
+            np.random.set_state(rng_state)
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        took = time.time() - start
+        logging.info(
+            "Loaded %s clips with %s workers in %.1fs %.1f clips/s",
+            counter,
+            workers,
+            took,
+            counter / max(took, 1e-6),
+        )
         return [counter, len(clip_ids)]
 
+    def merge_filtered_stats(self, filtered_stats, stats):
+        for key, value in stats.items():
+            if key == "tag_names":
+                filtered_stats[key] |= value
+            else:
+                filtered_stats[key] += value
+
     def load_clip(self, clip_id):
         clip_meta = self.db.get_clip_meta(clip_id)
         tracks = self.db.get_clip_tracks(clip_id)
+        samples, filtered = self.clip_samples(clip_id, clip_meta, tracks)
+        if isinstance(samples, SampleTable):
+            self.add_sample_table(samples)
+        else:
+            for sample in samples:
+                self.add_clip_sample_mappings(sample)
+        return filtered
+
+    def clip_samples(self, clip_id, clip_meta, tracks):
+        """
+        Returns the samples of the tracks of a clip which aren't filtered out, and
+        the number of tracks filtered. Frame samples are returned in a SampleTable
+        rather than as objects
+        """
+        samples = []
+        frame_samples = None
         filtered = 0
         for track_meta in tracks:
             if self.filter_track(clip_meta, track_meta):
@@ -241,21 +395,39 @@ class Dataset:
                 self.filtered_stats["segment_mass"] += track_header.filtered_stats[
                     "segment_mass"
                 ]
-                for segment in track_header.segments:
-                    self.add_clip_sample_mappings(segment)
+                samples.extend(track_header.segments)
             else:
-                sample_frames = track_header.get_sample_frames()
-                skip_x = None
+                if frame_samples is None:
+                    frame_samples = SampleTable()
+                regions, frame_temps, seconds = track_header.sample_frame_columns()
                 if self.type == "IR":
-                    skip_last = int(len(sample_frames) * 0.1)
-                    sample_frames = sample_frames[:-skip_last]
-                for sample in sample_frames:
-                    if not self.filter_by_lq or (
-                        sample.mass >= track_header.lower_mass
-                        and sample.mass <= track_header.upper_mass
-                    ):
-                        self.add_clip_sample_mappings(sample)
-        return filtered
+                    skip_last = int(len(regions) * 0.1)
+                    regions = regions[:-skip_last]
+                keep = np.arange(len(regions))
+                if self.filter_by_lq:
+                    mass = np.array([region.mass for region in regions])
+                    keep = np.flatnonzero(
+                        (mass >= track_header.lower_mass)
+                        & (mass <= track_header.upper_mass)
+                    )
+                regions = [regions[i] for i in keep]
+                track = (
+                    track_header.clip_id,
+                    track_header.track_id,
+                    track_header.camera,
+                    track_header.start_time,
+                )
+                frame_samples.append_frames(
+                    track,
+                    track_header.label,
+                    regions,
+                    np.asarray(frame_temps)[keep],
+                    np.asarray(seconds)[keep],
+                    [frame_bin_id(*track[:2], r.frame_number) for r in regions],
+                )
+        if frame_samples is not None:
+            return frame_samples, filtered
+        return samples, filtered
 
     def add_samples(self, samples):
         """
@@ -281,22 +453,41 @@ class Dataset:
 
         if self.filter_sample(sample):
             return False
-        self.samples.append(sample)
         if self.label_mapping and sample.label in self.label_mapping:
             sample.label = self.mapped_label(sample.label)
 
         if sample.label not in self.labels:
             self.labels.append(sample.label)
 
-        if sample.label not in self.samples_by_label:
-            self.samples_by_label[sample.label] = []
-        self.samples_by_label[sample.label].append(sample)
-
-        bins = self.samples_by_bin.setdefault(sample.bin_id, [])
-        bins.append(sample)
+        self.sample_table.append(sample)
         self.camera_names.add(sample.camera)
         return True
 
+    def add_sample_table(self, table, renumber=False):
+        """
+        Adds the frame samples of a table, filtering and mapping their labels as
+        add_clip_sample_mappings does for each sample
+        :param renumber: give the samples new ids, for tables made in another process
+        """
+        included = np.array(
+            [label in self.included_labels for label in table.labels], dtype=bool
+        )
+        keep = included[table.label]
+        self.filtered_stats["tags"] += int(np.sum(~keep))
+        if self.min_frame_mass:
+            keep &= table.rows["mass"] >= self.min_frame_mass
+        rows = np.flatnonzero(keep)
+        labels, first = np.unique(table.label[rows], return_index=True)
+        for label in labels[np.argsort(first)]:
+            label = self.mapped_label(table.labels[label])
+            if label not in self.labels:
+                self.labels.append(label)
+        for track in np.unique(table.rows["track"][rows]):
+            self.camera_names.add(table.tracks[track][2])
+        self.sample_table.extend_table(
+            table, rows, label_map=self.label_mapping, renumber=renumber
+        )
+
     def add_tracks(self, tracks):
         """
         Adds list of tracks to dataset
@@ -390,14 +581,14 @@ class Dataset:
 
         if (cap_at or cap_samples) and label_cap is None:
             if cap_at:
-                label_cap = len(self.samples_for(cap_at, remapped=True))
+                label_cap = self.count_for(cap_at, remapped=True)
             else:
                 label_cap = self.get_label_caps(labels, remapped=True)
 
         cap = None
         for label in labels:
             if label_cap:
-                cap = min(label_cap, len(self.samples_for(label, remapped=True)))
+                cap = min(label_cap, self.count_for(label, remapped=True))
             if label == "false-positive":
                 if cap is None:
                     cap = int(label_cap * 0.5)
@@ -413,45 +604,43 @@ class Dataset:
         return self.sample_cdf
 
     def label_cdf(self, label):
-        return self.sample_label_cdf.get(label, [])
+        return self.sample_label_cdf.get(label, np.empty(0))
 
     def get_sample(self, cap=None, replace=True, label=None, random=True):
         """Returns a random frames from weighted list."""
         if label:
-            samples = self.samples_for(label, remapped=True)
+            rows = self.rows_for(label, remapped=True)
             cdf = self.label_cdf(label)
         else:
-            samples = self.samples()
+            rows = np.arange(len(self.sample_table))
             cdf = self.cdf()
-        if not samples:
+        if len(rows) == 0:
             return None
         if cap is None:
-            return samples
+            return self.sample_table.samples(rows)
         if random:
-            return np.random.choice(samples, cap, replace=replace, p=cdf)
+            chosen = np.random.choice(len(rows), cap, replace=replace, p=cdf)
+            return self.sample_table.samples(rows[chosen])
         else:
-            cap = min(cap, len(samples))
-            return samples[:cap]
+            cap = min(cap, len(rows))
+            return self.sample_table.samples(rows[:cap])
 
     def balance_bins(self, max_bin_weight=None):
         """
         Adjusts weights so that bins with a number number of segments aren't sampled so frequently.
         :param max_bin_weight: bins with more weight than this number will be scaled back to this weight.
         """
-
-        for bin_name, samples in self.samples_by_bin.items():
-            bin_weight = sum(sample.sample_weight for sample in samples)
-            if bin_weight == 0:
-                continue
-            if max_bin_weight is None:
-                scale_factor = 1 / bin_weight
-                # means each bin has equal possiblity
-            elif bin_weight > max_bin_weight:
-                scale_factor = max_bin_weight / bin_weight
-            else:
-                scale_factor = 1
-            for sample in samples:
-                sample.weight = np.float16(sample.sample_weight * scale_factor)
+        table = self.sample_table
+        bin_weight = np.bincount(table.bin, weights=table.weight)
+        scale_factor = np.ones(len(bin_weight))
+        has_weight = bin_weight != 0
+        if max_bin_weight is None:
+            # means each bin has equal possiblity
+            scale_factor[has_weight] = 1 / bin_weight[has_weight]
+        else:
+            over = bin_weight > max_bin_weight
+            scale_factor[over] = max_bin_weight / bin_weight[over]
+        table.set_weight(np.float16(table.weight * scale_factor[table.bin]))
         self.rebuild_cdf()
 
     def remove_label(self, label_to_remove):
@@ -461,9 +650,8 @@ class Dataset:
         """
         if label_to_remove not in self.labels:
             return
-        tracks = self.tracks_by_label[label_to_remove]
-        for track in tracks:
-            self.remove_label()
+        table = self.sample_table
+        table.keep(table.label != table.label_index(label_to_remove))
 
         self.rebuild_cdf()
 
@@ -479,53 +667,43 @@ class Dataset:
         """
         if lbl_p is None:
             lbl_p = self.lbl_p
-
-        self.sample_cdf = []
-        total = 0
-        self.sample_label_cdf = {}
-
-        for sample in self.samples:
-            sample_weight = sample.sample_weight
-            if lbl_p and sample.label in lbl_p:
-                sample_weight *= lbl_p[sample.label]
-            total += sample_weight
-
-            self.sample_cdf.append(sample_weight)
-
-            cdf = self.sample_label_cdf.setdefault(sample.label, [])
-            cdf.append(sample.sample_weight)
-
+        table = self.sample_table
+        # weight of each label from lbl_p
+        label_p = np.ones(len(table.labels))
+        if lbl_p:
+            for label, p in lbl_p.items():
+                if label in table.labels:
+                    label_p[table.label_index(label)] = p
+
+        weight = table.weight
+        self.sample_cdf = weight * label_p[table.label]
         if len(self.sample_cdf) > 0:
-            self.sample_cdf = [x / total for x in self.sample_cdf]
-
-        for key, cdf in self.sample_label_cdf.items():
-            total = sum(cdf)
-            self.sample_label_cdf[key] = [x / total for x in cdf]
+            self.sample_cdf = self.sample_cdf / np.sum(self.sample_cdf)
 
+        # each label's weights sum to 1
+        label_weight = np.bincount(table.label, weights=weight)
+        label_cdf = weight / label_weight[table.label]
+        self.sample_label_cdf = {}
         if self.label_mapping:
-            mapped_cdf = {}
             labels = list(self.label_mapping.keys())
             labels.sort()
+            mapped = {}
             for label in labels:
-                if label not in self.sample_label_cdf:
+                if label not in table.labels:
                     continue
-                label_cdf = self.sample_label_cdf[label]
-                new_label = self.label_mapping[label]
-                if lbl_p and label in lbl_p:
-                    label_cdf = np.float64(label_cdf)
-                    label_cdf *= lbl_p[label]
-                cdf = mapped_cdf.setdefault(new_label, [])
-                cdf.extend(label_cdf)
-
-            for key, cdf in mapped_cdf.items():
-                total = sum(cdf)
-                mapped_cdf[key] = [x / total for x in cdf]
-            self.sample_label_cdf = mapped_cdf
+                mapped.setdefault(self.label_mapping[label], []).append(label)
+            for new_label, labels in mapped.items():
+                rows = table.label_rows(labels)
+                cdf = label_cdf[rows] * label_p[table.label[rows]]
+                self.sample_label_cdf[new_label] = cdf / np.sum(cdf)
+        else:
+            labels, rows = table.group_rows("label")
+            for label, label_rows in zip(labels, rows):
+                self.sample_label_cdf[table.labels[label]] = label_cdf[label_rows]
 
     def get_label_weight(self, label):
         """Returns the total weight for all segments of given label."""
-        samples = self.samples_by_label.get(label)
-        return sum(sample.weight for sample in samples) if samples else 0
+        return np.sum(self.sample_table.weight[self.rows_for(label)])
 
     def regroup(
         self,
@@ -536,41 +714,25 @@ class Dataset:
         regroups the dataset so multiple animals can be under a single label
         """
         self.label_mapping = {}
-        counts = []
-        samples_by_bin = {}
-        samples = []
+        rows = []
         for mapped_label, labels in groups.items():
-            count = 0
             for label in labels:
-                lbl_samples = self.samples_for(label)
-                count += len(lbl_samples)
-                samples.extend(lbl_samples)
+                rows.append(self.rows_for(label))
                 self.label_mapping[label] = mapped_label
-                for sample in lbl_samples:
-                    samples_by_bin[sample.bin_id] = sample
-            counts.append(count)
 
         self.labels = list(groups.keys())
         self.labels.sort()
-        self.samples_by_bin = samples_by_bin
-        self.set_samples(samples)
-        # self.samples_by_id == {}
-
+        rows = np.concatenate(rows) if len(rows) > 0 else np.empty(0, dtype=np.intp)
         if shuffle:
-            np.random.shuffle(self.samples)
+            np.random.shuffle(rows)
+        self.sample_table.take(rows)
         self.rebuild_cdf()
 
     def has_data(self):
-        return len(self.samples) > 0
+        return len(self.sample_table) > 0
 
     def recalculate_segments(self, segment_type=SegmentType.ALL_RANDOM):
-        self.samples_by_bin.clear()
-        self.samples_by_label.clear()
-        del self.samples[:]
-        del self.samples
-        self.samples = []
-        self.samples_by_label = {}
-        self.samples_by_bin = {}
+        self.sample_table = SampleTable()
         logging.info("%s generating segments  type %s", self.name, segment_type)
         start = time.time()
         empty_tracks = []
@@ -585,7 +747,7 @@ class Dataset:
                 segment_frame_spacing,
                 segment_width,
                 segment_type,
-                segment_min_mass=segment_min_avg_mass,
+                segment_min_mass=self.segment_min_avg_mass,
             )
             filtered_stats = filtered_stats + track.filtered_stats["segment_mass"]
             if len(track.segments) == 0:
@@ -598,14 +760,19 @@ class Dataset:
         logging.info(
             "%s #segments %s filtered stats are %s took  %s",
             self.name,
-            len(self.samples),
+            len(self.sample_table),
             filtered_stats,
             time.time() - start,
         )
 
     def remove_sample(self, sample):
-        self.samples.remove(sample)
-        self.samples_by_label[sample.label].remove(sample)
+        self.remove_samples([sample])
+
+    def remove_samples(self, samples):
+        table = self.sample_table
+        keep = np.ones(len(table), dtype=bool)
+        keep[table.rows_of(samples)] = False
+        table.keep(keep)
 
     def fetch_track(
         self,
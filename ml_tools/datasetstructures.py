@@ -1,3 +1,4 @@
+import bisect
 import math
 import cv2
 import json
@@ -82,6 +83,38 @@ res_x = 120
 res_y = 160
 
 
+class TrackFrames:
+    """
+    Per frame arrays of a track's regions, in the order of the regions, so segments
+    can be chosen with boolean masks rather than looking at each region.
+    """
+
+    def __init__(self, regions, ffc_frames=None, skipped_frames=None):
+        self.regions = np.empty(len(regions), dtype=object)
+        self.regions[:] = list(regions)
+        self.frame_numbers = np.int32([region.frame_number for region in regions])
+        self.mass = np.uint16([region.mass for region in regions])
+        self.blank = np.array([region.blank for region in regions], dtype=bool)
+        self.ffc = frames_in(self.frame_numbers, ffc_frames)
+        self.skipped = frames_in(self.frame_numbers, skipped_frames)
+
+    def usable(self, ignore_mass=False):
+        """Mask of frames which have mass and aren't blank, ffc or skipped"""
+        mask = ~(self.ffc | self.skipped | self.blank)
+        if not ignore_mass:
+            mask &= self.mass > 0
+        return mask
+
+    def __len__(self):
+        return len(self.regions)
+
+
+def frames_in(frame_numbers, frames):
+    if frames is None or len(frames) == 0:
+        return np.zeros(len(frame_numbers), dtype=bool)
+    return np.isin(frame_numbers, np.asarray(frames))
+
+
 class TrackHeader:
     """Header for track."""
 
@@ -141,52 +174,27 @@ class TrackHeader:
         self.num_frames = num_frames
         self.frames_per_second = frames_per_second
         self.important_predicted = 0
-        mass_history = [region.mass for region in self.regions_by_frame.values()]
+        self.ffc_frames = np.uint16(ffc_frames)
+        self.skipped_frames = skipped_frames
+        self.frames = TrackFrames(
+            sorted(self.regions_by_frame.values(), key=lambda r: r.frame_number),
+            ffc_frames,
+            skipped_frames,
+        )
+        mass_history = self.frames.mass
         self.lower_mass = np.uint16(np.percentile(mass_history, q=25))
         self.upper_mass = np.uint16(np.percentile(mass_history, q=75))
         self.median_mass = np.uint16(np.median(mass_history))
         self.mean_mass = np.uint16(np.mean(mass_history))
-        self.ffc_frames = np.uint16(ffc_frames)
-        self.skipped_frames = skipped_frames
-        self.sample_frames = []
-        sample_frames_indices is None
-        if sample_frames_indices is not None:
-            # shouldnt need to use this ever
-            for frame_num, frame_temp in zip(
-                sample_frames_indices, self.frame_temp_median
-            ):
-                region = self.regions_by_frame[frame_num]
-                assert region.frame_number == frame_num
-                f = FrameSample(
-                    self.clip_id,
-                    self.track_id,
-                    frame_num,
-                    self.label,
-                    frame_temp,
-                    None,
-                    region,
-                    weight=1,
-                    camera=self.camera,
-                    start_time=self.start_time
-                    + datetime.timedelta(seconds=frame_num / self.frames_per_second),
-                )
-                self.sample_frames.append(f)
-        else:
-            frame_numbers = list(self.regions_by_frame.keys())
-            frame_numbers = [
-                frame
-                for frame in frame_numbers
-                if (skipped_frames is None or frame not in skipped_frames)
-                and (ffc_frames is None or frame not in ffc_frames)
-            ]
-            frame_numbers.sort()
+        self.sample_frames_indices = sample_frames_indices
+        # made from the regions when first asked for
+        self._sample_frames = None
 
-            for frame_num, frame_temp in zip(frame_numbers, self.frame_temp_median):
-
-                region = self.regions_by_frame[frame_num]
-                if region.mass == 0 or region.blank:
-                    continue
-                f = FrameSample(
+    @property
+    def sample_frames(self):
+        if self._sample_frames is None:
+            self._sample_frames = [
+                FrameSample(
                     self.clip_id,
                     self.track_id,
                     region.frame_number,
@@ -196,16 +204,45 @@ class TrackHeader:
                     region,
                     weight=1,
                     camera=self.camera,
-                    start_time=self.start_time
-                    + datetime.timedelta(seconds=frame_num / self.frames_per_second),
+                    start_time=self.start_time + datetime.timedelta(seconds=seconds),
                 )
-                self.sample_frames.append(f)
+                for region, frame_temp, seconds in zip(*self.sample_frame_columns())
+            ]
+        return self._sample_frames
+
+    @sample_frames.setter
+    def sample_frames(self, sample_frames):
+        self._sample_frames = sample_frames
+
+    def sample_frame_columns(self):
+        """
+        Returns the regions, frame temperatures and seconds from the start of the
+        track of the frames to sample, without making a FrameSample for each
+        """
+        if self.sample_frames_indices is not None:
+            # shouldnt need to use this ever
+            regions = [
+                self.regions_by_frame[frame_num]
+                for frame_num in self.sample_frames_indices
+            ]
+            for region, frame_num in zip(regions, self.sample_frames_indices):
+                assert region.frame_number == frame_num
+            frame_temps = self.frame_temp_median[: len(regions)]
+            regions = regions[: len(frame_temps)]
+        else:
+            # frame temps are matched to the frames left after removing ffc and
+            # skipped frames, then frames without mass are removed
+            kept = np.flatnonzero(~self.frames.ffc & ~self.frames.skipped)
+            kept = kept[: len(self.frame_temp_median)]
+            has_mass = (self.frames.mass[kept] > 0) & ~self.frames.blank[kept]
+            regions = self.frames.regions[kept[has_mass]]
+            frame_temps = self.frame_temp_median[: len(kept)][has_mass]
+        seconds = [region.frame_number / self.frames_per_second for region in regions]
+        return regions, frame_temps, seconds
 
     @property
     def bounds_history(self):
-        regions = list(self.regions_by_frame.values())
-        regions = sorted(regions, key=lambda r: r.frame_number)
-        return regions
+        return list(self.frames.regions)
 
     def toJSON(self, clip_meta):
         meta_dict = {}
@@ -295,8 +332,6 @@ class TrackHeader:
         if self.label == "vehicle" or self.label == "human":
             min_frames = segment_width / 4.0
 
-        # in python3.7+ can just take the values and it guarantees order it was added to dict
-        regions = self.bounds_history
         self.segments, self.filtered_stats = get_segments(
             self.clip_id,
             self.track_id,
@@ -304,7 +339,7 @@ class TrackHeader:
             segment_frame_spacing,
             segment_width,
             label=self.label,
-            regions=np.array(regions),
+            regions=self.frames.regions,
             frame_temp_median=self.frame_temp_median,
             segment_min_mass=segment_min_mass,
             sample_frames=self.sample_frames if use_important else None,
@@ -317,6 +352,7 @@ class TrackHeader:
             start_time=self.start_time,
             segment_type=segment_type,
             max_segments=max_segments,
+            track_frames=self.frames,
         )
 
     @property
@@ -616,12 +652,21 @@ class FrameSample(Sample):
     def unique_id(self):
         return f"{self.clip_id}-{self.track_id}-{self.frame_number}"
 
+    def renumber(self):
+        """Gives this sample a new id, for samples made in another process"""
+        self.id = FrameSample._frame_id
+        FrameSample._frame_id += 1
+
     @property
     def bin_id(self):
         """Unique name of this segments track."""
-        # break into 50 frame keys, since we dont have much data this means multiple sets can have same clip
-        i = int(self.frame_number / 50)
-        return f"{self.clip_id}-{self.track_id}-{i}"
+        return frame_bin_id(self.clip_id, self.track_id, self.frame_number)
+
+
+def frame_bin_id(clip_id, track_id, frame_number):
+    # break into 50 frame keys, since we dont have much data this means multiple sets can have same clip
+    i = int(frame_number / 50)
+    return f"{clip_id}-{track_id}-{i}"
 
 
 class SegmentHeader(Sample):
@@ -734,17 +779,24 @@ class SegmentHeader(Sample):
     def unique_id(self):
         return self.id
 
+    def renumber(self):
+        """Gives this segment a new id, for segments made in another process"""
+        self.id = SegmentHeader._segment_id
+        SegmentHeader._segment_id += 1
+
     def get_data(self, db):
         crop_rectangle = tools.Rectangle(2, 2, 160 - 2 * 2, 140 - 2 * 2)
 
         try:
             background = db.get_clip_background(self.clip_id)
-            frames = db.get_track(
-                self.clip_id,
-                self.track_id,
-                original=False,
-                frame_numbers=self.frame_numbers - self.start_frame,
+            batch = db.get_tracks_batch(
+                [(self.clip_id, self.track_id, self.frame_numbers - self.start_frame)]
             )
+            frames = batch.frames(0)
+            # first index of each frame number, for looking up its median temp
+            temp_indices = {}
+            for i, frame_number in enumerate(self.frame_numbers):
+                temp_indices.setdefault(frame_number, i)
 
             thermals = []  # np.empty(len(frames), dtype=object)
             filtered = []  # np.empty(len(frames), dtype=object)
@@ -752,8 +804,7 @@ class SegmentHeader(Sample):
             for i, frame in enumerate(frames):
                 frame.float_arrays()
                 frame.filtered = frame.thermal - frame.region.subimage(background)
-                temp_index = np.where(self.frame_numbers == frame.frame_number)[0][0]
-                temp = self.frame_temp_median[temp_index]
+                temp = self.frame_temp_median[temp_indices[frame.frame_number]]
                 frame.resize_with_aspect((32, 32), crop_rectangle, keep_edge=True)
                 frame.thermal -= temp
                 np.clip(frame.thermal, a_min=0, a_max=None, out=frame.thermal)
@@ -835,26 +886,26 @@ def get_segments(
     start_time=None,
     segment_type=SegmentType.ALL_RANDOM,
     max_segments=None,
+    track_frames=None,
 ):
-
+    """
+    :param track_frames: TrackFrames of the regions, built from regions, ffc_frames and
+    skipped_frames if not given
+    """
     if segment_type == SegmentType.ALL_RANDOM_NOMIN:
         segment_min_mass = None
     if min_frames is None:
         min_frames = 25
     segments = []
-    mass_history = np.uint16([region.mass for region in regions])
+    if track_frames is None:
+        track_frames = TrackFrames(regions, ffc_frames, skipped_frames)
+    regions = track_frames.regions
+    mass_history = track_frames.mass
     filtered_stats = {"segment_mass": 0, "too short": 0}
     if sample_frames is not None:
-        frame_indices = [frame.frame_number for frame in sample_frames]
+        frame_indices = np.int32([frame.frame_number for frame in sample_frames])
     else:
-        frame_indices = [
-            region.frame_number
-            for region in regions
-            if (ignore_mass or region.mass > 0)
-            and region.frame_number not in ffc_frames
-            and (skipped_frames is None or region.frame_number not in skipped_frames)
-            and not region.blank
-        ]
+        frame_indices = track_frames.frame_numbers[track_frames.usable(ignore_mass)]
         if segment_min_mass is not None:
             if len(frame_indices) > 0:
                 segment_min_mass = min(
@@ -863,17 +914,14 @@ def get_segments(
                 )
         else:
             segment_min_mass = 1
-            # remove blank frames
 
         if segment_type == SegmentType.TOP_RANDOM:
-            # take top 50 mass frames
-            frame_indices = sorted(
-                frame_indices,
-                key=lambda f_i: mass_history[f_i - start_frame],
-                reverse=True,
+            # take top 50 mass frames, ties in frame order
+            top_mass = np.argsort(
+                -mass_history[frame_indices - start_frame].astype(np.int64),
+                kind="stable",
             )
-            frame_indices = frame_indices[:50]
-            frame_indices.sort()
+            frame_indices = np.sort(frame_indices[top_mass[:50]])
     # 1 / 0
     if segment_type == SegmentType.TOP_SEQUENTIAL:
         return get_top_mass_segments(
@@ -896,7 +944,6 @@ def get_segments(
     if len(frame_indices) < min_frames:
         filtered_stats["too short"] += 1
         return segments, filtered_stats
-    frame_indices = np.array(frame_indices)
     segment_count = max(1, len(frame_indices) // segment_frame_spacing)
     segment_count = int(segment_count)
     if max_segments is not None:
@@ -978,8 +1025,7 @@ def get_segments(
             temp_slice = frame_temp_median[relative_frames]
             region_slice = regions[relative_frames]
             movement_data = None
-            for z, f in enumerate(frames):
-                assert region_slice[z].frame_number == f
+            assert np.array_equal(track_frames.frame_numbers[relative_frames], frames)
             segment = SegmentHeader(
                 clip_id,
                 track_id,
@@ -1022,27 +1068,46 @@ def get_top_mass_segments(
     segment_count = max(1, len(regions) // segment_frame_spacing)
     segment_count = int(segment_count)
 
-    segment_mass = []
-    for i in range(max(1, len(mass_history) - segment_width)):
-        contains_ffc = False
-        for z in range(segment_width):
-            if (z + i + start_frame) in ffc_frames:
-                contains_ffc = True
-                break
-        if contains_ffc:
-            continue
-        mass = np.sum(mass_history[i : i + segment_width])
-        segment_mass.append((i, mass))
-
-    sorted_mass = sorted(segment_mass, key=lambda x: x[1], reverse=True)
+    num_windows = max(1, len(mass_history) - segment_width)
+    starts = np.arange(num_windows)
+    # mass of each window from the cumulative sum, windows containing an ffc frame are
+    # found by convolving a mask of ffc frames with the window
+    cumulative = np.cumsum(mass_history)
+    cumulative = np.concatenate((np.zeros(1, dtype=cumulative.dtype), cumulative))
+    ends = np.minimum(starts + segment_width, len(mass_history))
+    window_mass = cumulative[ends] - cumulative[starts]
+
+    ffc_mask = np.zeros(num_windows + segment_width - 1, dtype=np.int32)
+    ffc_indices = np.array(list(ffc_frames), dtype=np.int64) - start_frame
+    ffc_indices = ffc_indices[(ffc_indices >= 0) & (ffc_indices < len(ffc_mask))]
+    ffc_mask[ffc_indices] = 1
+    contains_ffc = np.convolve(ffc_mask, np.ones(segment_width, np.int32), "valid") > 0
+    starts = starts[~contains_ffc]
+    window_mass = window_mass[~contains_ffc]
+
+    # highest mass first, ties in start order
+    if np.issubdtype(window_mass.dtype, np.integer):
+        sort_key = -window_mass.astype(np.int64)
+    else:
+        sort_key = -window_mass
+    sorted_windows = np.argsort(sort_key, kind="stable")
     best_mass = True
     segment_count = max(1, len(regions) // segment_frame_spacing)
-    segment_count = int(min(len(sorted_mass), segment_count))
-
-    for _ in range(segment_count):
-        segment_info = sorted_mass[0]
-        index = segment_info[0]
-        avg_mass = segment_info[1] / segment_width
+    segment_count = int(min(len(sorted_windows), segment_count))
+    # sorted starts of chosen segments, windows starting within 2/3 of a segment
+    # width of one are skipped
+    chosen = []
+    for window_i in sorted_windows:
+        if len(segments) == segment_count:
+            break
+        index = int(starts[window_i])
+        pos = bisect.bisect_left(chosen, index)
+        if pos > 0 and index < chosen[pos - 1] + segment_width / 3 * 2:
+            continue
+        if pos < len(chosen) and index > chosen[pos] - segment_width / 3 * 2:
+            continue
+        mass = window_mass[window_i]
+        avg_mass = mass / segment_width
         if not best_mass and (
             ignore_mass or (avg_mass < lower_mass or avg_mass < segment_min_mass)
         ):
@@ -1056,7 +1121,7 @@ def get_top_mass_segments(
             start_frame=start_frame,
             frames=segment_width,
             weight=1,
-            mass=segment_info[1],
+            mass=mass,
             label=label,
             regions=regions[frames],
             frame_temp_median=frame_temp_median[frames],
@@ -1069,15 +1134,7 @@ def get_top_mass_segments(
         )
         best_mass = False
         segments.append(segment)
-        # remove those that start within this segment
-        sorted_mass = [
-            mass_info
-            for mass_info in sorted_mass
-            if mass_info[0] <= (index - segment_width / 3 * 2)
-            or mass_info[0] >= (index + segment_width / 3 * 2)
-        ]
-        if len(segments) == segment_count or len(sorted_mass) == 0:
-            break
+        chosen.insert(pos, index)
     return segments, filtered_stats
 
 
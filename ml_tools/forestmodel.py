@@ -160,116 +160,69 @@ def process_track(
     )
 
 
+# number of frames each feature is averaged over is the number of frames less this
+MOTION_OFFSETS = np.array([0] * 5 + [1] * 4 + [3] * 4 + [5] * 4 + [0] * 19)
+HISTOGRAM_BINS = 60
+
+
 def forest_features(
     track_frames, background, frame_temp_median, regions, buf_len=5, cropped=True
 ):
-    frame_features = []
-    avg_features = None
-    maximum_features = None
-    minimum_features = None
-    all_features = []
-    f_count = 0
-    prev_count = 0
-    if len(track_frames) <= buf_len:
-        return None
-
-    for i, frame in enumerate(track_frames):
-        region = regions[i]
-        if region.blank or region.width == 0 or region.height == 0:
-            prev_count = 0
+    return batch_forest_features(
+        [(track_frames, background, frame_temp_median, regions)], buf_len, cropped
+    )[0]
+
+
+def batch_forest_features(tracks, buf_len=5, cropped=True):
+    """
+    Calculates forest features of many tracks together, the pixels of every frame
+    are concatenated so features of all frames are calculated with array operations
+    :param tracks: list of (track_frames, background, frame_temp_median, regions)
+    :return: features of each track, None for tracks which are too short
+    """
+    pixels = FramePixels(cropped)
+    track_frames = []
+    # tracks of a clip share its background
+    back_medians = {}
+    for track_i, (frames, background, frame_temp_median, regions) in enumerate(tracks):
+        if len(frames) <= buf_len:
             continue
-        frame.float_arrays()
-        feature = FrameFeatures(region)
-        sub_back = region.subimage(background)
-        feature.calc_histogram(sub_back, frame.thermal)
-        t_median = frame_temp_median[frame.frame_number]
-        if cropped:
-            cropped_frame = frame
-        else:
-            cropped_frame = frame.crop_by_region(region)
-        thermal = cropped_frame.thermal
-        f_count += 1
-
-        thermal = thermal + np.median(background) - t_median
-        filtered = thermal - sub_back
-
-        feature.calculate(thermal, sub_back)
-        count_back = min(buf_len, prev_count)
-        for i in range(count_back):
-            prev = frame_features[-i - 1]
-            vel = feature.cent - prev.cent
-            feature.speed[i] = np.sqrt(np.sum(vel * vel))
-            feature.rel_speed[i] = feature.speed[i] / feature.sqrt_area
-            feature.rel_speed_x[i] = np.abs(vel[0]) / feature.sqrt_area
-            feature.rel_speed_y[i] = np.abs(vel[1]) / feature.sqrt_area
-            feature.speed_x[i] = np.abs(vel[0])
-            feature.speed_y[i] = np.abs(vel[1])
-
-        frame_features.append(feature)
-        features = feature.features()
-        all_features.append(features)
-        prev_count += 1
-        if maximum_features is None:
-            maximum_features = features.copy()
-            minimum_features = features.copy()
-
-            avg_features = features.copy()
-        else:
-            maximum_features = np.maximum(features, maximum_features)
-            for i, (new, min_f) in enumerate(zip(features, minimum_features)):
-                if min_f == 0:
-                    minimum_features[i] = new
-                elif new != 0 and new < min_f:
-                    minimum_features[i] = new
-            # Aggregate
-            avg_features += features
-
-    # Compute statistics for all tracks that have the min required duration
-    valid_counter = 0
-    N = f_count - np.array(
-        [
-            0,
-            0,
-            0,
-            0,
-            0,
-            1,
-            1,
-            1,
-            1,
-            3,
-            3,
-            3,
-            3,
-            5,
-            5,
-            5,
-            5,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-            0,
-        ]
-    )  # Normalise each measure by however many samples went into it
-    avg_features /= N
-    std_features = np.sqrt(np.sum((all_features - avg_features) ** 2, axis=0) / N)
+        if id(background) not in back_medians:
+            back_medians[id(background)] = np.median(background)
+        prev_count = 0
+        for frame, region in zip(frames, regions):
+            if region.blank or region.width == 0 or region.height == 0:
+                prev_count = 0
+                continue
+            pixels.add(
+                frame.thermal,
+                region,
+                region.subimage(background),
+                back_medians[id(background)],
+                frame_temp_median[frame.frame_number],
+            )
+            track_frames.append((track_i, prev_count))
+            prev_count += 1
+
+    results = [None] * len(tracks)
+    if len(track_frames) == 0:
+        return results
+    track_index, prev_count = np.array(track_frames).T
+    features = frame_features(pixels, prev_count, buf_len)
+
+    track_starts = np.flatnonzero(np.diff(track_index, prepend=-1))
+    f_count = np.diff(np.append(track_starts, len(track_index)))
+    # Normalise each measure by however many samples went into it
+    N = f_count[:, np.newaxis] - MOTION_OFFSETS
+    avg_features = np.add.reduceat(features, track_starts, axis=0) / N
+    deviation = features - np.repeat(avg_features, f_count, axis=0)
+    std_features = np.sqrt(np.add.reduceat(deviation**2, track_starts, axis=0) / N)
+    maximum_features = np.maximum.reduceat(features, track_starts, axis=0)
+    # smallest non zero value, or 0 if a feature is always 0
+    non_zero = np.where(features == 0, np.inf, features)
+    minimum_features = np.minimum.reduceat(non_zero, track_starts, axis=0)
+    minimum_features[np.isinf(minimum_features)] = 0
     diff_features = maximum_features - minimum_features
-    burst_features = calculate_burst_features(frame_features, avg_features[5])
 
     X = np.hstack(
         (
@@ -278,294 +231,268 @@ def forest_features(
             maximum_features,
             minimum_features,
             diff_features,
-            burst_features,
-            np.array([len(track_frames)]),
+            burst_features(features[:, 5], avg_features[:, 5], track_starts, f_count),
+            np.array([[len(tracks[i][0])] for i in track_index[track_starts]]),
         )
     )
-    return X
-
-
-def calculate_burst_features(frames, mean_speed):
-    #
-
-    cut_off = max(2, (1 + mean_speed))
-    speed_above = len([f for f in frames if f.speed[0] > cut_off])
-    speed_below = len([f for f in frames if f.speed[0] <= cut_off])
-
-    burst_frames = 0
-    burst_ratio = []
-    burst_history = []
-    total_birst_frames = 0
-    low_speed_distance = 0
-    high_speed_distance = 0
-    for i, frame in enumerate(frames):
-        if frame.speed[0] < cut_off:
-            low_speed_distance += frame.speed[0]
-        else:
-            high_speed_distance += frame.speed[0]
-        if i > 0:
-            prev = frames[i - 1]
-            if prev.speed[0] > cut_off and frame.speed[0] > cut_off:
-                burst_frames += 1
-            else:
-                if burst_frames > 0:
-                    burst_start = i - burst_frames - 1
-                    if len(burst_history) > 0:
-                        # length of non burst frames is from previous burst end
-                        prev = burst_history[-1]
-                        burst_start -= prev[0] + prev[1]
-                    burst_history.append((i - burst_frames - 1, burst_frames + 1))
-                    burst_ratio.append(burst_start / (burst_frames + 1))
-                    total_birst_frames += burst_frames + 1
-                    burst_frames = 0
-    burst_ratio = np.array(burst_ratio)
-    if speed_above == 0:
-        speed_ratio = 0
-        speed_distance_ratio = 0
+    for track_i, track_features in zip(track_index[track_starts], X):
+        results[track_i] = track_features
+    return results
+
+
+class FramePixels:
+    """
+    Collects the pixels of frames cropped to their regions, and the whole frames
+    for histograms when the frames aren't already cropped
+    """
+
+    def __init__(self, cropped):
+        self.cropped = cropped
+        self.thermal = []
+        self.back = []
+        self.shapes = []
+        self.positions = []
+        self.back_medians = []
+        self.temp_medians = []
+        self.histogram_thermal = []
+
+    def add(self, thermal, region, sub_back, back_median, t_median):
+        if not self.cropped:
+            self.histogram_thermal.append(thermal.ravel())
+            thermal = region.subimage(thermal)
+        self.thermal.append(thermal.ravel())
+        self.back.append(sub_back.ravel())
+        self.shapes.append(thermal.shape)
+        self.positions.append((region.x, region.y))
+        self.back_medians.append(back_median)
+        self.temp_medians.append(t_median)
+
+
+def frame_features(pixels, prev_count, buf_len):
+    """Features of each frame, as FEAT_LABELS"""
+    shapes = np.array(pixels.shapes)
+    sizes = shapes[:, 0] * shapes[:, 1]
+    starts = np.append(0, np.cumsum(sizes)[:-1])
+    thermal = np.float32(np.concatenate(pixels.thermal))
+    back = np.float64(np.concatenate(pixels.back))
+
+    if pixels.cropped:
+        histogram_diff = histogram_correlation(back, sizes, thermal, sizes)
     else:
-        speed_distance_ratio = low_speed_distance / high_speed_distance
-        speed_ratio = speed_below / speed_above
+        histogram_thermal = np.float32(np.concatenate(pixels.histogram_thermal))
+        histogram_sizes = np.array([len(frame) for frame in pixels.histogram_thermal])
+        histogram_diff = histogram_correlation(
+            back, sizes, histogram_thermal, histogram_sizes
+        )
 
-    if len(burst_ratio) == 0:
-        burst_min = 0
-        burst_max = 0
-        burst_mean = 0
-    else:
-        burst_min = np.amin(burst_ratio)
-        burst_max = np.amax(burst_ratio)
-        burst_mean = np.mean(burst_ratio)
-    burst_chance = len(burst_ratio) / len(frames)
-    burst_per_frame = total_birst_frames / len(frames)
-    return np.array(
-        [
-            speed_distance_ratio,
-            speed_ratio,
-            burst_min,
-            burst_max,
-            burst_mean,
-            burst_chance,
-            burst_per_frame,
-        ]
-    )
+    thermal += np.repeat(np.float32(pixels.back_medians), sizes)
+    thermal -= np.repeat(np.float32(pixels.temp_medians), sizes)
+    thermal_max = np.maximum.reduceat(thermal, starts)
+    thermal = np.float64(thermal)
+    _, thermal_std = mean_std(thermal, starts, sizes)
+    back_mean, std_back = mean_std(back, starts, sizes)
+    std_back += 1.0e-9
+
+    filtered = np.abs(thermal - back)
+    f_max = np.maximum.reduceat(filtered, starts)
+    filtered /= np.repeat(np.where(f_max > 0, f_max, 1), sizes)
+    total = np.add.reduceat(filtered, starts)
+    cent, extent = intensity_weighted_moments(filtered, total, shapes, starts, sizes)
+    cent += pixels.positions
+
+    area = np.pi * extent[:, 0] * extent[:, 1]
+    sqrt_area = np.sqrt(area)
+    speed, speed_x, speed_y = motion(cent, prev_count, buf_len)
+    rel_speed = speed / sqrt_area[:, np.newaxis]
+    rel_speed_x = speed_x / sqrt_area[:, np.newaxis]
+    rel_speed_y = speed_y / sqrt_area[:, np.newaxis]
+    columns = [
+        sqrt_area,
+        extent[:, 0] / extent[:, 1],
+        (thermal_max - back_mean) / std_back,
+        thermal_std / std_back,
+        total / area,
+    ]
+    for i in [0, 2, 4]:
+        columns.extend(
+            [speed[:, i], rel_speed[:, i], rel_speed_x[:, i], rel_speed_y[:, i]]
+        )
+    for buffer in [speed, speed_x, speed_y, rel_speed, rel_speed_x, rel_speed_y]:
+        columns.extend(non_zero_stats(buffer))
+    columns.append(histogram_diff)
+    return np.stack(columns, axis=1)
 
 
-class FrameFeatures:
-    def __init__(self, region, buff_len=5):
-        # self.thermal = thermal
-        self.region = region
-        self.cent = None
-        self.extent = None
-        self.thera = None
-        self.rel_speed = np.zeros(buff_len)
-        self.rel_speed_x = np.zeros(buff_len)
-        self.rel_speed_y = np.zeros(buff_len)
-        self.speed_x = np.zeros(buff_len)
-        self.speed_y = np.zeros(buff_len)
-        self.speed = np.zeros(buff_len)
-        self.histogram_diff = 0
-
-    def calculate(self, thermal, sub_back):
-        self.thermal_max = np.amax(thermal)
-        self.thermal_std = np.std(thermal)
-        filtered = thermal - sub_back
-        filtered = np.abs(filtered)
-        f_max = filtered.max()
-
-        if f_max > 0.0:
-            filtered /= f_max
-
-        # Calculate weighted centroid and second moments etc
-        cent, extent, theta = intensity_weighted_moments(filtered, self.region)
-
-        self.cent = cent
-        self.extent = extent
-        self.theta = theta
-        # Instantaneous shape features
-        area = np.pi * extent[0] * extent[1]
-        self.sqrt_area = np.sqrt(area)
-        self.elongation = extent[0] / extent[1]
-        self.std_back = np.std(sub_back) + 1.0e-9
-
-        # Instantaneous intensity features
-        self.peak_snr = (self.thermal_max - np.mean(sub_back)) / self.std_back
-        self.mean_snr = self.thermal_std / self.std_back
-        self.fill_factor = np.sum(filtered) / area
-
-    def features(self):
-        non_zero = np.array([s for s in self.speed if s > 0])
-        max_speed = 0
-        min_speed = 0
-        avg_speed = 0
-        if len(non_zero) > 0:
-            max_speed = np.amax(non_zero)
-            min_speed = np.amin(non_zero)
-            avg_speed = np.mean(non_zero)
-
-        non_zero = np.array([s for s in self.speed_x if s > 0])
-        max_speed_x = 0
-        min_speed_x = 0
-        avg_speed_x = 0
-        if len(non_zero) > 0:
-            max_speed_x = np.amax(non_zero)
-            min_speed_x = np.amin(non_zero)
-            avg_speed_x = np.mean(non_zero)
-
-        non_zero = np.array([s for s in self.speed_y if s > 0])
-        max_speed_y = 0
-        min_speed_y = 0
-        avg_speed_y = 0
-        if len(non_zero) > 0:
-            max_speed_y = np.amax(non_zero)
-            min_speed_y = np.amin(non_zero)
-            avg_speed_y = np.mean(non_zero)
-
-        non_zero = np.array([s for s in self.rel_speed if s > 0])
-        max_rel_speed = 0
-        min_rel_speed = 0
-        avg_rel_speed = 0
-        if len(non_zero) > 0:
-            max_rel_speed = np.amax(non_zero)
-            min_rel_speed = np.amin(non_zero)
-            avg_rel_speed = np.mean(non_zero)
-
-        non_zero = np.array([s for s in self.rel_speed_x if s > 0])
-        max_rel_speed_x = 0
-        min_rel_speed_x = 0
-        avg_rel_speed_x = 0
-        if len(non_zero) > 0:
-            max_rel_speed_x = np.amax(non_zero)
-            min_rel_speed_x = np.amin(non_zero)
-            avg_rel_speed_x = np.mean(non_zero)
-
-        non_zero = np.array([s for s in self.rel_speed_y if s > 0])
-        max_rel_speed_y = 0
-        min_rel_speed_y = 0
-        avg_rel_speed_y = 0
-        if len(non_zero) > 0:
-            max_rel_speed_y = np.amax(non_zero)
-            min_rel_speed_y = np.amin(non_zero)
-            avg_rel_speed_y = np.mean(non_zero)
-
-        return np.array(
-            [
-                self.sqrt_area,
-                self.elongation,
-                self.peak_snr,
-                self.mean_snr,
-                self.fill_factor,
-                self.speed[0],
-                self.rel_speed[0],
-                self.rel_speed_x[0],
-                self.rel_speed_y[0],
-                self.speed[2],
-                self.rel_speed[2],
-                self.rel_speed_x[2],
-                self.rel_speed_y[2],
-                self.speed[4],
-                self.rel_speed[4],
-                self.rel_speed_x[4],
-                self.rel_speed_y[4],
-                max_speed,
-                min_speed,
-                avg_speed,
-                max_speed_x,
-                min_speed_x,
-                avg_speed_x,
-                max_speed_y,
-                min_speed_y,
-                avg_speed_y,
-                max_rel_speed,
-                min_rel_speed,
-                avg_rel_speed,
-                max_rel_speed_x,
-                min_rel_speed_x,
-                avg_rel_speed_x,
-                max_rel_speed_y,
-                min_rel_speed_y,
-                avg_rel_speed_y,
-                self.histogram_diff,
-            ]
-        )
+def mean_std(values, starts, sizes):
+    mean = np.add.reduceat(values, starts) / sizes
+    variance = np.add.reduceat(values * values, starts) / sizes - mean * mean
+    return mean, np.sqrt(np.maximum(variance, 0))
 
-    def calc_histogram(self, sub_back, crop_t):
-        max_v = np.amax(sub_back)
-        min_v = np.amin(sub_back)
-        sub_back = (np.float32(sub_back) - min_v) / (max_v - min_v)
-        max_v = np.amax(crop_t)
-        min_v = np.amin(crop_t)
-        crop_t = (np.float32(crop_t) - min_v) / (max_v - min_v)
-
-        sub_back *= 255
-        crop_t *= 255
-
-        # sub_back = np.uint8(sub_back)
-        # crop_t = np.uint8(crop_t)
-        sub_back = sub_back[..., np.newaxis]
-        crop_t = crop_t[..., np.newaxis]
-        h_bins = 60
-        histSize = [h_bins]
-        channels = [0]
-        hist_base = cv2.calcHist(
-            [sub_back],
-            channels,
-            None,
-            histSize,
-            [0, 255],
-            accumulate=False,
-        )
-        cv2.normalize(hist_base, hist_base, alpha=0, beta=1, norm_type=cv2.NORM_MINMAX)
-
-        hist_track = cv2.calcHist(
-            [crop_t],
-            channels,
-            None,
-            histSize,
-            [0, 255],
-            accumulate=False,
-        )
-        # print(hist_track)
-        cv2.normalize(
-            hist_track,
-            hist_track,
-            alpha=0,
-            beta=1,
-            norm_type=cv2.NORM_MINMAX,
-        )
-        self.histogram_diff = cv2.compareHist(hist_base, hist_track, 0)
 
+def non_zero_stats(buffer):
+    """max, min and mean of the positive values of each row, 0 if there are none"""
+    positive = buffer > 0
+    count = np.sum(positive, axis=1)
+    max_v = np.max(np.where(positive, buffer, 0), axis=1)
+    min_v = np.min(np.where(positive, buffer, np.inf), axis=1)
+    min_v[count == 0] = 0
+    mean = np.sum(np.where(positive, buffer, 0), axis=1) / np.maximum(count, 1)
+    return max_v, min_v, mean
 
-# Find centre of mass and size/orientation of the hot spot
-def intensity_weighted_moments(sub, region=None):
-    tot = np.sum(sub)
-    # print(tot, "using", region)
-    if tot <= 0.0:
-        # Zero image - replace with ones so calculations can continue
-        sub = np.ones(sub.shape)
-        tot = sub.size
 
-    # Calculate weighted centroid
-    Y, X = np.mgrid[0 : sub.shape[0], 0 : sub.shape[1]]
-    cx = np.sum(sub * X) / tot
-    cy = np.sum(sub * Y) / tot
-    X = X - cx
-    Y = Y - cy
-    cent = np.array([region.x + cx, region.y + cy])
+# Find centre of mass and size of the hot spot
+def intensity_weighted_moments(weights, total, shapes, starts, sizes):
+    zero = total <= 0
+    if np.any(zero):
+        # Zero image - replace with ones so calculations can continue
+        weights[np.repeat(zero, sizes)] = 1
+        total = np.where(zero, sizes, total)
+    # pixel coordinates from each frame's rows
+    heights = shapes[:, 0]
+    row_widths = np.repeat(shapes[:, 1], heights)
+    row_starts = np.append(0, np.cumsum(row_widths)[:-1])
+    rows = np.arange(len(row_widths), dtype=np.float64)
+    rows -= np.repeat(np.append(0, np.cumsum(heights)[:-1]), heights)
+    y = np.repeat(rows, row_widths)
+    x = np.arange(len(weights), dtype=np.float64)
+    x -= np.repeat(row_starts, row_widths)
+    weighted_x = weights * x
+    weighted_y = weights * y
+    cx = np.add.reduceat(weighted_x, starts) / total
+    cy = np.add.reduceat(weighted_y, starts) / total
 
     # Second moments matrix
-    mxx = np.sum(X * X * sub) / tot
-    mxy = np.sum(X * Y * sub) / tot
-    myy = np.sum(Y * Y * sub) / tot
-    M = np.array([[mxx, mxy], [mxy, myy]])
-
-    # Extent and angle
-    w, v = np.linalg.eigh(M)
-    w = np.abs(w)
-    if w[0] < w[1]:
-        w = w[::-1]
-        v = v[:, ::-1]
-    extent = (
-        np.sqrt(w) + 0.5
-    )  # Add half a pixel so that a single bright pixel has non-zero extent
-    theta = np.arctan2(v[1, 0], v[0, 0])
-
-    return cent, extent, theta
+    moments = np.empty((len(total), 2, 2))
+    moments[:, 0, 0] = np.add.reduceat(weighted_x * x, starts) / total - cx * cx
+    moments[:, 0, 1] = np.add.reduceat(weighted_x * y, starts) / total - cx * cy
+    moments[:, 1, 0] = moments[:, 0, 1]
+    moments[:, 1, 1] = np.add.reduceat(weighted_y * y, starts) / total - cy * cy
+
+    # largest extent first, add half a pixel so that a single bright pixel has
+    # non-zero extent
+    w = np.sort(np.abs(np.linalg.eigvalsh(moments)), axis=1)[:, ::-1]
+    extent = np.sqrt(w) + 0.5
+    return np.stack((cx, cy), axis=1), extent
+
+
+def motion(cent, prev_count, buf_len):
+    """Speed from the centre of each of the previous buf_len frames of a run of frames"""
+    speed = np.zeros((len(cent), buf_len))
+    speed_x = np.zeros((len(cent), buf_len))
+    speed_y = np.zeros((len(cent), buf_len))
+    for i in range(buf_len):
+        frames = np.flatnonzero(prev_count > i)
+        vel = cent[frames] - cent[frames - i - 1]
+        speed[frames, i] = np.sqrt(vel[:, 0] * vel[:, 0] + vel[:, 1] * vel[:, 1])
+        speed_x[frames, i] = np.abs(vel[:, 0])
+        speed_y[frames, i] = np.abs(vel[:, 1])
+    return speed, speed_x, speed_y
+
+
+def histogram_correlation(back, back_sizes, thermal, thermal_sizes):
+    """
+    Correlation of the background and thermal histograms of each frame, as
+    cv2.compareHist with HISTCMP_CORREL, which doesn't change with the min max
+    normalization of the histograms
+    """
+    back_hist = scaled_histograms(back, back_sizes)
+    thermal_hist = scaled_histograms(thermal, thermal_sizes)
+    n = HISTOGRAM_BINS
+    s1 = np.sum(back_hist, axis=1)
+    s2 = np.sum(thermal_hist, axis=1)
+    num = np.sum(back_hist * thermal_hist, axis=1) - s1 * s2 / n
+    denom = (np.sum(back_hist**2, axis=1) - s1 * s1 / n) * (
+        np.sum(thermal_hist**2, axis=1) - s2 * s2 / n
+    )
+    valid = np.abs(denom) > np.finfo(np.float64).eps
+    return np.where(valid, num / np.sqrt(np.where(valid, denom, 1)), 1.0)
+
+
+def scaled_histograms(values, sizes):
+    """
+    Histogram of each frame's values scaled from 0 to 255 in float32, binned as
+    cv2.calcHist with range [0, 255) so the maximum isn't counted, and nan from
+    frames of one value is counted in the first bin
+    """
+    starts = np.append(0, np.cumsum(sizes)[:-1])
+    min_v = np.minimum.reduceat(values, starts)
+    value_range = np.float32(np.maximum.reduceat(values, starts) - min_v)
+    # values of frames of one value are all counted in the first bin
+    value_range[value_range == 0] = np.inf
+    scaled = np.float32(values) - np.repeat(np.float32(min_v), sizes)
+    scaled /= np.repeat(value_range, sizes)
+    scaled *= np.float32(255)
+    bins = np.int64(np.multiply(scaled, HISTOGRAM_BINS / 255, dtype=np.float64))
+    # an extra bin for values which aren't counted
+    bins[scaled >= 255] = HISTOGRAM_BINS
+    bins += np.repeat(np.arange(len(sizes)) * (HISTOGRAM_BINS + 1), sizes)
+    counts = np.bincount(bins, minlength=len(sizes) * (HISTOGRAM_BINS + 1))
+    counts = counts.reshape(len(sizes), HISTOGRAM_BINS + 1)[:, :HISTOGRAM_BINS]
+    return np.float64(counts)
+
+
+def burst_features(speed, mean_speed, track_starts, f_count):
+    """
+    Features of bursts of speed of each track, runs of frames faster than a cut off
+    which end before the last frame of the track
+    :param speed: speed of each frame from the previous frame, in tracks starting at
+    track_starts
+    :param mean_speed: mean speed of each track
+    """
+    num_tracks = len(track_starts)
+    track_i = np.repeat(np.arange(num_tracks), f_count)
+    cut_off = np.repeat(np.fmax(2, 1 + mean_speed), f_count)
+    fast = speed > cut_off
+    speed_above = np.add.reduceat(np.int64(fast), track_starts)
+    speed_below = f_count - speed_above
+    slow = speed < cut_off
+    low_speed_distance = np.add.reduceat(np.where(slow, speed, 0), track_starts)
+    high_speed_distance = np.add.reduceat(np.where(slow, 0, speed), track_starts)
+
+    # runs of fast frames within each track
+    last = np.append(track_starts[1:], len(speed)) - 1
+    follows_fast = np.append(False, fast[:-1])
+    follows_fast[track_starts] = False
+    precedes_fast = np.append(fast[1:], False)
+    precedes_fast[last] = False
+    run_starts = np.flatnonzero(fast & ~follows_fast)
+    run_ends = np.flatnonzero(fast & ~precedes_fast)
+    run_track = track_i[run_starts]
+    bursts = (run_ends > run_starts) & (run_ends < last[run_track])
+    burst_track = run_track[bursts]
+    burst_starts = run_starts[bursts] - track_starts[burst_track]
+    burst_lengths = run_ends[bursts] - run_starts[bursts] + 1
+    # non burst frames since the end of the previous burst of the track
+    prev_end = np.append(0, (burst_starts + burst_lengths)[:-1])
+    prev_end[np.append(True, burst_track[1:] != burst_track[:-1])] = 0
+    burst_ratio = (burst_starts - prev_end) / burst_lengths
+
+    num_bursts = np.bincount(burst_track, minlength=num_tracks)
+    burst_min = np.full(num_tracks, np.inf)
+    np.minimum.at(burst_min, burst_track, burst_ratio)
+    burst_max = np.full(num_tracks, -np.inf)
+    np.maximum.at(burst_max, burst_track, burst_ratio)
+    burst_min[num_bursts == 0] = 0
+    burst_max[num_bursts == 0] = 0
+    burst_mean = np.bincount(burst_track, burst_ratio, num_tracks) / np.maximum(
+        num_bursts, 1
+    )
+    total_burst_frames = np.bincount(burst_track, burst_lengths, num_tracks)
+
+    has_fast = speed_above > 0
+    speed_distance_ratio = np.where(
+        has_fast, low_speed_distance / np.where(has_fast, high_speed_distance, 1), 0
+    )
+    speed_ratio = np.where(has_fast, speed_below / np.maximum(speed_above, 1), 0)
+    return np.stack(
+        (
+            speed_distance_ratio,
+            speed_ratio,
+            burst_min,
+            burst_max,
+            burst_mean,
+            num_bursts / f_count,
+            total_burst_frames / f_count,
+        ),
+        axis=1,
+    )
@@ -144,10 +144,11 @@ def square_clip_flow(data_flow, frames_per_row, tile_dim, use_rgb=False):
     return new_frame, success
 
 
-def normalize(data, min=None, max=None, new_max=1):
+def normalize(data, min=None, max=None, new_max=1, out=None):
     """
     Normalize an array so that the values range from 0 -> new_max
     Returns normalized array, stats tuple (Success, min used, max used)
+    If out is given the result is written into it, out may be data
     """
     if data.size == 0:
         return np.zeros((data.shape)), (False, None, None)
@@ -158,11 +159,22 @@ def normalize(data, min=None, max=None, new_max=1):
     # print("normalizing with", max, min, new_max)
     if max == min:
         if max == 0:
-            return np.zeros((data.shape)), (False, max, min)
-        data = data / max
+            if out is None:
+                return np.zeros((data.shape)), (False, max, min)
+            out.fill(0)
+            return out, (False, max, min)
+        if out is None:
+            data = data / max
+        else:
+            data = np.divide(data, max, out=out)
         return data, (True, max, min)
 
-    data = new_max * (np.float32(data) - min) / (max - min)
+    if out is None:
+        data = new_max * (np.float32(data) - min) / (max - min)
+    else:
+        data = np.subtract(data, min, out=out, dtype=np.float32)
+        np.multiply(data, new_max, out=data)
+        np.divide(data, max - min, out=data)
     return data, (True, max, min)
 
 
@@ -245,18 +257,54 @@ def detect_objects_both(
     return components, small_mask, stats
 
 
-def detect_objects(image, otsus=False, threshold=30, kernel=(15, 15)):
-
-    image = np.uint8(image)
-    image = cv2.GaussianBlur(image, kernel, 0)
+def detect_objects(image, otsus=False, threshold=30, kernel=(15, 15), workspace=None):
+    """
+    Blurs, thresholds and closes image then labels the connected components
+    :param workspace: (optional) FrameWorkspace whose buffers are used for the
+    intermediate images, rather than allocating new ones
+    """
+    if workspace is None:
+        image = np.uint8(image)
+        image = cv2.GaussianBlur(image, kernel, 0)
+    else:
+        image_u8 = workspace.get("image", np.uint8)
+        np.copyto(image_u8, image, casting="unsafe")
+        image = cv2.GaussianBlur(
+            image_u8, kernel, 0, dst=workspace.get("blurred", np.uint8)
+        )
     flags = cv2.THRESH_BINARY
     if otsus:
         flags += cv2.THRESH_OTSU
-    _, image = cv2.threshold(image, threshold, 255, flags)
-    image = cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel)
+    if workspace is None:
+        _, image = cv2.threshold(image, threshold, 255, flags)
+        image = cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel)
+    else:
+        _, image = cv2.threshold(image, threshold, 255, flags, dst=image)
+        image = cv2.morphologyEx(
+            image, cv2.MORPH_CLOSE, kernel, dst=workspace.get("closed", np.uint8)
+        )
     return cv2.connectedComponentsWithStats(image)
 
 
+class FrameWorkspace:
+    """
+    Reusable buffers for processing frames of one shape, so filtering and detecting
+    objects each frame doesn't allocate new full frame arrays
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.buffers = {}
+
+    def get(self, name, dtype):
+        """Returns the buffer called name, allocating it if it doesn't exist with dtype"""
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.dtype != dtype:
+            buffer = np.empty(self.shape, dtype)
+            self.buffers[name] = buffer
+        return buffer
+
+
 def clear_frame(frame):
     filtered = frame.filtered
     thermal = frame.thermal
@@ -26,3 +26,7 @@ class Interpreter(ABC):
     def shape(self):
         """Prediction shape"""
         ...
+
+    def predict_batch(self, inputs):
+        """Predicts each of inputs, interpreters which can batch override this"""
+        return [self.predict(input_x) for input_x in inputs]
@@ -8,6 +8,7 @@ import math
 import logging
 from config.config import Config
 import json
+from ml_tools.shardindex import load_label_counts, load_schema, sampled_size
 
 seed = 1341
 tf.random.set_seed(seed)
@@ -30,8 +31,9 @@ def load_dataset(
     ignore_order.experimental_deterministic = (
         deterministic  # disable order, increase speed
     )
+    _, compression = load_schema(filenames)
     dataset = tf.data.TFRecordDataset(
-        filenames
+        filenames, compression_type=compression
     )  # automatically interleaves reads from multiple files
     dataset = dataset.with_options(
         ignore_order
@@ -123,10 +125,14 @@ def get_resampled(
 
     # weights[labels.index("cat")] = 0
 
+    label_counts = []
     for k, v in remapped.items():
         filenames = []
         for label in v:
-            filenames.append(tf.io.gfile.glob(f"{base_dir}/{label}-0*.tfrecord"))
+            filenames.extend(tf.io.gfile.glob(f"{base_dir}/{label}-0*.tfrecord"))
+        if label_counts is not None:
+            counts = load_label_counts(filenames, labels)
+            label_counts = None if counts is None else label_counts + [np.sum(counts)]
         dataset = load_dataset(
             filenames,
             image_size,
@@ -139,10 +145,20 @@ def get_resampled(
         dataset = dataset.shuffle(2048, reshuffle_each_iteration=True)
 
         datasets.append(dataset)
+    if label_counts is not None:
+        for label, count in zip(r_l, label_counts):
+            logging.info("Have %s for %s", count, label)
+        # an empty dataset would stop sampling straight away
+        weights = [w if count > 0 else 0 for w, count in zip(weights, label_counts)]
     resampled_ds = tf.data.Dataset.sample_from_datasets(
         datasets, weights=weights, stop_on_empty_dataset=stop_on_empty_dataset
     )
     resampled_ds = resampled_ds.shuffle(2048, reshuffle_each_iteration=reshuffle)
+    if label_counts is not None and stop_on_empty_dataset:
+        # keep the epoch size constant as it changes with each sampling
+        epoch_size = sampled_size(label_counts, weights)
+        logging.info("Setting dataset size to %s", epoch_size)
+        resampled_ds = resampled_ds.repeat(2).take(epoch_size)
     resampled_ds = resampled_ds.prefetch(buffer_size=AUTOTUNE)
     resampled_ds = resampled_ds.batch(batch_size)
     return resampled_ds, remapped
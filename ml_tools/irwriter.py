@@ -27,6 +27,7 @@ from PIL import Image
 from pathlib import Path
 
 import collections
+import functools
 import hashlib
 import io
 import json
@@ -44,6 +45,7 @@ from . import tfrecord_util
 from ml_tools import tools
 from ml_tools.imageprocessing import normalize, rotate
 from load.irtrackextractor import get_ir_back_filtered
+from ml_tools.tfwriter import write_tf_records
 import cv2
 import random
 import math
@@ -184,104 +186,90 @@ def create_tf_example(frame, image_dir, sample, labels, filename):
 
 
 def create_tf_records(
-    dataset, output_path, labels, back_thresh, num_shards=1, cropped=True, augment=False
+    dataset,
+    output_path,
+    labels,
+    back_thresh,
+    num_shards=1,
+    cropped=True,
+    augment=False,
+    by_label=True,
+    workers=None,
+    seed=None,
+    compression=None,
 ):
-    output_path = Path(output_path)
-    if output_path.is_dir():
-        logging.info("Clearing dir %s", output_path)
-        for child in output_path.glob("*"):
-            if child.is_file():
-                child.unlink()
-    output_path.mkdir(parents=True, exist_ok=True)
-    samples = dataset.samples
-    np.random.shuffle(samples)
-
-    dataset.load_db()
-    db = dataset.db
-    total_num_annotations_skipped = 0
-    num_labels = len(dataset.labels)
-    logging.info("writing to output path: %s for %s samples", output_path, len(samples))
-    lbl_counts = [0] * num_labels
-
-    writers = []
-    for label in labels:
-        for i in range(num_shards):
-
-            writers.append(
-                tf.io.TFRecordWriter(
-                    str(
-                        output_path
-                        / (f"{label}-%05d-of-%05d.tfrecord" % (i, num_shards))
-                    )
-                )
-            )
-    load_first = 200
-    try:
-        count = 0
-        while len(samples) > 0:
-            local_set = samples[:load_first]
-            samples = samples[load_first:]
-            loaded = []
-
-            for sample in local_set:
-                try:
-                    f = get_data(db, sample, cropped, back_thresh)
-                    if f is None:
-                        continue
-                    loaded.append((f, sample))
-                except Exception as e:
-                    logging.error("Got exception", exc_info=True)
-
-            loaded = np.array(loaded)
-            np.random.shuffle(loaded)
-            for data, sample in loaded:
-                try:
-                    tf_example, num_annotations_skipped = create_tf_example(
-                        data,
-                        output_path,
-                        sample,
-                        dataset.labels,
-                        sample.unique_track_id,
-                    )
-                    l_i = labels.index(sample.label)
-
-                    total_num_annotations_skipped += num_annotations_skipped
-                    writers[num_shards * l_i + lbl_counts[l_i] % num_shards].write(
-                        tf_example.SerializeToString()
-                    )
-                    count += 1
-                    lbl_counts[l_i] += 1
+    write_tf_records(
+        dataset.samples,
+        dataset.db_file,
+        output_path,
+        labels,
+        functools.partial(load_clip, cropped=cropped, back_thresh=back_thresh),
+        functools.partial(create_example, labels=dataset.labels),
+        num_shards=num_shards,
+        by_label=by_label,
+        workers=workers,
+        seed=seed,
+        compression=compression,
+    )
 
-                    if count % 100 == 0:
-                        logging.info("saved %s", count)
-                except Exception as e:
-                    logging.error("Error saving ", exc_info=True)
-            # break
-    except:
-        logging.error("Error saving track info", exc_info=True)
-    for writer in writers:
-        writer.close()
 
-    logging.info(
-        "Finished writing, skipped %d annotations.", total_num_annotations_skipped
+def create_example(data, sample, labels):
+    tf_example, _ = create_tf_example(
+        data, None, sample, labels, sample.unique_track_id
     )
+    return tf_example
 
 
-def get_data(db, sample, cropped, back_thresh):
-    background = db.get_clip_background(sample.clip_id)
+def load_clip(db, samples, cropped, back_thresh):
+    """Reads the background and frames of samples from one clip at once"""
+    clip_id = samples[0].clip_id
+    frame_numbers = sorted(set(sample.frame_number for sample in samples))
     try:
-        f = db.get_clip(
-            sample.clip_id,
-            [sample.frame_number],
-        )[0]
+        background = db.get_clip_background(clip_id)
+        frames = {
+            frame.frame_number: frame
+            for frame in db.get_clip(clip_id, frame_numbers, skip_missing=True)
+        }
     except Exception as e:
-        logging.error(
-            "Error gettin clip %s %s",
-            sample.clip_id,
-            sample,
-            exc_info=True,
-        )
-        return None
+        logging.error("Error gettin clip %s", clip_id, exc_info=True)
+        return [None] * len(samples)
+    loaded = []
+    for sample in samples:
+        if sample.frame_number not in frames:
+            logging.warning("Clip %s is missing frame %s", clip_id, sample.frame_number)
+            loaded.append(None)
+            continue
+        try:
+            # frames are changed by get_data and can be shared between samples
+            frame = frames[sample.frame_number].copy()
+            loaded.append(get_data(db, sample, cropped, back_thresh, frame, background))
+        except Exception as e:
+            logging.error("Got exception", exc_info=True)
+            loaded.append(None)
+    return loaded
+
+
+def get_data(db, sample, cropped, back_thresh, f=None, background=None):
+    """
+    :param f: (optional) the sample's frame, if already read from db
+    :param background: (optional) the clip's background, if already read from db
+    """
+    if background is None:
+        background = db.get_clip_background(sample.clip_id)
+    if f is None:
+        try:
+            f = db.get_clip(
+                sample.clip_id,
+                [sample.frame_number],
+            )[0]
+        except Exception as e:
+            logging.error(
+                "Error gettin clip %s %s",
+                sample.clip_id,
+                sample,
+                exc_info=True,
+            )
+            return None
     prev = f.thermal.copy()
     prev = sample.region.subimage(prev)
     if cropped:
@@ -706,6 +706,15 @@ class KerasModel(Interpreter):
         return model
 
     def classify_thermal_track(self, clip, track, keep_all=True, segment_frames=None):
+        return self.classify_track_data(
+            *self.prepare_thermal_track(clip, track, segment_frames)
+        )
+
+    def prepare_thermal_track(self, clip, track, segment_frames=None):
+        """
+        Crops the track's frames and splits it into segments
+        :return: (track id, frames by frame number, segments, features) ready for classify_tracks_data
+        """
         track_data = {}
         thermal_median = np.empty(len(track.bounds_history), dtype=np.uint16)
         for i, region in enumerate(track.bounds_history):
@@ -747,12 +756,7 @@ class KerasModel(Interpreter):
         features = None
         if self.params.mvm:
             features = forestmodel.process_track(clip, track)
-        return self.classify_track_data(
-            track.get_id(),
-            track_data,
-            segments,
-            features,
-        )
+        return track.get_id(), track_data, segments, features
 
     def classify_track(self, clip, track, keep_all=True, segment_frames=None):
         logging.debug("Classifying track %s", self.type)
@@ -760,6 +764,22 @@ class KerasModel(Interpreter):
             return self.classify_ir(clip, track)
         return self.classify_thermal_track(clip, track, keep_all, segment_frames)
 
+    def classify_tracks(self, clip_tracks, batch_size=None):
+        """
+        Classifies tracks, from one or more clips, predicting on the segments of all
+        tracks together
+        :param clip_tracks: list of (clip, track, segment frames or None)
+        :param batch_size: most segments to predict on in one call, None for all at once
+        :return: list of TrackPrediction in the same order as clip_tracks
+        """
+        if self.type == "IR":
+            return [self.classify_ir(clip, track) for clip, track, _ in clip_tracks]
+        tracks_data = [
+            self.prepare_thermal_track(clip, track, segment_frames)
+            for clip, track, segment_frames in clip_tracks
+        ]
+        return self.classify_tracks_data(tracks_data, batch_size)
+
     def classify_ir(self, clip, track, keep_all=True, segment_frames=None):
         data = []
         crop = True
@@ -812,58 +832,97 @@ class KerasModel(Interpreter):
         segments,
         features=None,
     ):
-        track_prediction = TrackPrediction(track_id, self.labels)
-        start = time.time()
-        predictions = []
-        smoothed_predictions = []
+        return self.classify_tracks_data([(track_id, data, segments, features)])[0]
+
+    def classify_tracks_data(self, tracks_data, batch_size=None):
+        """
+        Classifies many tracks, possibly from different clips, with their segments
+        predicted on together in batches of batch_size
+        :param tracks_data: list of (track id, frames by frame index, segments, features)
+        :return: list of TrackPrediction in the same order as tracks_data
+        """
+        track_predictions = []
         predict_me = []
-        prediction_frames = []
-        mass = []
-        for segment in segments:
-            segment_frames = []
-            median = np.zeros((len(segment.frame_indices)))
-            for frame_i in segment.frame_indices:
-                f = data[frame_i]
-                segment_frames.append(f.copy())
-            frames = preprocess_movement(
-                segment_frames,
-                self.params.square_width,
-                self.params.frame_size,
-                self.params.red_type,
-                self.params.green_type,
-                self.params.blue_type,
-                self.preprocess_fn,
-                reference_level=segment.frame_temp_median,
-                keep_edge=self.params.keep_edge,
-            )
-            if frames is None:
-                logging.warn("No frames to predict on")
-                continue
+        predict_features = []
+        track_segments = []
+        for track_id, data, segments, features in tracks_data:
+            start = time.time()
+            prediction_frames = []
+            mass = []
+            for segment in segments:
+                segment_frames = []
+                for frame_i in segment.frame_indices:
+                    f = data[frame_i]
+                    segment_frames.append(f.copy())
+                frames = preprocess_movement(
+                    segment_frames,
+                    self.params.square_width,
+                    self.params.frame_size,
+                    self.params.red_type,
+                    self.params.green_type,
+                    self.params.blue_type,
+                    self.preprocess_fn,
+                    reference_level=segment.frame_temp_median,
+                    keep_edge=self.params.keep_edge,
+                )
+                if frames is None:
+                    logging.warn("No frames to predict on")
+                    continue
 
-            predict_me.append(frames)
-            prediction_frames.append(segment.frame_indices)
-            mass.append(segment.mass)
-        if len(predict_me) > 0:
-            mass = np.array(mass)
-            mass = mass[:, None]
-            predict_me = np.array(predict_me)
-            if self.params.mvm:
-                features = features[np.newaxis, :]
-                features = np.repeat(features, len(predict_me), axis=0)
-                output = self.model.predict([predict_me, features])
-            else:
-                output = self.model.predict(predict_me)
+                predict_me.append(frames)
+                if self.params.mvm:
+                    predict_features.append(features)
+                prediction_frames.append(segment.frame_indices)
+                mass.append(segment.mass)
+            track_predictions.append(TrackPrediction(track_id, self.labels))
+            track_segments.append((prediction_frames, mass, time.time() - start))
 
-            track_prediction.classified_clip(
-                output, output * output * mass, prediction_frames
+        start = time.time()
+        output = self.predict_segments(predict_me, predict_features, batch_size)
+        predict_time = time.time() - start
+
+        output_i = 0
+        for track_prediction, (prediction_frames, mass, prepare_time) in zip(
+            track_predictions, track_segments
+        ):
+            num_segments = len(prediction_frames)
+            if num_segments > 0:
+                track_output = output[output_i : output_i + num_segments]
+                output_i += num_segments
+                mass = np.array(mass)
+                mass = mass[:, None]
+                track_prediction.classified_clip(
+                    track_output, track_output * track_output * mass, prediction_frames
+                )
+            # share the prediction time out by number of segments
+            track_prediction.classify_time = prepare_time + predict_time * (
+                num_segments / max(1, len(predict_me))
             )
+        return track_predictions
 
-        track_prediction.classify_time = time.time() - start
-        return track_prediction
+    def predict_segments(self, predict_me, features=None, batch_size=None):
+        """Predicts on preprocessed segments, batch_size segments per predict call"""
+        if len(predict_me) == 0:
+            return None
+        predict_me = np.array(predict_me)
+        if self.params.mvm:
+            features = np.array(features)
+        if batch_size is None:
+            batch_size = len(predict_me)
+        output = []
+        for start in range(0, len(predict_me), batch_size):
+            batch = predict_me[start : start + batch_size]
+            if self.params.mvm:
+                batch = [batch, features[start : start + batch_size]]
+            output.append(self.model.predict(batch, batch_size=batch_size))
+        return np.concatenate(output)
 
     def predict(self, frame):
         return self.model.predict(frame[np.newaxis, :])[0]
 
+    def predict_batch(self, frames):
+        return self.model.predict(np.array(frames))
+
     def classify_frame(self, frame, thermal_median, preprocess=True):
         if preprocess:
             frame = preprocess_frame(
@@ -0,0 +1,394 @@
+"""
+Columns of the samples of a dataset, so grouping, weighting and sampling are done
+with numpy on the columns rather than by walking lists of sample objects.
+Frame samples are only held as columns, their objects are made when asked for.
+"""
+
+import datetime
+
+import numpy as np
+
+from ml_tools.datasetstructures import FrameSample
+from track_extraction.track.region import Region
+
+REGION_DTYPE = np.dtype(
+    [
+        ("left", np.int32),
+        ("top", np.int32),
+        ("width", np.int32),
+        ("height", np.int32),
+        ("centroid", np.int32, (2,)),
+        ("pixel_variance", np.float32),
+        ("id", np.int32),
+        ("was_cropped", bool),
+        ("blank", bool),
+        ("is_along_border", bool),
+    ]
+)
+
+SAMPLE_DTYPE = np.dtype(
+    [
+        ("clip_id", np.int64),
+        ("track_id", np.int64),
+        # index into SampleTable.labels
+        ("label", np.int16),
+        # index into SampleTable.bins
+        ("bin", np.int32),
+        ("mass", np.float32),
+        ("weight", np.float64),
+        # first and last frame number of the sample
+        ("start_frame", np.int32),
+        ("end_frame", np.int32),
+        # id of the sample object
+        ("id", np.int64),
+        # index into SampleTable.objects, -1 for frame samples held as columns
+        ("object", np.int32),
+        # the rest are only used by frame samples
+        # index into SampleTable.tracks
+        ("track", np.int32),
+        # seconds from the track's start time
+        ("seconds", np.float64),
+        ("temp_median", np.float32),
+        ("augment", bool),
+        ("region", REGION_DTYPE),
+    ]
+)
+
+
+class SampleTable:
+    """
+    A row of SAMPLE_DTYPE for each sample. Frame samples are only held as rows and
+    a new FrameSample is made from its row each time it is asked for with samples,
+    other samples keep their object next to the row and weights changed in the
+    table are copied to the objects when they are asked for.
+    """
+
+    def __init__(self, capacity=16):
+        self._rows = np.zeros(capacity, dtype=SAMPLE_DTYPE)
+        # rows whose weight has changed since their object was last returned
+        self._stale = np.zeros(capacity, dtype=bool)
+        self.count = 0
+        # rows of each label, counted when asked for after the rows change
+        self._label_counts = None
+        self.objects = []
+        self.labels = []
+        self._label_index = {}
+        self.bins = []
+        self._bin_index = {}
+        # (clip_id, track_id, camera, start time) of the tracks of frame samples
+        self.tracks = []
+        self._track_index = {}
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def rows(self):
+        return self._rows[: self.count]
+
+    @property
+    def label(self):
+        return self._rows["label"][: self.count]
+
+    @property
+    def bin(self):
+        return self._rows["bin"][: self.count]
+
+    @property
+    def weight(self):
+        return self._rows["weight"][: self.count]
+
+    def label_index(self, label):
+        index = self._label_index.get(label)
+        if index is None:
+            index = len(self.labels)
+            self._label_index[label] = index
+            self.labels.append(label)
+        return index
+
+    def bin_index(self, bin_id):
+        index = self._bin_index.get(bin_id)
+        if index is None:
+            index = len(self.bins)
+            self._bin_index[bin_id] = index
+            self.bins.append(bin_id)
+        return index
+
+    def track_index(self, clip_id, track_id, camera, start_time):
+        """
+        Index of a track in tracks, start_time is only used when the track is
+        first added as the time the seconds of its frame samples count from
+        """
+        key = (clip_id, track_id, camera)
+        index = self._track_index.get(key)
+        if index is None:
+            index = len(self.tracks)
+            self._track_index[key] = index
+            self.tracks.append((clip_id, track_id, camera, start_time))
+        return index
+
+    def _grow(self, size):
+        if size <= len(self._rows):
+            return
+        capacity = max(size, 2 * len(self._rows))
+        rows = np.zeros(capacity, dtype=SAMPLE_DTYPE)
+        rows[: self.count] = self.rows
+        stale = np.zeros(capacity, dtype=bool)
+        stale[: self.count] = self._stale[: self.count]
+        self._rows = rows
+        self._stale = stale
+
+    def append(self, sample):
+        self._grow(self.count + 1)
+        frames = sample.frame_indices
+        row = self._rows[self.count]
+        row["clip_id"] = sample.clip_id
+        row["track_id"] = sample.track_id
+        row["label"] = self.label_index(sample.label)
+        row["bin"] = self.bin_index(sample.bin_id)
+        row["mass"] = sample.mass
+        row["weight"] = sample.sample_weight
+        row["start_frame"] = np.min(frames)
+        row["end_frame"] = np.max(frames)
+        row["id"] = sample.id
+        if isinstance(sample, FrameSample):
+            track = self.track_index(
+                sample.clip_id, sample.track_id, sample.camera, sample.start_time
+            )
+            row["object"] = -1
+            row["track"] = track
+            row["seconds"] = (sample.start_time - self.tracks[track][3]).total_seconds()
+            row["temp_median"] = sample.temp_median
+            row["augment"] = sample.augment
+            set_region(row["region"], sample.region)
+        else:
+            row["object"] = len(self.objects)
+            self.objects.append(sample)
+        self.count += 1
+        self._label_counts = None
+
+    def extend(self, samples):
+        for sample in samples:
+            self.append(sample)
+
+    def append_frames(
+        self, track, label, regions, temp_median, seconds, bin_ids, ids=None
+    ):
+        """
+        Adds frame samples of one track without making their objects
+        :param track: (clip_id, track_id, camera, start time)
+        :param regions: the region of each frame sample
+        :param seconds: seconds from the track start time of each frame sample
+        :param bin_ids: the bin id of each frame sample
+        :param ids: sample ids, defaults to new FrameSample ids
+        """
+        clip_id, track_id, camera, start_time = track
+        count = len(regions)
+        if count == 0:
+            return
+        if ids is None:
+            ids = np.arange(FrameSample._frame_id, FrameSample._frame_id + count)
+            FrameSample._frame_id += count
+        self._grow(self.count + count)
+        rows = self._rows[self.count : self.count + count]
+        rows["clip_id"] = clip_id
+        rows["track_id"] = track_id
+        rows["label"] = self.label_index(label)
+        rows["bin"] = [self.bin_index(bin_id) for bin_id in bin_ids]
+        rows["mass"] = [region.mass for region in regions]
+        rows["weight"] = 1
+        frame_numbers = [region.frame_number for region in regions]
+        rows["start_frame"] = frame_numbers
+        rows["end_frame"] = frame_numbers
+        rows["id"] = ids
+        rows["object"] = -1
+        rows["track"] = self.track_index(clip_id, track_id, camera, start_time)
+        rows["seconds"] = seconds
+        rows["temp_median"] = temp_median
+        rows["augment"] = False
+        for row, region in zip(rows["region"], regions):
+            set_region(row, region)
+        self.count += count
+        self._label_counts = None
+
+    def extend_table(self, table, rows=None, label_map=None, renumber=False):
+        """
+        Adds rows of another table, or all its rows
+        :param label_map: dict of labels to change to another label
+        :param renumber: give the samples new ids, for tables made in another process
+        """
+        if rows is None:
+            rows = np.arange(len(table))
+        rows = np.asarray(rows, dtype=np.intp)
+        count = len(rows)
+        if count == 0:
+            return
+        if label_map is None:
+            label_map = {}
+        new = table.rows[rows]
+        labels = np.array(
+            [self.label_index(label_map.get(label, label)) for label in table.labels],
+            dtype=np.int16,
+        )
+        new["label"] = labels[new["label"]]
+        bins = np.array([self.bin_index(bin_id) for bin_id in table.bins])
+        new["bin"] = bins[new["bin"]]
+        tracks = np.array([self.track_index(*track) for track in table.tracks])
+        if len(tracks) > 0:
+            # frame samples keep their time from their own track's start time
+            offsets = np.array(
+                [
+                    (start_time - self.tracks[index][3]).total_seconds()
+                    for (_, _, _, start_time), index in zip(table.tracks, tracks)
+                ]
+            )
+            is_frame = new["object"] < 0
+            new["seconds"][is_frame] += offsets[new["track"][is_frame]]
+            new["track"][is_frame] = tracks[new["track"][is_frame]]
+        stale = table._stale[rows]
+        for i in np.flatnonzero(new["object"] >= 0):
+            sample = table.objects[new["object"][i]]
+            if renumber:
+                sample.renumber()
+                new["id"][i] = sample.id
+            self.objects.append(sample)
+            new["object"][i] = len(self.objects) - 1
+        if renumber:
+            is_frame = np.flatnonzero(new["object"] < 0)
+            new["id"][is_frame] = np.arange(len(is_frame)) + FrameSample._frame_id
+            FrameSample._frame_id += len(is_frame)
+        self._grow(self.count + count)
+        self._rows[self.count : self.count + count] = new
+        self._stale[self.count : self.count + count] = stale
+        self.count += count
+        self._label_counts = None
+
+    def label_rows(self, labels):
+        """Indices of the rows of each of labels, one label after another"""
+        rows = [
+            np.flatnonzero(self.label == self._label_index[label])
+            for label in labels
+            if label in self._label_index
+        ]
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate(rows)
+
+    def label_counts(self):
+        """Number of rows of each label in labels"""
+        if self._label_counts is None or len(self._label_counts) != len(self.labels):
+            self._label_counts = np.bincount(self.label, minlength=len(self.labels))
+        return self._label_counts
+
+    def label_count(self, label):
+        index = self._label_index.get(label)
+        if index is None:
+            return 0
+        return int(self.label_counts()[index])
+
+    def group_rows(self, column):
+        """Returns the values of column and the indices of the rows of each value"""
+        order = np.argsort(self.rows[column], kind="stable")
+        values, starts = np.unique(self.rows[column][order], return_index=True)
+        return values, np.split(order, starts[1:])
+
+    def set_weight(self, weight, rows=None):
+        if rows is None:
+            rows = slice(0, self.count)
+        self._rows["weight"][rows] = weight
+        self._stale[rows] = True
+
+    def samples(self, rows=None):
+        """Returns the sample objects of rows, or of all rows"""
+        if rows is None:
+            rows = np.arange(self.count)
+        rows = np.asarray(rows, dtype=np.intp)
+        stale = rows[self._stale[rows]]
+        if len(stale) > 0:
+            for row in stale:
+                index = self._rows["object"][row]
+                if index >= 0:
+                    self.objects[index].weight = np.float16(self._rows["weight"][row])
+            self._stale[stale] = False
+        result = []
+        for row in self._rows[rows]:
+            if row["object"] >= 0:
+                result.append(self.objects[row["object"]])
+            else:
+                result.append(self.frame_sample(row))
+        return result
+
+    def frame_sample(self, row):
+        """Makes the FrameSample of a row"""
+        clip_id, track_id, camera, start_time = self.tracks[row["track"]]
+        frame_number = int(row["start_frame"])
+        region = row["region"]
+        sample = FrameSample(
+            clip_id,
+            track_id,
+            frame_number,
+            self.labels[row["label"]],
+            row["temp_median"],
+            None,
+            Region(
+                int(region["left"]),
+                int(region["top"]),
+                int(region["width"]),
+                int(region["height"]),
+                centroid=region["centroid"].tolist(),
+                mass=int(row["mass"]),
+                frame_number=frame_number,
+                pixel_variance=float(region["pixel_variance"]),
+                id=int(region["id"]),
+                was_cropped=bool(region["was_cropped"]),
+                blank=bool(region["blank"]),
+                is_along_border=bool(region["is_along_border"]),
+            ),
+            weight=np.float16(row["weight"]),
+            camera=camera,
+            start_time=start_time + datetime.timedelta(seconds=row["seconds"]),
+            augment=bool(row["augment"]),
+        )
+        sample.id = int(row["id"])
+        return sample
+
+    def take(self, rows):
+        """Keeps only rows, in the order given"""
+        rows = np.asarray(rows, dtype=np.intp)
+        count = len(rows)
+        self._rows[:count] = self.rows[rows]
+        self._stale[:count] = self._stale[rows]
+        self.count = count
+        self._label_counts = None
+        # drop the objects of rows which are gone
+        has_object = np.flatnonzero(self.rows["object"] >= 0)
+        objects = self.rows["object"]
+        self.objects = [self.objects[index] for index in objects[has_object]]
+        objects[has_object] = np.arange(len(has_object))
+
+    def keep(self, mask):
+        """Keeps the rows where mask is True"""
+        self.take(np.flatnonzero(mask))
+
+    def rows_of(self, samples):
+        """Indices of the rows of sample objects"""
+        index = {sample_id: row for row, sample_id in enumerate(self.rows["id"])}
+        return np.array([index[sample.id] for sample in samples], dtype=np.intp)
+
+    def clear(self):
+        self.count = 0
+        self._label_counts = None
+        self.objects = []
+
+
+def set_region(row, region):
+    row["left"] = region.left
+    row["top"] = region.top
+    row["width"] = region.width
+    row["height"] = region.height
+    row["centroid"] = region.centroid
+    row["pixel_variance"] = region.pixel_variance
+    row["id"] = region.id
+    row["was_cropped"] = region.was_cropped
+    row["blank"] = region.blank
+    row["is_along_border"] = region.is_along_border
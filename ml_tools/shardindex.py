@@ -0,0 +1,169 @@
+"""
+Index files written next to each TFRecord shard, holding the number of records, how
+many there are of each label and where each record starts, so a dataset's size and
+label distribution can be known without reading its records.
+The index also holds the schema of the shard, how its images are encoded and how the
+shard is compressed, shards written before this have float images and no compression.
+Offsets are of the uncompressed records.
+"""
+
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".index.json"
+# each record is an 8 byte length and a 4 byte crc of it, the data then a 4 byte crc
+RECORD_OVERHEAD = 16
+
+# how the thermal images of a record are stored, as float32 lists or uint8 bytes
+FLOAT_ENCODING = 0
+UINT8_ENCODING = 1
+
+
+def index_path(shard_path):
+    return Path(str(shard_path) + INDEX_SUFFIX)
+
+
+class ShardIndex:
+    def __init__(
+        self,
+        name,
+        records=0,
+        label_counts=None,
+        offsets=None,
+        size=0,
+        encoding=FLOAT_ENCODING,
+        compression=None,
+    ):
+        self.name = name
+        self.encoding = encoding
+        self.compression = compression
+        self.records = records
+        self.label_counts = {} if label_counts is None else label_counts
+        self.offsets = [] if offsets is None else offsets
+        self.size = size
+
+    def add(self, label, num_bytes):
+        """Records a serialized example of num_bytes written to the end of the shard"""
+        self.offsets.append(self.size)
+        self.size += num_bytes + RECORD_OVERHEAD
+        self.records += 1
+        self.label_counts[label] = self.label_counts.get(label, 0) + 1
+
+    def save(self, filename):
+        with open(filename, "w") as f:
+            json.dump(
+                {
+                    "version": INDEX_VERSION,
+                    "name": self.name,
+                    "records": self.records,
+                    "size": self.size,
+                    "encoding": self.encoding,
+                    "compression": self.compression,
+                    "label_counts": self.label_counts,
+                    "offsets": self.offsets,
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "r") as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(
+                "{} has index version {} expected {}".format(
+                    filename, meta.get("version"), INDEX_VERSION
+                )
+            )
+        return cls(
+            meta["name"],
+            meta["records"],
+            meta["label_counts"],
+            meta["offsets"],
+            meta["size"],
+            meta.get("encoding", FLOAT_ENCODING),
+            meta.get("compression"),
+        )
+
+
+def load_schema(filenames):
+    """
+    Returns the image encoding and compression of the shards filenames, shards without
+    an index are taken to have float images and no compression
+    """
+    schemas = set()
+    for filename in filenames:
+        path = index_path(filename)
+        if path.exists():
+            index = ShardIndex.load(path)
+            schemas.add((index.encoding, index.compression))
+        else:
+            schemas.add((FLOAT_ENCODING, None))
+    if len(schemas) > 1:
+        raise ValueError("Shards have different schemas {}".format(schemas))
+    if len(schemas) == 0:
+        return FLOAT_ENCODING, None
+    return schemas.pop()
+
+
+def load_label_counts(filenames, labels, label_map=None):
+    """
+    Returns the number of records of each label in the shards filenames, or None if
+    any shard has no index
+    :param label_map: index of the label each of labels is counted as, for labels
+    which are remapped when read
+    """
+    counts = np.zeros(len(labels), dtype=np.int64)
+    for filename in filenames:
+        path = index_path(filename)
+        if not path.exists():
+            logging.info("No index for %s, counting records", filename)
+            return None
+        index = ShardIndex.load(path)
+        for label, count in index.label_counts.items():
+            if label not in labels:
+                continue
+            l_i = labels.index(label)
+            if label_map is not None:
+                l_i = label_map[l_i]
+            counts[l_i] += count
+    return counts
+
+
+def rejection_resample_size(counts, target_dist):
+    """
+    Expected number of records from tf.data rejection_resample of a dataset with counts
+    records of each label, given counts as the initial distribution.
+    A record is taken unchanged with the probability of the smallest target to
+    initial ratio, otherwise drawn from the records accepted in proportion to the
+    ratio. The resample stops when either of these runs out.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    total = np.sum(counts)
+    if total == 0:
+        return 0
+    initial = counts / total
+    target = np.asarray(target_dist, dtype=np.float64)
+    target = target / np.sum(target)
+    ratio = target / (initial + np.finfo(np.float64).tiny)
+    max_ratio = np.max(ratio)
+    min_ratio = np.min(ratio)
+    return int(total / max(min_ratio, max_ratio - min_ratio))
+
+
+def sampled_size(counts, weights):
+    """
+    Expected number of records from tf.data sample_from_datasets of datasets with counts
+    records, which stops when a dataset with weight runs out
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    weights = weights / np.sum(weights)
+    sampled = weights > 0
+    if not np.any(sampled):
+        return 0
+    return int(np.min(counts[sampled] / weights[sampled]))
@@ -0,0 +1,73 @@
+import h5py
+import numpy as np
+
+from config.config import Config
+from ml_tools.dataset import Dataset
+from ml_tools.trackdatabase import TrackDatabase
+
+
+def create_db(tmp_path, num_clips, num_frames):
+    filename = str(tmp_path / "dataset.hdf5")
+    TrackDatabase(filename)
+    with h5py.File(filename, "a") as f:
+        for clip_id in range(1, num_clips + 1):
+            clip = f["clips"].create_group(str(clip_id))
+            clip.attrs["finished"] = True
+            clip.attrs["start_time"] = "2022-01-01T10:00:00+13:00"
+            clip.attrs["filename"] = f"{clip_id}.cptv"
+            clip.attrs["device"] = "camera"
+            clip.attrs["frame_temp_median"] = np.full(num_frames, 3000)
+            track = clip.create_group("1")
+            track.attrs["tag"] = "possum"
+            track.attrs["start_time"] = "2022-01-01T10:00:00+13:00"
+            track.attrs["end_time"] = "2022-01-01T10:00:33+13:00"
+            track.attrs["frames"] = num_frames
+            track.attrs["start_frame"] = 0
+            track.attrs["score"] = 1.0
+            track.attrs["bounds_history"] = np.array(
+                [[10, 10, 30, 30, frame, 100, 0] for frame in range(num_frames)]
+            )
+            track.attrs["mass_history"] = np.full(num_frames, 100)
+    return filename
+
+
+def load_samples(db_file, workers, train_type=None):
+    config = Config.get_defaults()
+    config.labels = ["possum"]
+    if train_type is not None:
+        config.train.type = train_type
+    dataset = Dataset(db_file, "test", config)
+    np.random.seed(1)
+    dataset.load_clips(workers=workers)
+    if train_type == "IR":
+        # frame samples are only made when asked for
+        assert dataset.sample_table.objects == []
+    return [
+        (sample.clip_id, sample.track_id, list(sample.frame_indices), sample.id)
+        for sample in dataset.samples
+    ]
+
+
+def strip_ids(samples):
+    return [sample[:-1] for sample in samples]
+
+
+class TestLoadClips:
+    def test_workers_sample_the_same(self, tmp_path):
+        db_file = create_db(tmp_path, num_clips=12, num_frames=300)
+        samples = load_samples(db_file, workers=1)
+        assert len(samples) > 12
+        assert strip_ids(samples) == strip_ids(load_samples(db_file, workers=3))
+        # each clip draws its own segments
+        first_segments = {}
+        for clip_id, _, frames, _ in samples:
+            first_segments.setdefault(clip_id, tuple(frames))
+        assert len(set(first_segments.values())) == 12
+
+    def test_ir_frame_samples(self, tmp_path):
+        db_file = create_db(tmp_path, num_clips=4, num_frames=100)
+        samples = load_samples(db_file, workers=1, train_type="IR")
+        assert len(samples) > 0
+        other = load_samples(db_file, workers=2, train_type="IR")
+        assert strip_ids(samples) == strip_ids(other)
+        assert len(set(sample_id for *_, sample_id in other)) == len(other)
@@ -0,0 +1,115 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+from ml_tools.forestmodel import batch_forest_features, forest_features
+from ml_tools.frame import Frame
+from track_extraction.track.region import Region
+
+# features of make_tracks recorded from the FrameFeatures implementation
+EXPECTED_FILE = Path(__file__).parent.parent / "tests" / "forest-features.json"
+# the second track has a crop of one constant value, whose thermal std used to
+# be float32 rounding noise rather than 0.  These are the std, max, min and
+# diff of its mean_snr
+CONSTANT_CROP_TRACK = 1
+CONSTANT_CROP_FEATURES = [39, 75, 111, 147]
+
+
+def make_tracks():
+    """Returns (forest_features arguments, cropped) of some synthetic tracks"""
+    rng = np.random.default_rng(7)
+    background = rng.normal(3000, 20, (120, 160)).astype(np.float32)
+    frame_temp_median = rng.normal(3000, 5, 100).astype(np.float32)
+    tracks = []
+    for track_i, (num_frames, cropped) in enumerate(
+        [(14, True), (9, True), (5, True), (10, False)]
+    ):
+        frames = []
+        regions = []
+        for i in range(num_frames):
+            left = 20 + 3 * i + track_i
+            top = 30 + 2 * i
+            width = 8 + i % 4
+            height = 10 + (i * 3) % 5
+            blank = track_i == 0 and i == 6
+            region = Region(
+                left,
+                top,
+                width,
+                height,
+                centroid=[left + width // 2, top + height // 2],
+                mass=width * height,
+                frame_number=i,
+                blank=blank,
+            )
+            thermal = background + rng.normal(0, 5, background.shape)
+            y, x = np.mgrid[:height, :width]
+            thermal[top : top + height, left : left + width] += 40 + 10 * np.sin(
+                x + y + i
+            )
+            if track_i == 1 and i == 4:
+                thermal[top : top + height, left : left + width] = 3012.7
+            if cropped:
+                thermal = region.subimage(thermal)
+            frames.append(
+                Frame(thermal.astype(np.float32), None, None, i, region=region)
+            )
+            regions.append(region)
+        tracks.append(((frames, background, frame_temp_median, regions), cropped))
+    return tracks
+
+
+def load_expected():
+    with open(EXPECTED_FILE) as f:
+        return [None if e is None else np.array(e) for e in json.load(f)]
+
+
+class TestForestFeatures:
+    def test_matches_frame_features(self):
+        expected = load_expected()
+        for i, ((track, cropped), track_expected) in enumerate(
+            zip(make_tracks(), expected)
+        ):
+            features = forest_features(*track, cropped=cropped)
+            if track_expected is None:
+                assert features is None
+                continue
+            assert features.shape == track_expected.shape
+            mask = np.ones(len(features), dtype=bool)
+            if i == CONSTANT_CROP_TRACK:
+                mask[CONSTANT_CROP_FEATURES] = False
+            # FrameFeatures took peak_snr from float32 maxima and means, the
+            # subtraction leaves it good to about 1e-5
+            np.testing.assert_allclose(
+                features[mask], track_expected[mask], rtol=5e-5, atol=1e-6
+            )
+
+    def test_constant_crop_has_no_std(self):
+        expected = load_expected()[CONSTANT_CROP_TRACK]
+        track, _ = make_tracks()[CONSTANT_CROP_TRACK]
+        frames, background, frame_temp_median, regions = track
+        features = forest_features(frames, background, frame_temp_median, regions)
+        # the old implementation took float32 rounding noise as the minimum
+        assert 0 < expected[111] < 1e-4
+        np.testing.assert_allclose(
+            features[[39, 75]], expected[[39, 75]], rtol=0, atol=1e-4
+        )
+        assert features[147] == features[75] - features[111]
+
+        # a zero mean_snr is left out of the minimum, as if the frame were blank
+        regions[4] = regions[4].copy()
+        regions[4].blank = True
+        without_crop = forest_features(frames, background, frame_temp_median, regions)
+        assert features[111] == without_crop[111]
+
+    def test_batch_matches_each_track(self):
+        tracks = [track for track, cropped in make_tracks() if cropped]
+        batch = batch_forest_features(tracks)
+        assert len(batch) == len(tracks)
+        for track, features in zip(tracks, batch):
+            expected = forest_features(*track)
+            if expected is None:
+                assert features is None
+            else:
+                np.testing.assert_array_equal(features, expected)
@@ -0,0 +1,103 @@
+import datetime
+
+import numpy as np
+
+from ml_tools.datasetstructures import FrameSample
+from ml_tools.sampletable import SampleTable
+from track_extraction.track.region import Region
+
+
+def frame_sample(clip_id, track_id, frame_number, label):
+    region = Region(0, 0, 10, 10, centroid=[5, 5], mass=20, frame_number=frame_number)
+    return FrameSample(
+        clip_id,
+        track_id,
+        frame_number,
+        label,
+        0,
+        None,
+        region,
+        weight=1,
+        camera="camera",
+        start_time=datetime.datetime(2022, 1, 1),
+    )
+
+
+def assert_same_sample(sample, expected):
+    for key in ["clip_id", "track_id", "frame_number", "label", "camera"]:
+        assert getattr(sample, key) == getattr(expected, key)
+    assert sample.id == expected.id
+    assert sample.start_time == expected.start_time
+    assert sample.temp_median == expected.temp_median
+    assert sample.augment == expected.augment
+    assert list(sample.region.to_array()) == list(expected.region.to_array())
+    assert sample.region.centroid == expected.region.centroid
+
+
+class TestSampleTable:
+    def test_columns(self):
+        table = SampleTable(capacity=2)
+        samples = [
+            frame_sample(1, 2, 10, "cat"),
+            frame_sample(1, 2, 70, "cat"),
+            frame_sample(3, 4, 5, "possum"),
+            frame_sample(1, 2, 20, "cat"),
+        ]
+        table.extend(samples)
+        assert len(table) == 4
+        assert table.labels == ["cat", "possum"]
+        assert table.bins == ["1-2-0", "1-2-1", "3-4-0"]
+        assert list(table.bin) == [0, 1, 2, 0]
+        assert list(table.label_counts()) == [3, 1]
+        assert list(table.label_rows(["possum", "cat"])) == [2, 0, 1, 3]
+        assert list(table.rows["start_frame"]) == [10, 70, 5, 20]
+        # frame samples are only kept as rows
+        assert table.objects == []
+        for sample, expected in zip(table.samples([3, 0]), [samples[3], samples[0]]):
+            assert_same_sample(sample, expected)
+        assert list(table.rows_of([samples[2], samples[1]])) == [2, 1]
+        bins, rows = table.group_rows("bin")
+        assert list(bins) == [0, 1, 2]
+        assert [list(bin_rows) for bin_rows in rows] == [[0, 3], [1], [2]]
+
+    def test_label_counts_follow_rows(self):
+        table = SampleTable()
+        table.extend([frame_sample(1, 1, i, "cat") for i in range(3)])
+        assert table.label_count("cat") == 3
+        assert table.label_count("possum") == 0
+        table.append(frame_sample(2, 1, 0, "possum"))
+        assert table.label_count("possum") == 1
+        table.keep(table.label == table.label_index("cat"))
+        assert table.label_count("cat") == 3
+        assert table.label_count("possum") == 0
+        table.clear()
+        assert table.label_count("cat") == 0
+
+    def test_take_and_weights(self):
+        table = SampleTable()
+        samples = [frame_sample(1, 1, i, "cat") for i in range(5)]
+        table.extend(samples)
+        table.set_weight(np.arange(5) / 4)
+        table.take([4, 2])
+        assert [s.id for s in table.samples()] == [samples[4].id, samples[2].id]
+        assert [s.weight for s in table.samples()] == [1, np.float16(0.5)]
+        table.keep(table.weight > 0.6)
+        assert [s.id for s in table.samples()] == [samples[4].id]
+
+    def test_extend_table(self):
+        chunk = SampleTable()
+        samples = [frame_sample(1, 1, i, "cat") for i in range(3)]
+        samples.append(frame_sample(2, 1, 0, "possum"))
+        samples[1].start_time = datetime.datetime(2022, 1, 2)
+        chunk.extend(samples)
+        table = SampleTable()
+        table.append(frame_sample(3, 1, 0, "possum"))
+        table.extend_table(chunk, [3, 1], label_map={"cat": "animal"})
+        assert table.labels == ["possum", "animal"]
+        loaded = table.samples()
+        assert loaded[1].label == "possum"
+        assert_same_sample(loaded[1], samples[3])
+        assert loaded[2].label == "animal"
+        assert loaded[2].start_time == samples[1].start_time
+        table.extend_table(chunk, renumber=True)
+        assert len(set(table.rows["id"])) == len(table)
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from ml_tools.shardindex import (
+    FLOAT_ENCODING,
+    UINT8_ENCODING,
+    ShardIndex,
+    index_path,
+    load_label_counts,
+    load_schema,
+    rejection_resample_size,
+    sampled_size,
+)
+
+
+def simulate_rejection_resample(counts, target, rng):
+    """Number of records taken by a sampling like tf.data rejection_resample"""
+    initial = counts / np.sum(counts)
+    ratio = target / (initial + np.finfo(np.float64).tiny)
+    mix = np.min(ratio)
+    if mix == np.max(ratio):
+        return np.sum(counts)
+    accept = (ratio - mix) / (np.max(ratio) - mix)
+    records = np.repeat(np.arange(len(counts)), counts)
+    accepted = np.sum(rng.random(len(records)) < accept[rng.permutation(records)])
+    original = len(records)
+    taken = 0
+    while True:
+        if rng.random() < mix:
+            if original == 0:
+                return taken
+            original -= 1
+        else:
+            if accepted == 0:
+                return taken
+            accepted -= 1
+        taken += 1
+
+
+class TestShardIndex:
+    def test_save_load(self, tmp_path):
+        shard = tmp_path / "cat-00000-of-00001.tfrecord"
+        index = ShardIndex(shard.name)
+        for label, size in [("cat", 10), ("possum", 4), ("cat", 7)]:
+            index.add(label, size)
+        index.save(index_path(shard))
+        loaded = ShardIndex.load(index_path(shard))
+        assert loaded.records == 3
+        assert loaded.label_counts == {"cat": 2, "possum": 1}
+        assert loaded.offsets == [0, 26, 46]
+        assert loaded.size == 69
+
+        labels = ["cat", "insect", "false-positive"]
+        other = tmp_path / "insect-00000-of-00001.tfrecord"
+        index = ShardIndex(other.name)
+        index.add("insect", 3)
+        index.add("dog", 3)
+        index.save(index_path(other))
+        counts = load_label_counts([shard, other], labels, label_map=[0, 2, 2])
+        assert list(counts) == [2, 0, 1]
+        assert load_label_counts([shard, tmp_path / "missing.tfrecord"], labels) is None
+
+    def test_schema(self, tmp_path):
+        old = tmp_path / "00000-of-00002.tfrecord"
+        assert load_schema([old]) == (FLOAT_ENCODING, None)
+        new = tmp_path / "00001-of-00002.tfrecord"
+        ShardIndex(new.name, encoding=UINT8_ENCODING, compression="GZIP").save(
+            index_path(new)
+        )
+        assert load_schema([new]) == (UINT8_ENCODING, "GZIP")
+        with pytest.raises(ValueError):
+            load_schema([old, new])
+
+    def test_epoch_sizes(self):
+        rng = np.random.default_rng(8)
+        for counts, target in [
+            ([1000, 300, 50], [0.4, 0.4, 0.2]),
+            ([1000, 300, 0], [0.5, 0.5, 0]),
+            ([500, 500], [0.5, 0.5]),
+        ]:
+            counts = np.array(counts)
+            target = np.array(target)
+            taken = [
+                simulate_rejection_resample(counts, target, rng) for _ in range(20)
+            ]
+            expected = rejection_resample_size(counts, target)
+            assert abs(np.mean(taken) - expected) < 0.05 * expected
+        assert sampled_size([100, 30, 500], [1, 1, 0]) == 60
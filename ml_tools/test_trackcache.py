@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from ml_tools.frame import Frame
+from ml_tools.trackcache import TrackCache
+from track_extraction.track.region import Region
+
+
+class TestTrackCache:
+    def test_loads_once(self):
+        cache = TrackCache(max_bytes=1024)
+        loads = []
+
+        def load():
+            loads.append(1)
+            return [np.zeros(10, dtype=np.uint8)]
+
+        first = cache.get(1, 1, load)
+        second = cache.get(1, 1, load)
+        assert first is second
+        assert len(loads) == 1
+        assert cache.hit_rate == 0.5
+        assert cache.resident_bytes == 10
+
+    def test_arrays_are_read_only(self):
+        cache = TrackCache(max_bytes=1024)
+        frames = cache.get(1, 1, lambda: (np.zeros(10), [np.ones(2)]))
+        with pytest.raises(ValueError):
+            frames[0][0] = 1
+        with pytest.raises(ValueError):
+            frames[1][0][0] = 1
+
+    def test_evicts_least_recently_used(self):
+        cache = TrackCache(max_bytes=25)
+        for track_id in range(3):
+            cache.get(1, track_id, lambda: np.zeros(10, dtype=np.uint8))
+        cache.get(1, 1, lambda: None)
+        cache.get(1, 3, lambda: np.zeros(10, dtype=np.uint8))
+        assert (1, 0) not in cache
+        assert (1, 2) not in cache
+        assert (1, 1) in cache
+        assert (1, 3) in cache
+        assert cache.resident_bytes == 20
+
+    def test_frames_are_frozen(self):
+        def load():
+            return [
+                Frame(
+                    np.zeros((10, 10), dtype=np.float32),
+                    np.zeros((10, 10), dtype=np.float32),
+                    np.zeros((10, 10), dtype=np.uint8),
+                    frame_number,
+                    region=Region(0, 0, 10, 10, centroid=[5, 5]),
+                )
+                for frame_number in range(3)
+            ]
+
+        cache = TrackCache(max_bytes=2000)
+        frames = cache.get(1, 1, load)
+        assert cache.resident_bytes == 3 * 900
+        with pytest.raises(ValueError):
+            frames[0].thermal[0, 0] = 1
+        copy = frames[0].copy()
+        copy.thermal[0, 0] = 1
+        # too big for the cache but the latest track is kept
+        assert (1, 1) in cache
+        cache.get(1, 2, load)
+        assert (1, 1) not in cache
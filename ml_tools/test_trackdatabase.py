@@ -0,0 +1,193 @@
+import h5py
+import numpy as np
+import pytest
+
+from ml_tools.trackdatabase import (
+    TrackDatabase,
+    migrate_database,
+    write_original_frames,
+    STORAGE_VERSION,
+)
+
+
+class TestSession:
+    def create_db(self, tmp_path):
+        filename = str(tmp_path / "dataset.hdf5")
+        db = TrackDatabase(filename)
+        with h5py.File(filename, "a") as f:
+            f["clips"].create_group("1")
+        return db
+
+    def test_session_keeps_file_open(self, tmp_path):
+        db = self.create_db(tmp_path)
+        with db.session() as s:
+            f = s._session.f
+            assert not s.has_clip("1")
+            with s.session():
+                assert s._session.f is f
+            assert f.id.valid
+        assert db._session is None
+        assert not f.id.valid
+
+    def test_write_session(self, tmp_path):
+        db = self.create_db(tmp_path)
+        with db.session("a") as s:
+            s.finished_processing("1")
+            assert s.has_clip("1")
+        assert db.has_clip("1")
+
+    def test_no_writes_in_read_session(self, tmp_path):
+        db = self.create_db(tmp_path)
+        with db.session() as s:
+            with pytest.raises(ValueError):
+                s.finished_processing("1")
+            with pytest.raises(ValueError):
+                with s.session("a"):
+                    pass
+        assert not db.has_clip("1")
+
+
+class TestStorage:
+    def create_v1_db(self, tmp_path):
+        filename = str(tmp_path / "v1.hdf5")
+        db = TrackDatabase(filename)
+        with h5py.File(filename, "a") as f:
+            clip = f["clips"].create_group("1")
+            clip.attrs["finished"] = True
+            original = clip.create_group("original_frames")
+            track = clip.create_group("1")
+            cropped = track.create_group("cropped")
+            bounds = []
+            for frame_i in range(4):
+                original.create_dataset(
+                    str(frame_i + 2), data=np.full((6, 8), frame_i, dtype=np.int16)
+                )
+                if frame_i == 2:
+                    # skipped frame
+                    bounds.append([0, 0, 0, 0, frame_i + 2, 0, 0])
+                    continue
+                size = frame_i + 1
+                cropped.create_dataset(
+                    str(frame_i),
+                    data=np.arange(3 * size * size, dtype=np.int16).reshape(
+                        3, size, size
+                    ),
+                )
+                bounds.append([0, 0, size, size, frame_i + 2, 4, 0])
+            track.attrs["frames"] = 4
+            track.attrs["start_frame"] = 2
+            track.attrs["bounds_history"] = np.int16(bounds)
+        return db
+
+    def test_migrated_frames_match(self, tmp_path):
+        v1 = self.create_v1_db(tmp_path)
+        migrate_database(v1.database, str(tmp_path / "v2.hdf5"))
+        v2 = TrackDatabase(str(tmp_path / "v2.hdf5"))
+        with h5py.File(v2.database, "r") as f:
+            assert f["clips"]["1"]["1"].attrs["storage_version"] == STORAGE_VERSION
+        for kwargs in [{}, {"original": True}, {"frame_numbers": [3, 0]}]:
+            old = v1.get_track("1", "1", **kwargs)
+            new = v2.get_track("1", "1", **kwargs)
+            assert len(old) == len(new)
+            for old_frame, new_frame in zip(old, new):
+                assert old_frame.frame_number == new_frame.frame_number
+                assert np.array_equal(old_frame.thermal, new_frame.thermal)
+                assert np.array_equal(old_frame.filtered, new_frame.filtered)
+        old = v1.get_clip("1")
+        new = v2.get_clip("1")
+        assert [f.frame_number for f in old] == [f.frame_number for f in new]
+        for old_frame, new_frame in zip(old, new):
+            assert np.array_equal(old_frame.thermal, new_frame.thermal)
+
+    def test_batch_matches_get_track(self, tmp_path):
+        v1 = self.create_v1_db(tmp_path)
+        migrate_database(v1.database, str(tmp_path / "v2.hdf5"))
+        v2 = TrackDatabase(str(tmp_path / "v2.hdf5"))
+        for db in [v1, v2]:
+            requests = [("1", "1", None), ("1", "1", [3, 2, 0]), ("1", "1", [])]
+            batch = db.get_tracks_batch(requests, channels=[1])
+            assert list(batch.lengths) == [3, 2, 0]
+            assert batch.data.shape == (5, 1, 4, 4)
+            for request_i, (clip_id, track_id, frame_numbers) in enumerate(requests):
+                old = db.get_track(
+                    clip_id, track_id, frame_numbers=frame_numbers, channels=[1]
+                )
+                new = batch.frames(request_i)
+                assert [f.frame_number for f in old] == [f.frame_number for f in new]
+                for old_frame, new_frame in zip(old, new):
+                    assert np.array_equal(old_frame.filtered, new_frame.filtered)
+                    assert np.array_equal(
+                        old_frame.region.to_array(), new_frame.region.to_array()
+                    )
+
+    def test_clips_meta_matches(self, tmp_path):
+        db = self.create_v1_db(tmp_path)
+        with h5py.File(db.database, "a") as f:
+            f["clips"]["1"].attrs["station_id"] = 3
+            f["clips"]["1"]["1"].attrs["tag"] = "cat"
+            f["clips"].create_group("2").attrs["finished"] = True
+        loaded = list(db.get_clips_meta(["2", "1"]))
+        assert [clip_id for clip_id, _, _ in loaded] == ["2", "1"]
+        for clip_id, clip_meta, tracks in loaded:
+            assert clip_meta == db.get_clip_meta(clip_id)
+            expected = db.get_clip_tracks(clip_id)
+            assert len(tracks) == len(expected)
+            for track, expected_track in zip(tracks, expected):
+                assert track.keys() == expected_track.keys()
+                for key, value in track.items():
+                    assert np.array_equal(value, expected_track[key])
+
+    def test_long_clip_original_frames(self, tmp_path):
+        db = TrackDatabase(str(tmp_path / "long.hdf5"))
+        num_frames = 20000
+        frames = np.arange(num_frames, dtype=np.int16).reshape(-1, 1, 1)
+        frames = np.broadcast_to(frames, (num_frames, 2, 2))
+        with h5py.File(db.database, "a") as f:
+            clip = f["clips"].create_group("1")
+            # overlapping tracks
+            write_original_frames(clip, 100, frames[100:num_frames], {})
+            write_original_frames(clip, 0, frames[0:200], {})
+            assert clip["original_frame_numbers"].shape == (num_frames,)
+        loaded = db.get_clip("1", frame_numbers=[0, 150, num_frames - 1])
+        for frame in loaded:
+            assert frame.thermal[0, 0] == np.int16(frame.frame_number)
+        assert [f.frame_number for f in db.get_clip("1")] == list(range(num_frames))
+
+    def test_frame_numbers_attribute_still_read(self, tmp_path):
+        db = TrackDatabase(str(tmp_path / "attrs.hdf5"))
+        frames = np.ones((4, 2, 2), dtype=np.int16)
+        with h5py.File(db.database, "a") as f:
+            clip = f["clips"].create_group("1")
+            write_original_frames(clip, 2, frames, {})
+            del clip["original_frame_numbers"]
+            clip["original_frames"].attrs["frame_numbers"] = np.arange(2, 6)
+        assert [f.frame_number for f in db.get_clip("1")] == [2, 3, 4, 5]
+        with h5py.File(db.database, "a") as f:
+            write_original_frames(f["clips"]["1"], 5, frames, {})
+        assert [f.frame_number for f in db.get_clip("1")] == list(range(2, 9))
+
+    def test_get_clip_skip_missing(self, tmp_path):
+        db = TrackDatabase(str(tmp_path / "missing.hdf5"))
+        with h5py.File(db.database, "a") as f:
+            clip = f["clips"].create_group("1")
+            write_original_frames(clip, 2, np.ones((4, 2, 2), dtype=np.int16), {})
+        with pytest.raises(KeyError):
+            db.get_clip("1", [1, 3])
+        loaded = db.get_clip("1", [1, 3, 5, 9], skip_missing=True)
+        assert [f.frame_number for f in loaded] == [3, 5]
+
+    def test_split_requests(self, tmp_path):
+        db = self.create_v1_db(tmp_path)
+        requests = [
+            ("1", "1", None),
+            ("1", "1", [0, 1]),
+            ("1", "1", [3]),
+            ("1", "1", []),
+        ]
+        assert db.split_requests(requests, 4) == [slice(0, 1), slice(1, 4)]
+        assert db.split_requests(requests, 2) == [
+            slice(0, 1),
+            slice(1, 2),
+            slice(2, 4),
+        ]
+        assert db.split_requests([], 4) == []
@@ -0,0 +1,314 @@
+"""
+Writes dataset samples to sharded TFRecords with a pool of worker processes.
+
+Samples are grouped by clip, each worker reads a clip's data from the database once,
+prepares and serializes all of its samples, and the main process writes the examples
+to their shards.  Samples are shuffled and assigned to shards up front and the clips
+are written in that order, so the records only depend on the seed and not on the
+number of workers.  As a clip's samples arrive together, each shard's records pass
+through a shuffle buffer so that they aren't stored in runs of one clip.  Each shard has an index file with its number of records, the
+count of each label and the offset of each record.
+"""
+
+import collections
+import logging
+import multiprocessing
+import os
+import random
+import time
+import zlib
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+
+from ml_tools.shardindex import FLOAT_ENCODING, ShardIndex, index_path
+from ml_tools.trackdatabase import TrackDatabase
+
+# set in each worker process by init_worker
+worker_db = None
+worker_load_clip = None
+worker_create_example = None
+worker_cache_stats = None
+
+LOG_EVERY = 1000
+# records held per shard to shuffle clips together before writing
+SHUFFLE_BUFFER = 256
+# clips each worker may have loaded or queued ahead of the writer
+PENDING_CLIPS = 4
+
+
+def init_worker(db_file, load_clip, create_example, cache_stats=None):
+    global worker_db, worker_load_clip, worker_create_example, worker_cache_stats
+    worker_db = TrackDatabase(db_file, read_only=True)
+    worker_load_clip = load_clip
+    worker_create_example = create_example
+    worker_cache_stats = cache_stats
+
+
+def write_tf_records(
+    samples,
+    db_file,
+    output_path,
+    labels,
+    load_clip,
+    create_example,
+    num_shards=1,
+    by_label=True,
+    workers=None,
+    seed=None,
+    encoding=FLOAT_ENCODING,
+    compression=None,
+    cache_stats=None,
+    shuffle_buffer=SHUFFLE_BUFFER,
+):
+    """
+    :param load_clip: function(db, samples) returning the data of each sample of a clip,
+    or None for samples which couldn't be loaded
+    :param create_example: function(data, sample) returning a tf.train.Example
+    :param workers: number of worker processes, defaults to the number of cpus,
+    1 loads the samples in this process
+    :param seed: seed for shuffling samples and any augmentation, defaults to one
+    drawn from np.random
+    :param encoding: how create_example encodes images, saved in the shard indexes
+    :param compression: "GZIP" or "ZLIB" to compress the shards, None to not
+    :param cache_stats: function() returning the hits and lookups of a worker's cache
+    of loaded data, the hit rate over all workers is logged when finished
+    :param shuffle_buffer: number of records of each shard held back and written in
+    a random order, 0 writes records in the order they are loaded
+    """
+    output_path = Path(output_path)
+    if output_path.is_dir():
+        logging.info("Clearing dir %s", output_path)
+        for child in output_path.glob("*"):
+            if child.is_file():
+                child.unlink()
+    output_path.mkdir(parents=True, exist_ok=True)
+    if seed is None:
+        seed = np.random.randint(2**31)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    rng = np.random.default_rng(seed)
+    samples = [samples[i] for i in rng.permutation(len(samples))]
+    shards = assign_shards(samples, labels, num_shards, by_label)
+    jobs = [
+        (clip_samples, seed) for clip_samples in group_by_clip(samples, shards).values()
+    ]
+    logging.info(
+        "writing to output path: %s for %s samples from %s clips with %s workers seed %s compression %s",
+        output_path,
+        len(samples),
+        len(jobs),
+        workers,
+        seed,
+        compression,
+    )
+
+    initargs = (db_file, load_clip, create_example, cache_stats)
+    pool = None
+    if workers > 1:
+        # start workers before opening any writers
+        pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=initargs)
+        results = bounded_imap(pool, write_clip, jobs, workers * PENDING_CLIPS)
+    else:
+        init_worker(*initargs)
+        results = map(write_clip, jobs)
+
+    names = shard_names(labels, num_shards, by_label)
+    writers = [
+        tf.io.TFRecordWriter(str(output_path / name), options=compression)
+        for name in names
+    ]
+    indexes = [
+        ShardIndex(name, encoding=encoding, compression=compression) for name in names
+    ]
+    buffers = [[] for _ in names]
+
+    def write(shard, label, example):
+        writers[shard].write(example)
+        indexes[shard].add(label, len(example))
+
+    stats = WriteStats(workers)
+    try:
+        for examples, num_samples, read_time, encode_time, cache in results:
+            start = time.time()
+            for shard, label, example in examples:
+                buffer = buffers[shard]
+                if len(buffer) < shuffle_buffer:
+                    buffer.append((label, example))
+                    continue
+                i = rng.integers(len(buffer) + 1)
+                if i < len(buffer):
+                    # swap in the new record for a random one held back
+                    buffer[i], (label, example) = (label, example), buffer[i]
+                write(shard, label, example)
+            stats.add(num_samples, len(examples), read_time, encode_time, start, cache)
+        for shard, buffer in enumerate(buffers):
+            for i in rng.permutation(len(buffer)):
+                write(shard, *buffer[i])
+    except Exception:
+        logging.error("Error saving track info", exc_info=True)
+        # the shards are incomplete, don't write indexes that say otherwise
+        raise
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        for writer in writers:
+            writer.close()
+    for name, index in zip(names, indexes):
+        index.save(index_path(output_path / name))
+    stats.log()
+    stats.log_cache()
+    logging.info("Finished writing, skipped %d samples.", stats.skipped)
+
+
+def bounded_imap(pool, func, jobs, max_pending):
+    """
+    Like pool.imap but only max_pending jobs are submitted ahead of the result
+    being read, so a slow reader doesn't hold every result in memory
+    """
+    pending = collections.deque()
+    for job in jobs:
+        pending.append(pool.apply_async(func, (job,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while len(pending) > 0:
+        yield pending.popleft().get()
+
+
+def write_clip(job):
+    """
+    Loads and serializes the samples of one clip
+    :return: list of (shard, label, serialized example), number of samples, read seconds, encode seconds,
+    (process id, cache hits, cache lookups) or None
+    """
+    clip_samples, seed = job
+    samples = [sample for sample, _ in clip_samples]
+    # augmentation is seeded per clip so it doesn't depend on which worker loads the clip
+    seed_clip(seed, samples[0].clip_id)
+    start = time.time()
+    try:
+        with worker_db.session():
+            loaded = worker_load_clip(worker_db, samples)
+    except Exception:
+        logging.error("Error loading clip %s", samples[0].clip_id, exc_info=True)
+        loaded = [None] * len(samples)
+    read_time = time.time() - start
+
+    start = time.time()
+    examples = []
+    for (sample, shard), data in zip(clip_samples, loaded):
+        if data is None:
+            continue
+        try:
+            example = worker_create_example(data, sample)
+            examples.append((shard, sample.label, example.SerializeToString()))
+        except Exception:
+            logging.error("Error saving %s", sample, exc_info=True)
+    encode_time = time.time() - start
+    cache = None
+    if worker_cache_stats is not None:
+        cache = (os.getpid(), *worker_cache_stats())
+    return examples, len(samples), read_time, encode_time, cache
+
+
+def seed_clip(seed, clip_id):
+    clip_seed = zlib.crc32(str(clip_id).encode("utf8"))
+    state = np.random.SeedSequence([seed, clip_seed]).generate_state(1)[0]
+    np.random.seed(state)
+    random.seed(int(state))
+
+
+def assign_shards(samples, labels, num_shards, by_label):
+    """Returns the shard of each sample, spreading each label evenly over its shards"""
+    lbl_counts = [0] * len(labels)
+    shards = []
+    for i, sample in enumerate(samples):
+        if by_label:
+            l_i = labels.index(sample.label)
+            shards.append(num_shards * l_i + lbl_counts[l_i] % num_shards)
+            lbl_counts[l_i] += 1
+        else:
+            shards.append(i % num_shards)
+    return shards
+
+
+def group_by_clip(samples, shards):
+    """Groups (sample, shard) by clip id, in the order of each clip's first sample"""
+    clips = {}
+    for sample, shard in zip(samples, shards):
+        clips.setdefault(sample.clip_id, []).append((sample, shard))
+    return clips
+
+
+def shard_names(labels, num_shards, by_label):
+    names = []
+    if by_label:
+        for label in labels:
+            safe_l = label.replace("/", "-")
+            for i in range(num_shards):
+                names.append(f"{safe_l}-%05d-of-%05d.tfrecord" % (i, num_shards))
+    else:
+        for i in range(num_shards):
+            names.append("%05d-of-%05d.tfrecord" % (i, num_shards))
+    return names
+
+
+class WriteStats:
+    """Samples per second of each stage, read and encode are per worker"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.start = time.time()
+        self.samples = 0
+        self.written = 0
+        self.read_time = 0
+        self.encode_time = 0
+        self.write_time = 0
+        self.last_logged = 0
+        # latest cache hits and lookups of each worker process
+        self.caches = {}
+
+    @property
+    def skipped(self):
+        return self.samples - self.written
+
+    def add(
+        self, num_samples, written, read_time, encode_time, write_start, cache=None
+    ):
+        self.write_time += time.time() - write_start
+        if cache is not None:
+            pid, hits, lookups = cache
+            self.caches[pid] = (hits, lookups)
+        self.samples += num_samples
+        self.written += written
+        self.read_time += read_time
+        self.encode_time += encode_time
+        if self.samples - self.last_logged >= LOG_EVERY:
+            self.last_logged = self.samples
+            self.log()
+
+    def log(self):
+        elapsed = time.time() - self.start
+        logging.info(
+            "saved %s of %s samples, %.1f samples/s; read %.1f, encode %.1f samples/s per worker, write %.1f samples/s",
+            self.written,
+            self.samples,
+            self.samples / max(elapsed, 1e-6),
+            self.samples / max(self.read_time, 1e-6),
+            self.samples / max(self.encode_time, 1e-6),
+            self.written / max(self.write_time, 1e-6),
+        )
+
+    def log_cache(self):
+        if len(self.caches) == 0:
+            return
+        hits = sum(hits for hits, _ in self.caches.values())
+        lookups = sum(lookups for _, lookups in self.caches.values())
+        logging.info(
+            "Cache hit rate %.1f%% of %s lookups over %s workers",
+            100 * hits / max(lookups, 1),
+            lookups,
+            len(self.caches),
+        )
@@ -11,6 +11,12 @@ from ml_tools.logs import init_logging
 import logging
 
 from ml_tools.featurenorms import mean_v, std_v
+from ml_tools.shardindex import (
+    UINT8_ENCODING,
+    load_label_counts,
+    load_schema,
+    rejection_resample_size,
+)
 
 # seed = 1341
 # tf.random.set_seed(seed)
@@ -30,7 +36,9 @@ def load_dataset(filenames, num_labels, args):
     ignore_order.experimental_deterministic = (
         deterministic  # disable order, increase speed
     )
-    dataset = tf.data.TFRecordDataset(filenames)
+    encoding, compression = load_schema(filenames)
+    logging.info("Loading records encoding %s compression %s", encoding, compression)
+    dataset = tf.data.TFRecordDataset(filenames, compression_type=compression)
 
     dataset = dataset.with_options(
         ignore_order
@@ -38,8 +46,6 @@ def load_dataset(filenames, num_labels, args):
 
     image_size = args["image_size"]
     labeled = args.get("labeled", True)
-    augment = args.get("augment", False)
-    preprocess_fn = args.get("preprocess_fn")
     include_features = args.get("include_features", False)
     only_features = args.get("only_features", False)
     one_hot = args.get("one_hot", True)
@@ -50,11 +56,10 @@ def load_dataset(filenames, num_labels, args):
             num_labels=num_labels,
             image_size=image_size,
             labeled=labeled,
-            augment=augment,
-            preprocess_fn=preprocess_fn,
             include_features=include_features,
             only_features=only_features,
             one_hot=one_hot,
+            encoding=encoding,
         ),
         num_parallel_calls=AUTOTUNE,
         deterministic=deterministic,
@@ -107,11 +112,13 @@ def get_dataset(base_dir, labels, **args):
         name="remapped_y",
     )
     filenames = tf.io.gfile.glob(f"{base_dir}/*.tfrecord")
+    # counts of the labels after remapping, from the shard indexes if they all have one
+    label_counts = load_label_counts(filenames, labels, label_map=values)
     dataset = load_dataset(filenames, num_labels, args)
     resample_data = args.get("resample", True)
     if resample_data:
         logging.info("Resampling data")
-        dataset = resample(dataset, labels)
+        dataset = resample(dataset, labels, label_counts)
 
     if not args.get("only_features"):
         logging.info("shuffling data")
@@ -120,7 +127,13 @@ def get_dataset(base_dir, labels, **args):
         )
     # tf refues to run if epoch sizes change so we must decide a costant epoch size even though with reject res
     # it will chang eeach epoch, to ensure this take this repeat data and always take epoch_size elements
-    epoch_size = len([0 for x, y in dataset])
+    if label_counts is None:
+        epoch_size = len([0 for x, y in dataset])
+    elif resample_data:
+        _, target_dist = target_distribution(label_counts, labels)
+        epoch_size = rejection_resample_size(label_counts, target_dist)
+    else:
+        epoch_size = int(np.sum(label_counts))
     logging.info("Setting dataset size to %s", epoch_size)
     if not args.get("only_features", False):
         dataset = dataset.repeat(2)
@@ -128,30 +141,70 @@ def get_dataset(base_dir, labels, **args):
     if scale_epoch:
         epoch_size = epoch_size // scale_epoch
     dataset = dataset.take(epoch_size)
-    dataset = dataset.prefetch(buffer_size=AUTOTUNE)
     batch_size = args.get("batch_size", None)
     if batch_size is not None:
         dataset = dataset.batch(batch_size)
+    if not args.get("only_features", False):
+        augmentation = None
+        if args.get("augment", False):
+            logging.info("Augmenting")
+            augmentation = augmentation_layers()
+        preprocess_fn = args.get("preprocess_fn")
+        if preprocess_fn is not None:
+            logging.info(
+                "Preprocessing with %s.%s",
+                preprocess_fn.__module__,
+                preprocess_fn.__name__,
+            )
+        dataset = prepare_dataset(
+            dataset,
+            args.get("labeled", True),
+            args.get("include_features", False),
+            augmentation,
+            preprocess_fn,
+        )
+    dataset = dataset.prefetch(buffer_size=AUTOTUNE)
     return dataset, remapped
 
 
-def resample(dataset, labels):
+def resample(dataset, labels, label_counts=None):
+    """
+    Resamples dataset towards an even distribution of labels
+    :param label_counts: number of records of each label, counted from the dataset if None
+    """
+    if label_counts is None:
+        true_categories = [y for x, y in dataset]
+        if len(true_categories) == 0:
+            return None
+        true_categories = np.int64(tf.argmax(true_categories, axis=1))
+        c = Counter(list(true_categories))
+        label_counts = [c[i] for i in range(len(labels))]
+    dist, target_dist = target_distribution(label_counts, labels, log=True)
+
+    rej = dataset.rejection_resample(
+        class_func=class_func,
+        target_dist=target_dist,
+        initial_dist=dist,
+    )
+    dataset = rej.map(lambda extra_label, features_and_label: features_and_label)
+    return dataset
+
+
+def target_distribution(label_counts, labels, log=False):
+    """Returns the initial and target distribution of labels for resampling"""
     excluded_labels = ["sheep"]
     num_labels = len(labels)
-    true_categories = [y for x, y in dataset]
-    if len(true_categories) == 0:
-        return None
-    true_categories = np.int64(tf.argmax(true_categories, axis=1))
-    c = Counter(list(true_categories))
     dist = np.empty((num_labels), dtype=np.float32)
     target_dist = np.empty((num_labels), dtype=np.float32)
     for i in range(num_labels):
         if labels[i] in excluded_labels:
-            logging.info("Excluding %s for %s", c[i], labels[i])
+            if log:
+                logging.info("Excluding %s for %s", label_counts[i], labels[i])
             dist[i] = 0
         else:
-            dist[i] = c[i]
-            logging.info("Have %s for %s", dist[i], labels[i])
+            dist[i] = label_counts[i]
+            if log:
+                logging.info("Have %s for %s", dist[i], labels[i])
     zeros = dist[dist == 0]
     non_zero_labels = num_labels - len(zeros)
     target_dist[:] = 1 / non_zero_labels
@@ -170,13 +223,7 @@ def resample(dataset, labels):
 
         target_dist[i] = max(0, target_dist[i])
     target_dist = target_dist / np.sum(target_dist)
-
-    rej = dataset.rejection_resample(
-        class_func=class_func,
-        target_dist=target_dist,
-    )
-    dataset = rej.map(lambda extra_label, features_and_label: features_and_label)
-    return dataset
+    return dist, target_dist
 
 
 # not currently used makes more sense to have recods by label but then you need a really big shuffle
@@ -252,28 +299,23 @@ def read_tfrecord(
     image_size,
     num_labels,
     labeled,
-    augment=False,
-    preprocess_fn=None,
     only_features=False,
     one_hot=True,
     include_features=False,
+    encoding=UINT8_ENCODING,
 ):
-    logging.info(
-        "Read tf record with image %s lbls %s labeld %s aug  %s  prepr %s only features %s one hot %s include fetures %s",
-        image_size,
-        num_labels,
-        labeled,
-        augment,
-        preprocess_fn,
-        only_features,
-        one_hot,
-        include_features,
-    )
+    """
+    Parses a record, images are returned as 25 frames [25, 32, 32, 3] which
+    prepare_dataset augments and tiles once the records are batched
+    """
     load_images = not only_features
     tfrecord_format = {
         "image/class/label": tf.io.FixedLenFeature((), tf.int64, -1),
     }
-    if load_images:
+    if load_images and encoding == UINT8_ENCODING:
+        tfrecord_format["image/thermalencoded"] = tf.io.FixedLenFeature((), tf.string)
+        tfrecord_format["image/filteredencoded"] = tf.io.FixedLenFeature((), tf.string)
+    elif load_images:
         tfrecord_format["image/thermalencoded"] = tf.io.FixedLenFeature(
             [25 * 32 * 32], dtype=tf.float32
         )
@@ -290,39 +332,17 @@ def read_tfrecord(
     if load_images:
         thermalencoded = example["image/thermalencoded"]
         filteredencoded = example["image/filteredencoded"]
+        if encoding == UINT8_ENCODING:
+            thermalencoded = tf.cast(
+                tf.io.decode_raw(thermalencoded, tf.uint8), tf.float32
+            )
+            filteredencoded = tf.cast(
+                tf.io.decode_raw(filteredencoded, tf.uint8), tf.float32
+            )
 
         thermals = tf.reshape(thermalencoded, [25, 32, 32, 1])
         filtered = tf.reshape(filteredencoded, [25, 32, 32, 1])
-        rgb_images = tf.concat((thermals, thermals, filtered), axis=3)
-        rotation_augmentation = tf.keras.Sequential(
-            [
-                tf.keras.layers.RandomRotation(0.1, fill_mode="nearest", fill_value=0),
-            ]
-        )
-        # rotation augmentation before tiling
-        if augment:
-            logging.info("Augmenting")
-            rgb_images = rotation_augmentation(rgb_images)
-        image = tile_images(rgb_images)
-
-        if augment:
-            data_augmentation = tf.keras.Sequential(
-                [
-                    tf.keras.layers.RandomFlip("horizontal"),
-                    tf.keras.layers.RandomBrightness(
-                        0.2
-                    ),  # better per frame or per sequence??
-                    tf.keras.layers.RandomContrast(0.5),
-                ]
-            )
-            image = data_augmentation(image)
-        if preprocess_fn is not None:
-            logging.info(
-                "Preprocessing with %s.%s",
-                preprocess_fn.__module__,
-                preprocess_fn.__name__,
-            )
-            image = preprocess_fn(image)
+        image = tf.concat((thermals, thermals, filtered), axis=3)
     if labeled:
         label = tf.cast(example["image/class/label"], tf.int32)
         global remapped_y
@@ -353,18 +373,91 @@ def decode_image(thermals, filtereds, image_size):
     return decoded_thermal, decoded_filtered
 
 
-def tile_images(images):
-    index = 0
-    image = None
-    for x in range(5):
-        t_row = tf.concat(tf.unstack(images[index : index + 5]), axis=1)
-        if image is None:
-            image = t_row
-        else:
-            image = tf.concat([image, t_row], 0)
+def augmentation_layers():
+    """
+    Returns the augmentation of each frame before tiling and of the tiled images,
+    these are made once for a dataset rather than for every record
+    """
+    frame_augmentation = tf.keras.Sequential(
+        [
+            tf.keras.layers.RandomRotation(0.1, fill_mode="nearest", fill_value=0),
+        ]
+    )
+    image_augmentation = tf.keras.Sequential(
+        [
+            tf.keras.layers.RandomFlip("horizontal"),
+            tf.keras.layers.RandomBrightness(0.2),  # better per frame or per sequence??
+            # RandomContrast uses one factor for a whole batch
+            tf.keras.layers.Lambda(partial(random_contrast, factor=0.5)),
+        ]
+    )
+    return frame_augmentation, image_augmentation
+
+
+def random_contrast(images, factor):
+    """
+    Adjusts the contrast of each image of a batch [batch, height, width, channels]
+    by its own random factor in [1 - factor, 1 + factor], as RandomContrast does
+    for a single image
+    """
+    factors = tf.random.uniform([tf.shape(images)[0], 1, 1, 1], 1 - factor, 1 + factor)
+    means = tf.reduce_mean(images, axis=[1, 2], keepdims=True)
+    images = (images - means) * factors + means
+    return tf.clip_by_value(images, 0, 255)
+
+
+def prepare_images(images, augmentation=None, preprocess_fn=None):
+    """
+    Augments and tiles a batch of frames [batch, 25, height, width, channels] into
+    images [batch, 5 * height, 5 * width, channels], or the frames of one record
+    :param augmentation: layers from augmentation_layers
+    """
+    batched = images.shape.rank == 5
+    if not batched:
+        images = images[tf.newaxis]
+    _, frames, height, width, channels = images.shape
+    if augmentation is not None:
+        frame_augmentation, image_augmentation = augmentation
+        # rotation augmentation before tiling
+        images = tf.reshape(images, [-1, height, width, channels])
+        images = frame_augmentation(images)
+        images = tf.reshape(images, [-1, frames, height, width, channels])
+    images = tile_images(images)
+    if augmentation is not None:
+        images = image_augmentation(images)
+    if preprocess_fn is not None:
+        images = preprocess_fn(images)
+    if not batched:
+        images = images[0]
+    return images
+
+
+def prepare_dataset(
+    dataset, labeled, include_features, augmentation=None, preprocess_fn=None
+):
+    """Applies prepare_images to the images of each element of dataset"""
 
-        index += 5
-    return image
+    def prepare_x(x):
+        if include_features:
+            images, features = x
+            return prepare_images(images, augmentation, preprocess_fn), features
+        return prepare_images(x, augmentation, preprocess_fn)
+
+    if labeled:
+        prepare = lambda x, y: (prepare_x(x), y)
+    elif include_features:
+        prepare = lambda images, features: prepare_x((images, features))
+    else:
+        prepare = prepare_x
+    return dataset.map(prepare, num_parallel_calls=AUTOTUNE)
+
+
+def tile_images(images):
+    """Tiles frames [batch, 25, height, width, channels] into rows of 5 frames"""
+    _, frames, height, width, channels = images.shape
+    images = tf.reshape(images, [-1, 5, 5, height, width, channels])
+    images = tf.transpose(images, [0, 1, 3, 2, 4, 5])
+    return tf.reshape(images, [-1, 5 * height, 5 * width, channels])
 
 
 def class_func(features, label):
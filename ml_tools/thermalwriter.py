@@ -27,6 +27,7 @@ from PIL import Image
 from pathlib import Path
 
 import collections
+import functools
 import hashlib
 import io
 import json
@@ -43,12 +44,23 @@ import tensorflow as tf
 from . import tfrecord_util
 from ml_tools import tools
 from ml_tools.imageprocessing import normalize
-from ml_tools.forestmodel import forest_features
+from ml_tools.forestmodel import batch_forest_features, forest_features
 from ml_tools import imageprocessing
 from ml_tools.frame import TrackChannels
+from ml_tools.shardindex import UINT8_ENCODING
+from ml_tools.tfwriter import write_tf_records
+from ml_tools.trackcache import TrackCache
 
 crop_rectangle = tools.Rectangle(0, 0, 640, 480)
-from functools import lru_cache
+
+# tracks loaded by this process, samples are loaded a clip at a time so this only
+# needs to hold the tracks of a few clips
+TRACK_CACHE_BYTES = 256 * 1024 * 1024
+track_cache = TrackCache(TRACK_CACHE_BYTES)
+
+
+def track_cache_stats():
+    return track_cache.hits, track_cache.hits + track_cache.misses
 
 
 def create_tf_example(data, image_dir, sample, labels, filename):
@@ -94,8 +106,9 @@ def create_tf_example(data, image_dir, sample, labels, filename):
         # ensure 25 frames even if 0s
         thermals.append(np.zeros((thermals[0].shape)))
         filtereds.append(np.zeros((filtereds[0].shape)))
-    thermals = np.array(thermals)
-    filtereds = np.array(filtereds)
+    # images are normalized to 0-255 so are stored as uint8
+    thermals = np.uint8(np.rint(np.clip(thermals, 0, 255)))
+    filtereds = np.uint8(np.rint(np.clip(filtereds, 0, 255)))
     thermal_key = hashlib.sha256(thermals).hexdigest()
     filtered_key = hashlib.sha256(filtereds).hexdigest()
 
@@ -107,8 +120,9 @@ def create_tf_example(data, image_dir, sample, labels, filename):
         "image/track_id": tfrecord_util.int64_feature(sample.track_id),
         "image/filename": tfrecord_util.bytes_feature(filename.encode("utf8")),
         "image/source_id": tfrecord_util.bytes_feature(str(image_id).encode("utf8")),
-        "image/thermalencoded": tfrecord_util.float_list_feature(thermals.ravel()),
-        "image/filteredencoded": tfrecord_util.float_list_feature(filtereds.ravel()),
+        "image/encoding": tfrecord_util.int64_feature(UINT8_ENCODING),
+        "image/thermalencoded": tfrecord_util.bytes_feature(thermals.tobytes()),
+        "image/filteredencoded": tfrecord_util.bytes_feature(filtereds.tobytes()),
         "image/features": tfrecord_util.float_list_feature(features),
         "image/filteredkey/sha256": tfrecord_util.bytes_feature(
             filtered_key.encode("utf8")
@@ -126,105 +140,85 @@ def create_tf_example(data, image_dir, sample, labels, filename):
 
 
 def create_tf_records(
-    dataset, output_path, labels, back_thresh, num_shards=1, cropped=True, by_label=True
+    dataset,
+    output_path,
+    labels,
+    back_thresh,
+    num_shards=1,
+    cropped=True,
+    by_label=True,
+    workers=None,
+    seed=None,
+    compression=None,
 ):
-
-    output_path = Path(output_path)
-    if output_path.is_dir():
-        logging.info("Clearing dir %s", output_path)
-        for child in output_path.glob("*"):
-            if child.is_file():
-                child.unlink()
-    output_path.mkdir(parents=True, exist_ok=True)
-    samples = dataset.samples
-    # keys = list(samples.keys())
-    np.random.shuffle(samples)
-
-    dataset.load_db()
-    dataset.set_read_only(True)
-    db = dataset.db
-    total_num_annotations_skipped = 0
-    num_labels = len(labels)
-    # pool = multiprocessing.Pool(4)
-    logging.info("writing to output path: %s for %s samples", output_path, len(samples))
-    writers = []
-    lbl_counts = [0] * num_labels
-    # lbl_counts[l] = 0
     logging.info("labels are %s", labels)
+    write_tf_records(
+        dataset.samples,
+        dataset.db_file,
+        output_path,
+        labels,
+        load_clip,
+        functools.partial(create_example, labels=labels),
+        num_shards=num_shards,
+        by_label=by_label,
+        workers=workers,
+        seed=seed,
+        encoding=UINT8_ENCODING,
+        compression=compression,
+        cache_stats=track_cache_stats,
+    )
 
-    writers = []
-    for label in labels:
-        for i in range(num_shards):
-            if by_label:
-                safe_l = label.replace("/", "-")
-                name = f"{safe_l}-%05d-of-%05d.tfrecord" % (i, num_shards)
-            else:
-                name = f"%05d-of-%05d.tfrecord" % (i, num_shards)
-            writers.append(tf.io.TFRecordWriter(str(output_path / name)))
-        if not by_label:
-            break
-    load_first = 200
-    try:
-        count = 0
-        while len(samples) > 0:
-            local_set = samples[:load_first]
-            samples = samples[load_first:]
-            loaded = []
-            for sample in local_set:
-                data, features = get_data(sample, db)
-                # features = forest_features(db, sample.clip_id, sample.track_id)
-                if data is None:
-                    continue
-
-                loaded.append(((data, features), sample))
-            loaded = np.array(loaded, dtype=object)
-            np.random.shuffle(loaded)
-
-            for data, sample in loaded:
-                try:
-                    tf_example, num_annotations_skipped = create_tf_example(
-                        data, output_path, sample, labels, ""
-                    )
-                    total_num_annotations_skipped += num_annotations_skipped
-                    l_i = labels.index(sample.label)
-                    if by_label:
-                        wrtier = writers[
-                            num_shards * l_i + lbl_counts[l_i] % num_shards
-                        ]
-                    else:
-                        writer = writers[count % num_shards]
-                    writer.write(tf_example.SerializeToString())
-                    lbl_counts[l_i] += 1
-                    # print("saving example", [count % num_shards])
-                    count += 1
-                    if count % 100 == 0:
-                        logging.info("saved %s", count)
-                    # count += 1
-                except Exception as e:
-                    logging.error("Error saving ", exc_info=True)
 
-    except:
-        logging.error("Error saving track info", exc_info=True)
-    for writer in writers:
-        writer.close()
+def create_example(data, sample, labels):
+    tf_example, _ = create_tf_example(data, None, sample, labels, "")
+    return tf_example
 
-    logging.info(
-        "Finished writing, skipped %d annotations.", total_num_annotations_skipped
-    )
 
+def load_clip(db, samples):
+    """Loads the data of samples from one clip, reading its uncached tracks together"""
+    clip_id = samples[0].clip_id
+    track_ids = [
+        track_id
+        for track_id in dict.fromkeys(sample.track_id for sample in samples)
+        if (clip_id, track_id) not in track_cache
+    ]
+    if len(track_ids) > 0:
+        background = db.get_clip_background(clip_id)
+        frame_temp_median = db.get_clip_meta(clip_id)["frame_temp_median"]
+        track_frames = [
+            get_track_frames(clip_id, track_id, db) for track_id in track_ids
+        ]
+        # features of the clip's tracks are calculated together
+        features = batch_forest_features(
+            [
+                (frames, background, frame_temp_median, [f.region for f in frames])
+                for frames in track_frames
+            ]
+        )
+        for track_id, frames, track_features in zip(track_ids, track_frames, features):
+            track_cache.get(
+                clip_id,
+                track_id,
+                lambda: (background, frames, track_features, frame_temp_median),
+            )
+    return [get_data(sample, db) for sample in samples]
 
-@lru_cache(maxsize=1000)
-def get_track_data(clip_id, track_id, db):
-    background = db.get_clip_background(clip_id)
 
-    track_frames = db.get_track(
+def get_track_frames(clip_id, track_id, db):
+    return db.get_track(
         clip_id,
         track_id,
         original=False,
         channels=[TrackChannels.thermal],
     )
-    clip_meta = db.get_clip_meta(clip_id)
-    frame_temp_median = clip_meta["frame_temp_median"]
+
+
+def get_track_data(clip_id, track_id, db, background=None, frame_temp_median=None):
+    if background is None:
+        background = db.get_clip_background(clip_id)
+    if frame_temp_median is None:
+        frame_temp_median = db.get_clip_meta(clip_id)["frame_temp_median"]
+    track_frames = get_track_frames(clip_id, track_id, db)
     regions = [f.region for f in track_frames]
     features = forest_features(track_frames, background, frame_temp_median, regions)
     return background, track_frames, features, frame_temp_median
@@ -235,8 +229,10 @@ def get_data(sample, db):
     # prepare the sample data for saving
     crop_rectangle = tools.Rectangle(2, 2, 160 - 2 * 2, 140 - 2 * 2)
     try:
-        background, track_frames, features, frame_temp_median = get_track_data(
-            sample.clip_id, sample.track_id, db
+        background, track_frames, features, frame_temp_median = track_cache.get(
+            sample.clip_id,
+            sample.track_id,
+            lambda: get_track_data(sample.clip_id, sample.track_id, db),
         )
 
         thermals = []  # np.empty(len(frames), dtype=object)
@@ -244,6 +240,8 @@ def get_data(sample, db):
         for i, frame in enumerate(track_frames):
             if frame.frame_number not in sample.frame_numbers:
                 continue
+            # track frames are cached and shared between samples
+            frame = frame.copy()
             frame.float_arrays()
             frame.filtered = frame.thermal - frame.region.subimage(background)
             temp = frame_temp_median[i]
@@ -0,0 +1,110 @@
+import logging
+from collections import OrderedDict
+
+import attr
+import numpy as np
+
+
+class TrackCache:
+    """
+    Caches loaded track data keyed by (clip_id, track_id), unloading least recently
+    used tracks once more than max_bytes of arrays are resident.  Cached arrays are
+    made read only, so callers must copy any data they want to change.
+    """
+
+    # log statistics after this many lookups
+    LOG_EVERY = 10000
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.tracks = OrderedDict()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, clip_id, track_id, load):
+        """Returns the data of the track, calling load() to read it if it isn't cached"""
+        key = (clip_id, track_id)
+        if key in self.tracks:
+            self.tracks.move_to_end(key)
+            self.hits += 1
+            data = self.tracks[key][0]
+        else:
+            self.misses += 1
+            data = self.add(clip_id, track_id, load())
+        if (self.hits + self.misses) % TrackCache.LOG_EVERY == 0:
+            self.log_stats()
+        return data
+
+    def add(self, clip_id, track_id, data):
+        key = (clip_id, track_id)
+        if key in self.tracks:
+            self.resident_bytes -= self.tracks[key][1]
+        nbytes = freeze(data)
+        self.tracks[key] = (data, nbytes)
+        self.tracks.move_to_end(key)
+        self.resident_bytes += nbytes
+        while len(self.tracks) > 1 and self.resident_bytes > self.max_bytes:
+            _, (_, evicted_bytes) = self.tracks.popitem(last=False)
+            self.resident_bytes -= evicted_bytes
+        return data
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0
+        return self.hits / lookups
+
+    def log_stats(self):
+        logging.info(
+            "Track cache hit rate %.1f%% of %s lookups, %s tracks %.1fMB resident",
+            100 * self.hit_rate,
+            self.hits + self.misses,
+            len(self.tracks),
+            self.resident_bytes / (1024 * 1024),
+        )
+
+    def clear(self):
+        self.tracks.clear()
+        self.resident_bytes = 0
+
+    def __contains__(self, key):
+        return key in self.tracks
+
+    def __len__(self):
+        return len(self.tracks)
+
+
+def freeze(value, seen=None):
+    """Makes every numpy array in value read only and returns their total bytes"""
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(freeze(item, seen) for item in value)
+    if isinstance(value, dict):
+        return sum(freeze(item, seen) for item in value.values())
+    return sum(freeze(item, seen) for item in attribute_values(value))
+
+
+def attribute_values(value):
+    """Values of the attributes of an object, including attrs and slotted classes"""
+    if attr.has(type(value)):
+        return [getattr(value, field.name) for field in attr.fields(type(value))]
+    values = list(vars(value).values()) if hasattr(value, "__dict__") else []
+    for cls in type(value).__mro__:
+        slots = getattr(cls, "__slots__", ())
+        if isinstance(slots, str):
+            slots = [slots]
+        values.extend(
+            getattr(value, name)
+            for name in slots
+            if name not in ("__dict__", "__weakref__") and hasattr(value, name)
+        )
+    return values
@@ -11,6 +11,7 @@ import time
 
 import h5py
 import os
+from contextlib import contextmanager
 from time import sleep
 import logging
 import filelock
@@ -23,11 +24,17 @@ from track_extraction.track.region import Region
 special_datasets = [
     "tag_frames",
     "original_frames",
+    "original_frame_numbers",
     "background_frame",
     "predictions",
     "overlay",
 ]
 
+# version 1 stores each frame as its own dataset, version 2 stores a track's cropped
+# frames in one flat dataset with offsets and a clip's original frames in one 3d dataset
+STORAGE_VERSION = 2
+CROPPED_CHUNK_SIZE = 16384
+
 
 class HDF5Manager:
     """Class to handle locking of HDF5 files."""
@@ -39,6 +46,7 @@ class HDF5Manager:
         self.mode = mode
         self.f = None
         self.db = db
+        self.locked = False
         self.lock = filelock.FileLock(HDF5Manager.LOCK_FILE, timeout=30)
         logging.getLogger("filelock").setLevel(logging.INFO)
         # filelock.logger().setLevel(logging.ERROR)
@@ -48,7 +56,8 @@ class HDF5Manager:
         # this could improve performance
         if HDF5Manager.READ_ONLY and self.mode != "r":
             raise ValueError("Only read can be done in readonly mode")
-        if not HDF5Manager.READ_ONLY:
+        self.locked = not HDF5Manager.READ_ONLY
+        if self.locked:
             self.lock.acquire()
         self.f = h5py.File(self.db, self.mode)
         return self.f
@@ -57,10 +66,53 @@ class HDF5Manager:
         try:
             self.f.close()
         finally:
-            if not HDF5Manager.READ_ONLY:
+            if self.locked:
                 self.lock.release()
 
 
+class HDF5Session:
+    """
+    Keeps a HDF5 file open across many TrackDatabase calls.  In read only mode
+    no lock is taken, otherwise the lock is held until the session ends so that
+    many writes share a single lock hold.
+    """
+
+    def __init__(self, db, mode="r"):
+        self.mode = mode
+        self.manager = HDF5Manager(db, mode)
+        self.f = None
+        self.depth = 0
+
+    def open(self):
+        if self.depth == 0:
+            self.f = self.manager.__enter__()
+        self.depth += 1
+
+    def close(self):
+        self.depth -= 1
+        if self.depth == 0:
+            self.manager.__exit__(None, None, None)
+            self.f = None
+
+    def borrow(self, mode="r"):
+        if mode != "r" and self.mode == "r":
+            raise ValueError("Cannot write to the database in a read session")
+        return _BorrowedFile(self.f)
+
+
+class _BorrowedFile:
+    """Hands out a session's open file without closing it on exit."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def __enter__(self):
+        return self.f
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
 class TrackDatabase:
     def __init__(self, database_filename, read_only=False):
         """
@@ -69,6 +121,7 @@ class TrackDatabase:
         """
 
         self.database = database_filename
+        self._session = None
         if not os.path.exists(database_filename):
             logging.info("Creating new database %s", database_filename)
             f = h5py.File(database_filename, "w")
@@ -79,13 +132,45 @@ class TrackDatabase:
     def set_read_only(self, read_only):
         HDF5Manager.READ_ONLY = read_only
 
+    @contextmanager
+    def session(self, mode="r"):
+        """
+        Holds the database open for all calls made inside the with block, e.g.
+            with db.session() as s:
+                tracks = [s.get_track(clip_id, track_id) for ...]
+        Sessions are not shared between processes, each process should open its own.
+        :param mode: "r" for reads only, "a" to allow writes
+        """
+        if self._session is None:
+            self._session = HDF5Session(self.database, mode)
+        elif mode != "r" and self._session.mode == "r":
+            raise ValueError("Cannot open a write session inside a read session")
+        session = self._session
+        try:
+            session.open()
+        except:
+            if session.depth == 0:
+                self._session = None
+            raise
+        try:
+            yield self
+        finally:
+            session.close()
+            if session.depth == 0:
+                self._session = None
+
+    def _open(self, mode="r"):
+        if self._session is not None:
+            return self._session.borrow(mode)
+        return HDF5Manager(self.database, mode)
+
     def has_clip(self, clip_id):
         """
         Returns if database contains track information for given clip
         :param clip_id: name of clip
         :return: If the database contains given clip
         """
-        with HDF5Manager(self.database) as f:
+        with self._open() as f:
             clips = f["clips"]
             has_record = clip_id in clips and "finished" in clips[clip_id].attrs
             if has_record:
@@ -93,7 +178,7 @@ class TrackDatabase:
         return False
 
     def has_prediction(self, clip_id):
-        with HDF5Manager(self.database, "a") as f:
+        with self._open() as f:
             clips = f["clips"]
             # has_record = clip_id in clips and "finished" in clips[clip_id].attrs
             clip = clips[clip_id]
@@ -130,12 +215,12 @@ class TrackDatabase:
     #         track_attrs["prediction_classes"] = labels
 
     def finished_processing(self, clip_id):
-        with HDF5Manager(self.database, "a") as f:
+        with self._open("a") as f:
             clip_node = f["clips"][clip_id]
             clip_node.attrs["finished"] = True
 
     def get_labels(self):
-        with HDF5Manager(self.database) as f:
+        with self._open() as f:
             return f.attrs.get("labels", None)
 
     def create_clip(self, clip, overwrite=True):
@@ -147,7 +232,7 @@ class TrackDatabase:
         """
         logging.info("creating clip {}".format(clip.get_id()))
         clip_id = str(clip.get_id())
-        with HDF5Manager(self.database, "a") as f:
+        with self._open("a") as f:
             clips = f["clips"]
             if overwrite and clip_id in clips:
                 del clips[clip_id]
@@ -210,7 +295,7 @@ class TrackDatabase:
     def latest_date(self):
         start_time = None
 
-        with HDF5Manager(self.database) as f:
+        with self._open() as f:
             clips = f["clips"]
             results = {}
             for clip_id in clips:
@@ -226,7 +311,7 @@ class TrackDatabase:
         """
         Returns a list of clip_id, track_id pairs.
         """
-        with HDF5Manager(self.database) as f:
+        with self._open() as f:
             clips = f["clips"]
             results = {}
             for clip_id in clips:
@@ -248,7 +333,7 @@ class TrackDatabase:
         """
         Returns a list of clip_id, track_id pairs.
         """
-        with HDF5Manager(self.database) as f:
+        with self._open() as f:
             clips = f["clips"]
             tracks = []
             clip = clips[clip_id]
@@ -263,7 +348,7 @@ class TrackDatabase:
         """
         Returns a list of clip_id, track_id pairs.
         """
-        with HDF5Manager(self.database) as f:
+        with self._open() as f:
             clips = f["clips"]
             result = []
             for clip_id in clips:
@@ -284,7 +369,7 @@ class TrackDatabase:
         return result
 
     def remove_tag_info(self, clip_id, track_id):
-        with HDF5Manager(self.database, "a") as f:
+        with self._open("a") as f:
             clip = f["clips"][clip_id]
             try:
                 del clip["tag_frames"]
@@ -305,7 +390,7 @@ class TrackDatabase:
             track_id,
             track_tag,
         )
-        with HDF5Manager(self.database, "a") as f:
+        with self._open("a") as f:
             clip = f["clips"][clip_id]
             clip_tags = clip.get("tag_frames")
             if clip_tags is None:
@@ -375,7 +460,7 @@ class TrackDatabase:
         :param track_id:
         :return:
         """
-        with HDF5Manager(self.database) as f:
+        with self._open() as f:
             dataset = f["clips"][str(clip_id)][str(track_id)]
             result = self.dataset_track(dataset, track_id)
 
@@ -400,14 +485,14 @@ class TrackDatabase:
         :param track_id:
         :return:
         """
-        with HDF5Manager(self.database) as f:
+        with self._open() as f:
             track = f["clips"][clip_id][str(track_id)]
             if "predictions" in track:
                 return track["predictions"][:]
         return None
 
     def get_clip_background(self, clip_id):
-        with HDF5Manager(self.database) as f:
+        with self._open() as f:
             clip = f["clips"][str(clip_id)]
             if "background_frame" in clip:
                 return clip["background_frame"][:]
@@ -420,21 +505,23 @@ class TrackDatabase:
         :return:
         """
 
-        with HDF5Manager(self.database) as f:
-            dataset = f["clips"][str(clip_id)]
-            result = hdf5_attributes_dictionary(dataset)
-            result["tracks"] = len(dataset)
-            tag_frames = dataset.get("tag_frames")
-            if tag_frames:
-                result["tag_frames"] = {}
-                for key, value in tag_frames.attrs.items():
-                    result["tag_frames"][key] = value
-
-                tag_regions = tag_frames.get("tag_regions")
-                if tag_regions is not None:
-                    result["tag_frames"]["tag_regions"] = {}
-                    for key, value in tag_regions.attrs.items():
-                        result["tag_frames"]["tag_regions"][key] = value
+        with self._open() as f:
+            return self.dataset_clip(f["clips"][str(clip_id)])
+
+    def dataset_clip(self, dataset):
+        result = hdf5_attributes_dictionary(dataset)
+        result["tracks"] = len(dataset)
+        tag_frames = dataset.get("tag_frames")
+        if tag_frames:
+            result["tag_frames"] = {}
+            for key, value in tag_frames.attrs.items():
+                result["tag_frames"][key] = value
+
+            tag_regions = tag_frames.get("tag_regions")
+            if tag_regions is not None:
+                result["tag_frames"]["tag_regions"] = {}
+                for key, value in tag_regions.attrs.items():
+                    result["tag_frames"]["tag_regions"][key] = value
         return result
 
     def get_clip_tracks(self, clip_id):
@@ -443,18 +530,29 @@ class TrackDatabase:
         :param clip_id:
         :return:
         """
-        tracks = []
-        with HDF5Manager(self.database) as f:
-            clip = f["clips"][str(clip_id)]
-            for track_id in clip:
-                if track_id in special_datasets:
-                    continue
-                track = self.dataset_track(clip[track_id], track_id)
-                tracks.append(track)
-        return tracks
+        with self._open() as f:
+            return self.dataset_tracks(f["clips"][str(clip_id)])
+
+    def dataset_tracks(self, clip):
+        return [
+            self.dataset_track(clip[track_id], track_id)
+            for track_id in clip
+            if track_id not in special_datasets
+        ]
+
+    def get_clips_meta(self, clip_ids):
+        """
+        Yields (clip_id, clip meta, list of track meta) for each of clip_ids, reading
+        them all with the file open once
+        """
+        with self._open() as f:
+            clips = f["clips"]
+            for clip_id in clip_ids:
+                clip = clips[str(clip_id)]
+                yield clip_id, self.dataset_clip(clip), self.dataset_tracks(clip)
 
     def get_tag(self, clip_id, track_id):
-        with HDF5Manager(self.database) as f:
+        with self._open() as f:
             clips = f["clips"]
             track_node = clips[str(clip_id)][str(track_id)]
             return track_node.attrs["tag"]
@@ -472,23 +570,33 @@ class TrackDatabase:
         clip_id,
         frame_numbers=None,
         channels=None,
+        skip_missing=False,
     ):
+        """
+        :param skip_missing: leave out requested frames which aren't stored rather
+        than raising a KeyError
+        """
         frames = []
-        with HDF5Manager(self.database) as f:
+        with self._open() as f:
             clip = f["clips"][str(clip_id)]
             if "original_frames" not in clip:
                 return None
             frames_node = clip["original_frames"]
+            if storage_version(frames_node) < 2:
+                original_frames = FrameDatasets(frames_node)
+            else:
+                original_frames = OriginalFrames(frames_node, frame_numbers)
             if frame_numbers is None:
-                frame_numbers = []
-                for f_i in frames_node:
-                    frame_numbers.append(int(f_i))
-                frame_numbers.sort()
+                frame_numbers = original_frames.frame_numbers
             frame_iter = iter(frame_numbers)
 
             for frame_number in frame_iter:
-
-                frame = frames_node[str(frame_number)][:, :]
+                try:
+                    frame = original_frames[frame_number]
+                except KeyError:
+                    if not skip_missing:
+                        raise
+                    continue
                 frames.append(
                     Frame.from_channels([frame], [TrackChannels.thermal], frame_number)
                 )
@@ -512,7 +620,7 @@ class TrackDatabase:
         :param end_frame: last frame of slice to return (exclusive).
         :return: a list of numpy arrays of shape [channels, height, width] and of type np.int16
         """
-        with HDF5Manager(self.database) as f:
+        with self._open() as f:
             clips = f["clips"]
             clip_node = clips[str(clip_id)]
             track_node = clip_node[str(track_id)]
@@ -525,16 +633,25 @@ class TrackDatabase:
             track_start = track_node.attrs.get("start_frame")
             bad_frames = track_node.attrs.get("skipepd_frames", [])
             result = []
+            if frame_numbers is None:
+                frame_iter = range(start_frame, end_frame)
+            else:
+                frame_iter = list(frame_numbers)
+
             if original:
                 track_node = clip_node["original_frames"]
-            else:
+                if storage_version(track_node) < 2:
+                    track_node = FrameDatasets(track_node)
+                else:
+                    track_node = OriginalFrames(
+                        track_node, [f + track_start for f in frame_iter]
+                    )
+            elif storage_version(track_node) < 2:
                 if "cropped" in track_node:
                     track_node = track_node["cropped"]
-
-            if frame_numbers is None:
-                frame_iter = range(start_frame, end_frame)
+                track_node = FrameDatasets(track_node)
             else:
-                frame_iter = iter(frame_numbers)
+                track_node = CroppedFrames(track_node, frame_iter)
 
             for frame_number in frame_iter:
 
@@ -542,7 +659,7 @@ class TrackDatabase:
 
                     region = Region.region_from_array(bounds[frame_number])
                     region.frame_number = frame_number + track_start
-                    frame = track_node[str(frame_number + track_start)][:, :]
+                    frame = track_node[frame_number + track_start]
                     result.append(
                         Frame.from_channels(
                             [frame],
@@ -557,7 +674,7 @@ class TrackDatabase:
                     region = Region.region_from_array(bounds[frame_number])
                     if channels is None:
                         try:
-                            frame = track_node[str(frame_number)][:, :, :]
+                            frame = track_node[frame_number]
                             if frame.shape[0] < 5:
                                 frame_channels = [
                                     TrackChannels.thermal,
@@ -589,7 +706,7 @@ class TrackDatabase:
                             )
                     else:
                         try:
-                            frame = track_node[str(frame_number)][channels, :, :]
+                            frame = track_node[frame_number][channels, :, :]
                             result.append(
                                 Frame.from_channels(
                                     frame,
@@ -609,8 +726,92 @@ class TrackDatabase:
 
         return result
 
+    def split_requests(self, requests, max_frames):
+        """
+        Splits requests for get_tracks_batch into runs of at most max_frames frames,
+        a track with more frames than max_frames is given a run of its own
+        :param requests: list of (clip_id, track_id, frame_numbers)
+        :return: list of slices of requests
+        """
+        runs = []
+        start = 0
+        num_frames = 0
+        with self._open() as f:
+            clips = f["clips"]
+            for request_i, (clip_id, track_id, frame_iter) in enumerate(requests):
+                if frame_iter is None:
+                    track_node = clips[str(clip_id)][str(track_id)]
+                    frames = track_node.attrs["frames"]
+                else:
+                    frames = len(frame_iter)
+                if request_i > start and num_frames + frames > max_frames:
+                    runs.append(slice(start, request_i))
+                    start = request_i
+                    num_frames = 0
+                num_frames += frames
+        if start < len(requests):
+            runs.append(slice(start, len(requests)))
+        return runs
+
+    def get_tracks_batch(self, requests, channels=None):
+        """
+        Fetches the cropped frames of many tracks in one pass, without building
+        a Frame per frame.
+        :param requests: list of (clip_id, track_id, frame_numbers), frame numbers are
+        relative to the track start, None for every frame of the track
+        :param channels: channels to return, None for all stored channels
+        :return: TrackBatch, holding a zero padded array of shape
+        [frames, channels, height, width] with the frames of every request in order
+        """
+        arrays = []
+        bounds = []
+        frame_numbers = []
+        lengths = np.zeros(len(requests), dtype=np.int32)
+        bounds_columns = np.zeros(len(requests), dtype=np.int32)
+        with self._open() as f:
+            clips = f["clips"]
+            for request_i, (clip_id, track_id, frame_iter) in enumerate(requests):
+                track_node = clips[str(clip_id)][str(track_id)]
+                track_bounds = track_node.attrs["bounds_history"]
+                track_start = track_node.attrs.get("start_frame")
+                bad_frames = track_node.attrs.get("skipepd_frames", [])
+                if frame_iter is None:
+                    frame_iter = range(track_node.attrs["frames"])
+                else:
+                    frame_iter = list(frame_iter)
+                if storage_version(track_node) < 2:
+                    if "cropped" in track_node:
+                        track_node = track_node["cropped"]
+                    track_node = FrameDatasets(track_node)
+                else:
+                    track_node = CroppedFrames(track_node, frame_iter)
+                bounds_columns[request_i] = track_bounds.shape[1]
+                for frame_number in frame_iter:
+                    if frame_number in bad_frames:
+                        continue
+                    try:
+                        frame = track_node[frame_number]
+                        if channels is not None:
+                            frame = frame[channels, :, :]
+                    except:
+                        logging.debug(
+                            "trying to get clip %s track %s frame %s",
+                            clip_id,
+                            track_id,
+                            frame_number + track_start,
+                            exc_info=True,
+                        )
+                        continue
+                    arrays.append(frame)
+                    bounds.append(track_bounds[frame_number])
+                    frame_numbers.append(frame_number + track_start)
+                    lengths[request_i] += 1
+        return TrackBatch(
+            arrays, bounds, frame_numbers, lengths, bounds_columns, channels
+        )
+
     def remove_track(self, clip_id, track_id):
-        with HDF5Manager(self.database, "a") as f:
+        with self._open("a") as f:
             clips = f["clips"]
             clip_s = str(clip_id)
             track_s = str(track_id)
@@ -630,7 +831,7 @@ class TrackDatabase:
         :param clip_id: id of clip to remove
         :returns: true if clip was deleted, false if it could not be found.
         """
-        with HDF5Manager(self.database, "a") as f:
+        with self._open("a") as f:
             clips = f["clips"]
             if clip_id in clips:
                 del clips[clip_id]
@@ -640,7 +841,7 @@ class TrackDatabase:
 
     def set_sample_frames(self, clip_id, track_id, sample_frames):
         sample_frames.sort()
-        with HDF5Manager(self.database, "a") as f:
+        with self._open("a") as f:
             clips = f["clips"]
             clip_node = clips[str(clip_id)]
             track_node = clip_node[str(track_id)]
@@ -650,7 +851,7 @@ class TrackDatabase:
         logging.warn("Not adding prediction data as code needs to be written")
 
     # TODO IF NEEDED
-    #     with HDF5Manager(self.database, "a") as f:
+    #     with self._open("a") as f:
     #         clip = f["clips"][(str(clip_id))]
     #         track_node = clip[str(track_id)]
     #         predicted_tag = track_prediction.predicted_tag()
@@ -733,49 +934,26 @@ class TrackDatabase:
         logging.info("Adding track %s", track_id)
         if opts is None:
             opts = {}
-        with HDF5Manager(self.database, "a") as f:
+        with self._open("a") as f:
             clips = f["clips"]
             clip_node = clips[clip_id]
             has_prediction = False
             track_node = clip_node.create_group(track_id)
-            cropped_frame = track_node.create_group("cropped")
-            if "original_frames" in clip_node:
-                original_group = clip_node["original_frames"]
-            else:
-                original_group = clip_node.create_group("original_frames")
             skipped_frames = []
-            # write each frame out individually, as they will probably be different sizes.
-            original = None
+            cropped_shapes = np.zeros((len(cropped_data), 3), dtype=np.uint16)
+            cropped_arrays = []
             for frame_i, cropped in enumerate(cropped_data):
-                if original_thermal is not None:
-                    original = original_thermal[frame_i]
-                # using a chunk size of 1 for channels has the advantage that we can quickly load just one channel
-
-                if (
-                    original is not None
-                    and str(frame_i + track.start_frame) not in original_group
-                ):
-                    thermal_node = original_group.create_dataset(
-                        str(frame_i + track.start_frame),
-                        original.shape,
-                        chunks=original.shape,
-                        **opts,
-                        dtype=np.int16,
-                    )
-                    thermal_node[:, :] = original
-                # if original is not None:
                 if cropped.thermal.size > 0:
-                    height, width = cropped.shape
-                    chunks = (1, height, width)
                     cropped_array = cropped.as_array()
-                    dims = cropped_array.shape
-                    frame_node = cropped_frame.create_dataset(
-                        str(frame_i), dims, chunks=chunks, **opts, dtype=np.int16
-                    )
-
-                    frame_node[:, :, :] = cropped_array
+                    cropped_shapes[frame_i] = cropped_array.shape
+                    cropped_arrays.append(cropped_array.ravel())
                 else:
                     skipped_frames.append(frame_i + track.start_frame)
+            write_cropped_frames(track_node, cropped_shapes, cropped_arrays, opts)
+            if original_thermal is not None and len(original_thermal) > 0:
+                write_original_frames(
+                    clip_node, track.start_frame, original_thermal, opts
+                )
 
             # write out attributes
             track_stats = track.get_stats()
@@ -806,12 +984,8 @@ class TrackDatabase:
             for name, value in track_stats._asdict().items():
                 node_attrs[name] = value
             # frame history
-            node_attrs["mass_history"] = np.int32(
-                [bounds.mass for bounds in track.bounds_history]
-            )
-            node_attrs["bounds_history"] = np.int16(
-                [bounds.to_array() for bounds in track.bounds_history]
-            )
+            node_attrs["mass_history"] = np.int32(track.bounds_history.mass)
+            node_attrs["bounds_history"] = np.int16(track.bounds_history.to_array())
             f.flush()
 
             # mark the record as have been writen to.
@@ -824,3 +998,277 @@ def hdf5_attributes_dictionary(dataset):
     for key, value in dataset.attrs.items():
         result[key] = value
     return result
+
+
+def storage_version(node):
+    return node.attrs.get("storage_version", 1)
+
+
+def write_cropped_frames(track_node, shapes, arrays, opts):
+    """
+    Packs a track's cropped frames into one flat dataset, frame i is
+    cropped[offsets[i] : offsets[i + 1]] reshaped to shapes[i]
+    """
+    sizes = np.prod(shapes, axis=1, dtype=np.int64)
+    offsets = np.zeros(len(shapes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    total = int(offsets[-1])
+    if total > 0:
+        chunks = (min(total, CROPPED_CHUNK_SIZE),)
+        cropped = track_node.create_dataset(
+            "cropped", (total,), chunks=chunks, **opts, dtype=np.int16
+        )
+        cropped[:] = np.concatenate(arrays)
+    else:
+        track_node.create_dataset("cropped", (0,), dtype=np.int16)
+    track_node.create_dataset("cropped_offsets", data=offsets)
+    track_node.create_dataset("cropped_shapes", data=shapes)
+    track_node.attrs["storage_version"] = STORAGE_VERSION
+
+
+def write_original_frames(clip_node, start_frame, frames, opts):
+    """
+    Writes frames into the clip's original frames, indexed by frame number,
+    skipping any frames another track has already written
+    """
+    end_frame = start_frame + len(frames)
+    node = clip_node.get("original_frames")
+    if node is not None and storage_version(node) < 2:
+        for frame_i, original in enumerate(frames):
+            key = str(frame_i + start_frame)
+            if key not in node:
+                thermal_node = node.create_dataset(
+                    key, original.shape, chunks=original.shape, **opts, dtype=np.int16
+                )
+                thermal_node[:, :] = original
+        return
+    if node is None:
+        height, width = frames[0].shape
+        node = clip_node.create_dataset(
+            "original_frames",
+            (end_frame, height, width),
+            maxshape=(None, height, width),
+            chunks=(1, height, width),
+            **opts,
+            dtype=np.int16,
+        )
+        node.attrs["storage_version"] = STORAGE_VERSION
+    elif node.shape[0] < end_frame:
+        node.resize(end_frame, axis=0)
+    numbers_node = clip_node.get("original_frame_numbers")
+    if numbers_node is None:
+        # a dataset rather than an attribute, attributes are limited to 64k
+        numbers_node = clip_node.create_dataset(
+            "original_frame_numbers",
+            data=node.attrs.get("frame_numbers", np.zeros(0, dtype=np.uint32)),
+            maxshape=(None,),
+            chunks=(1024,),
+            dtype=np.uint32,
+        )
+        if "frame_numbers" in node.attrs:
+            del node.attrs["frame_numbers"]
+    frame_numbers = numbers_node[:]
+    written = np.isin(np.arange(start_frame, end_frame), frame_numbers)
+    if not np.any(written):
+        node[start_frame:end_frame] = np.asarray(frames)
+    else:
+        for frame_i in np.flatnonzero(~written):
+            node[start_frame + frame_i] = frames[frame_i]
+    new_numbers = np.flatnonzero(~written) + start_frame
+    if len(new_numbers) > 0:
+        numbers_node.resize(len(frame_numbers) + len(new_numbers), axis=0)
+        numbers_node[len(frame_numbers) :] = new_numbers
+
+
+class FrameDatasets:
+    """Reads frames stored one dataset per frame (storage version 1)."""
+
+    def __init__(self, node):
+        self.node = node
+
+    @property
+    def frame_numbers(self):
+        frame_numbers = [int(f_i) for f_i in self.node]
+        frame_numbers.sort()
+        return frame_numbers
+
+    def __getitem__(self, frame_number):
+        return self.node[str(frame_number)][()]
+
+
+class CroppedFrames:
+    """
+    Reads a track's packed cropped frames (storage version 2), all requested
+    frames are read with a single slice of the flat dataset
+    """
+
+    def __init__(self, track_node, frame_numbers):
+        self.offsets = track_node["cropped_offsets"][:]
+        self.shapes = track_node["cropped_shapes"][:]
+        self.start = 0
+        self.data = np.zeros(0, dtype=np.int16)
+        frame_numbers = [f for f in frame_numbers if f >= 0 and f < len(self.shapes)]
+        if len(frame_numbers) > 0:
+            self.start = self.offsets[min(frame_numbers)]
+            end = self.offsets[max(frame_numbers) + 1]
+            self.data = track_node["cropped"][self.start : end]
+
+    def __getitem__(self, frame_number):
+        if frame_number < 0 or np.prod(self.shapes[frame_number]) == 0:
+            raise KeyError("No cropped frame {}".format(frame_number))
+        start = self.offsets[frame_number] - self.start
+        end = self.offsets[frame_number + 1] - self.start
+        return self.data[start:end].reshape(self.shapes[frame_number])
+
+
+class OriginalFrames:
+    """
+    Reads a clip's original frames from one 3d dataset (storage version 2),
+    reading the span of requested frames in one go
+    """
+
+    def __init__(self, node, frame_numbers=None):
+        if "original_frame_numbers" in node.parent:
+            stored = node.parent["original_frame_numbers"][:]
+        else:
+            # written before frame numbers moved out of the attributes
+            stored = node.attrs["frame_numbers"]
+        self.frame_numbers = np.sort(stored).tolist()
+        self.stored = set(self.frame_numbers)
+        if frame_numbers is None:
+            frame_numbers = self.frame_numbers
+        frame_numbers = [f for f in frame_numbers if f in self.stored]
+        self.start = 0
+        self.data = None
+        if len(frame_numbers) > 0:
+            self.start = min(frame_numbers)
+            self.data = node[self.start : max(frame_numbers) + 1]
+
+    def __getitem__(self, frame_number):
+        if frame_number not in self.stored:
+            raise KeyError("No original frame {}".format(frame_number))
+        return self.data[frame_number - self.start]
+
+
+class TrackBatch:
+    """
+    Frames of many tracks packed into one zero padded array of shape
+    [frames, channels, height, width]. Frame i is
+    data[i, :, : shapes[i][0], : shapes[i][1]] with region bounds bounds[i],
+    the frames of request r are those in track_slice(r)
+    """
+
+    def __init__(
+        self, arrays, bounds, frame_numbers, lengths, bounds_columns, channels=None
+    ):
+        self.channels = channels
+        self.lengths = lengths
+        self.bounds_columns = bounds_columns
+        self.offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.frame_numbers = np.array(frame_numbers, dtype=np.int32)
+        self.shapes = np.zeros((len(arrays), 3), dtype=np.int32)
+        for i, array in enumerate(arrays):
+            self.shapes[i] = array.shape
+        self.bounds = np.zeros(
+            (len(bounds), max(bounds_columns, default=0)), dtype=np.int32
+        )
+        for i, bound in enumerate(bounds):
+            self.bounds[i, : len(bound)] = bound
+        dtype = arrays[0].dtype if len(arrays) > 0 else np.int16
+        self.data = np.zeros((len(arrays), *self.shapes.max(axis=0, initial=0)), dtype)
+        for i, array in enumerate(arrays):
+            c, h, w = array.shape
+            self.data[i, :c, :h, :w] = array
+
+    def __len__(self):
+        return len(self.data)
+
+    def track_slice(self, request_i):
+        return slice(self.offsets[request_i], self.offsets[request_i + 1])
+
+    def frames(self, request_i):
+        """Builds Frame views into data for the frames of one request"""
+        result = []
+        bounds_columns = self.bounds_columns[request_i]
+        for i in range(self.offsets[request_i], self.offsets[request_i + 1]):
+            c, h, w = self.shapes[i]
+            frame = self.data[i, :c, :h, :w]
+            region = Region.region_from_array(self.bounds[i, :bounds_columns])
+            if self.channels is not None:
+                result.append(
+                    Frame.from_channels(
+                        frame, self.channels, self.frame_numbers[i], region=region
+                    )
+                )
+            elif c < 5:
+                frame_channels = [TrackChannels.thermal, TrackChannels.filtered]
+                if c == 3:
+                    frame_channels.append(TrackChannels.mask)
+                result.append(
+                    Frame.from_channels(
+                        frame, frame_channels, self.frame_numbers[i], region=region
+                    )
+                )
+            else:
+                result.append(
+                    Frame.from_array(
+                        frame, self.frame_numbers[i], flow_clipped=True, region=region
+                    )
+                )
+        return result
+
+
+def migrate_database(source, destination, opts=None):
+    """
+    Copies a track database to destination, converting frames stored one
+    dataset per frame to the current storage version
+    """
+    if opts is None:
+        opts = {}
+    with h5py.File(source, "r") as f, h5py.File(destination, "w") as out:
+        for key, value in f.attrs.items():
+            out.attrs[key] = value
+        clips = f["clips"]
+        out_clips = out.create_group("clips")
+        for clip_id in clips:
+            logging.info("Migrating clip %s", clip_id)
+            migrate_clip(clips[clip_id], out_clips.create_group(clip_id), opts)
+
+
+def migrate_clip(clip_node, out_node, opts):
+    for key, value in clip_node.attrs.items():
+        out_node.attrs[key] = value
+    for key in clip_node:
+        node = clip_node[key]
+        if key == "original_frames" and storage_version(node) < 2:
+            frames = FrameDatasets(node)
+            frame_numbers = np.array(frames.frame_numbers)
+            # write each run of consecutive frames in one go
+            runs = np.split(
+                frame_numbers, np.flatnonzero(np.diff(frame_numbers) != 1) + 1
+            )
+            for run in runs:
+                if len(run) > 0:
+                    write_original_frames(
+                        out_node, run[0], [frames[f] for f in run], opts
+                    )
+        elif key not in special_datasets and storage_version(node) < 2:
+            out_track = out_node.create_group(key)
+            for track_key, value in node.attrs.items():
+                out_track.attrs[track_key] = value
+            # very old databases store the frames directly in the track
+            cropped = node["cropped"] if "cropped" in node else node
+            for track_key in node:
+                if track_key != "cropped" and not track_key.isdigit():
+                    node.copy(track_key, out_track)
+            shapes = np.zeros((node.attrs["frames"], 3), dtype=np.uint16)
+            arrays = []
+            for frame_i in range(len(shapes)):
+                if str(frame_i) in cropped:
+                    frame = cropped[str(frame_i)][()]
+                    shapes[frame_i] = frame.shape
+                    arrays.append(frame.ravel())
+            write_cropped_frames(out_track, shapes, arrays, opts)
+        else:
+            clip_node.copy(key, out_node)
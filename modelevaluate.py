@@ -29,6 +29,8 @@ import numpy as np
 
 crop_rectangle = tools.Rectangle(0, 0, 160, 120)
 PROB_THRESHOLD = 0.8
+# frames to read from the database at once, tracks are padded to the largest frame
+BATCH_FRAMES = 2048
 
 
 def evaluate_db_clips(model, config, after_date, confusion_file="tracks-confusion"):
@@ -54,29 +56,40 @@ def evaluate_db_clips(model, config, after_date, confusion_file="tracks-confusio
     actual = []
     predicted = []
     probs = []
-    for samples in samples_by_track.values():
-        s = samples[0]
-        background = dataset.db.get_clip_background(s.clip_id)
-        track_data = dataset.db.get_track(s.clip_id, s.track_id, channels=[0])
-        for f in track_data:
-            sub_back = f.region.subimage(background)
-            f.filtered = f.thermal - sub_back
-            f.resize_with_aspect(
-                (model.params.frame_size, model.params.frame_size),
-                crop_rectangle,
-                True,
+    track_samples = list(samples_by_track.values())
+    requests = [(s[0].clip_id, s[0].track_id, None) for s in track_samples]
+    for run in dataset.db.split_requests(requests, BATCH_FRAMES):
+        batch_samples = track_samples[run]
+        # only hold the database while reading, not while classifying
+        with dataset.db.session():
+            batch = dataset.db.get_tracks_batch(requests[run], channels=[0])
+            backgrounds = {
+                s[0].clip_id: dataset.db.get_clip_background(s[0].clip_id)
+                for s in batch_samples
+            }
+        for track_i, samples in enumerate(batch_samples):
+            s = samples[0]
+            background = backgrounds[s.clip_id]
+            track_data = batch.frames(track_i)
+            for f in track_data:
+                sub_back = f.region.subimage(background)
+                f.filtered = f.thermal - sub_back
+                f.resize_with_aspect(
+                    (model.params.frame_size, model.params.frame_size),
+                    crop_rectangle,
+                    True,
+                )
+            logging.debug(
+                f"Evaluating {s.clip_id}-{s.track_id} as {s.label} with {len(samples)} samples"
             )
-        logging.debug(
-            f"Evaluating {s.clip_id}-{s.track_id} as {s.label} with {len(samples)} samples"
-        )
-        for s in samples:
-            # make relative
-            s.frame_numbers = s.frame_numbers - s.start_frame
-        prediction = model.classify_track_data(s.track_id, track_data, samples)
-        logging.debug(prediction.description())
-        actual.append(s.label)
-        predicted.append(prediction.predicted_tag())
-        probs.append(prediction.max_score)
+            for s in samples:
+                # make relative
+                s.frame_numbers = s.frame_numbers - s.start_frame
+            prediction = model.classify_track_data(s.track_id, track_data, samples)
+            logging.debug(prediction.description())
+            actual.append(s.label)
+            predicted.append(prediction.predicted_tag())
+            probs.append(prediction.max_score)
     actual = np.array(actual)
     predicted = np.array(predicted)
     probs = np.array(probs)
@@ -27,6 +27,20 @@ class RawFrame(ABC):
             telemetry.fpa_temp_last_ffc,
         )
 
+    def parse_into(self, data, pix):
+        """
+        Copies the thermal pixels of data into pix, swapping to native byte order
+        :return: the frame's telemetry
+        """
+        telemetry = self.parse_telemetry(data[: self.get_telemetry_size()])
+        thermal_frame = np.frombuffer(
+            data,
+            dtype=self.img_dtype.newbyteorder(">"),
+            offset=self.get_telemetry_size(),
+        ).reshape(self.res_y, self.res_x)
+        np.copyto(pix, thermal_frame)
+        return telemetry
+
     @abstractmethod
     def get_telemetry_size(self):
         ...
@@ -0,0 +1,107 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2020, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import math
+
+
+class ClassifyScheduler:
+    """
+    Decides how many tracks to classify each frame so that tracking, recording and
+    classifying keep up with the camera.
+    Each frame has a budget of 1 / fps seconds, whatever a frame leaves unused is
+    saved as credit and classifying a track spends it. Tracks are classified when
+    there is enough credit for them at the recent cost of classifying a track, so
+    a quiet pi classifies often and a busy one waits until it has caught up.
+    """
+
+    # weight given to the newest cost in the moving averages
+    SMOOTHING = 0.2
+    # most seconds of credit that can be saved up, or owed after a busy spell
+    MAX_CREDIT = 2
+    # classify nothing while frames are received this many seconds before processing
+    MAX_BEHIND = 1
+
+    def __init__(self, fps, max_tracks, track_cost=None):
+        self.budget = 1 / fps
+        self.max_tracks = max_tracks
+        # moving averages of seconds to process a frame without classifying and
+        # to classify a track
+        self.frame_cost = None
+        self.track_cost = track_cost
+        self.credit = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.frames = 0
+        self.classify_frames = 0
+        self.tracks_classified = 0
+        self.behind_frames = 0
+
+    def _average(self, average, cost):
+        if average is None:
+            return cost
+        return average + ClassifyScheduler.SMOOTHING * (cost - average)
+
+    def tracks_to_classify(self, num_tracks, behind=0):
+        """
+        Returns how many of num_tracks tracks should be classified this frame
+        :param behind: seconds since the frame was received
+        """
+        if num_tracks == 0:
+            return 0
+        if behind > ClassifyScheduler.MAX_BEHIND:
+            self.behind_frames += 1
+            return 0
+        if self.track_cost is None:
+            # classify one to find out what it costs
+            return 1 if self.credit >= 0 else 0
+        count = math.floor(self.credit / self.track_cost)
+        return max(0, min(count, num_tracks, self.max_tracks))
+
+    def _add_credit(self, seconds):
+        max_credit = max(ClassifyScheduler.MAX_CREDIT, self.track_cost or 0)
+        self.credit = max(-max_credit, min(self.credit + seconds, max_credit))
+
+    def classified(self, num_tracks, took):
+        """Records that classifying num_tracks tracks took seconds"""
+        self._add_credit(-took)
+        if num_tracks == 0:
+            return
+        self.track_cost = self._average(self.track_cost, took / num_tracks)
+        self.classify_frames += 1
+        self.tracks_classified += num_tracks
+
+    def frame_processed(self, took):
+        """Records the seconds a frame took to process, not including classifying"""
+        self.frame_cost = self._average(self.frame_cost, took)
+        self._add_credit(self.budget - took)
+        self.frames += 1
+
+    def __str__(self):
+        frame_ms = 0 if self.frame_cost is None else self.frame_cost * 1000
+        track_ms = 0 if self.track_cost is None else self.track_cost * 1000
+        return "classified {} tracks in {}/{} frames behind {} frames credit {}ms frame {}ms track {}ms".format(
+            self.tracks_classified,
+            self.classify_frames,
+            self.frames,
+            self.behind_frames,
+            round(self.credit * 1000),
+            round(frame_ms),
+            round(track_ms),
+        )
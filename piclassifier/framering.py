@@ -0,0 +1,144 @@
+"""
+Passes frames from the socket reader to the classifier process through shared
+memory, so only slot indices go over the process queue rather than pickled frames.
+"""
+
+from datetime import timedelta
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+from cptv import Frame
+
+# times are stored in microseconds
+TELEMETRY_DTYPE = np.dtype(
+    [
+        ("time_on", np.int64),
+        ("last_ffc_time", np.int64),
+        ("temp_c", np.float64),
+        ("last_ffc_temp_c", np.float64),
+        ("received_at", np.float64),
+    ]
+)
+COUNTERS = ["written", "read", "waited", "dropped"]
+WRITTEN, READ, WAITED, DROPPED = range(len(COUNTERS))
+
+
+def to_micros(delta):
+    return delta // timedelta(microseconds=1)
+
+
+class FrameRing:
+    """
+    A ring of preallocated frame slots in shared memory.
+    The reader takes a free slot with acquire, fills pix and telemetry and puts
+    the slot index on the queue with publish. The classifier gets the frame with
+    get, which copies it out and frees the slot.
+    When every slot is waiting to be classified the reader waits up to max_wait
+    seconds for one to be freed, then drops the frame.
+    Each counter is only changed by one process so needs no lock.
+    """
+
+    def __init__(self, headers, slots=32, max_wait=0.1):
+        self.slots = slots
+        self.max_wait = max_wait
+        self.shape = (headers.res_y, headers.res_x)
+        self.dtype = np.dtype("uint{}".format(headers.pixel_bits))
+        self.free = multiprocessing.Semaphore(slots)
+        self.shm = shared_memory.SharedMemory(create=True, size=self._size())
+        self._attach()
+        self.counters[:] = 0
+
+    def _size(self):
+        pix_size = self.slots * int(np.prod(self.shape)) * self.dtype.itemsize
+        return (
+            pix_size
+            + self.slots * TELEMETRY_DTYPE.itemsize
+            + len(COUNTERS) * np.dtype(np.int64).itemsize
+        )
+
+    def _attach(self):
+        buf = self.shm.buf
+        self.pix = np.ndarray((self.slots,) + self.shape, self.dtype, buf)
+        offset = self.pix.nbytes
+        self.telemetry = np.ndarray((self.slots,), TELEMETRY_DTYPE, buf, offset)
+        offset += self.telemetry.nbytes
+        self.counters = np.ndarray((len(COUNTERS),), np.int64, buf, offset)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["shm"] = self.shm.name
+        for name in ["pix", "telemetry", "counters"]:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=state["shm"])
+        self._attach()
+
+    def acquire(self):
+        """
+        Returns the index of the next slot to write to, or None if none were freed
+        within max_wait and the frame should be dropped
+        """
+        if not self.free.acquire(block=False):
+            self.counters[WAITED] += 1
+            if not self.free.acquire(timeout=self.max_wait):
+                self.counters[DROPPED] += 1
+                logging.debug("Dropping frame %s slots are waiting", self.behind)
+                return None
+        return int(self.counters[WRITTEN] % self.slots)
+
+    def release(self, index):
+        """Frees a slot from acquire which isn't going to be published"""
+        self.free.release()
+
+    def publish(self, index, telemetry, received_at):
+        """Saves the telemetry of a filled slot, the index must then be queued"""
+        self.telemetry[index] = (
+            to_micros(telemetry.time_on),
+            to_micros(telemetry.last_ffc_time),
+            telemetry.fpa_temp,
+            telemetry.fpa_temp_last_ffc,
+            received_at,
+        )
+        self.counters[WRITTEN] += 1
+
+    def get(self, index):
+        """Returns the frame in a published slot and frees the slot"""
+        telemetry = self.telemetry[index]
+        # the classifier keeps frames after processing them so needs its own copy
+        frame = Frame(
+            self.pix[index].copy(),
+            timedelta(microseconds=int(telemetry["time_on"])),
+            timedelta(microseconds=int(telemetry["last_ffc_time"])),
+            float(telemetry["temp_c"]),
+            float(telemetry["last_ffc_temp_c"]),
+        )
+        frame.received_at = float(telemetry["received_at"])
+        self.counters[READ] += 1
+        self.free.release()
+        return frame
+
+    @property
+    def behind(self):
+        """Number of frames waiting to be classified"""
+        return int(self.counters[WRITTEN] - self.counters[READ])
+
+    @property
+    def dropped(self):
+        return int(self.counters[DROPPED])
+
+    def stats(self):
+        return {name: int(count) for name, count in zip(COUNTERS, self.counters)}
+
+    def close(self):
+        self.pix = None
+        self.telemetry = None
+        self.counters = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
@@ -28,6 +28,7 @@ from .irrecorder import IRRecorder
 
 from .motiondetector import MotionDetector, SlidingWindow
 from .processor import Processor
+from .classifyscheduler import ClassifyScheduler
 from ml_tools.preprocess import (
     preprocess_frame,
     preprocess_movement,
@@ -80,31 +81,49 @@ class NeuralInterpreter(Interpreter):
 
 
 class LiteInterpreter(Interpreter):
-    def __init__(self, model_name):
+    def __init__(self, model_name, max_batch=1):
         super().__init__(model_name)
 
-        import tensorflow as tf
-
         model_name = Path(model_name)
-        model_name = model_name.with_suffix(".tflite")
-        self.interpreter = tf.lite.Interpreter(str(model_name))
-
-        self.interpreter.allocate_tensors()  # Needed before execution!
-
-        self.output = self.interpreter.get_output_details()[
-            0
-        ]  # Model has single output.
-        self.input = self.interpreter.get_input_details()[0]  # Model has single input.
+        self.model_file = str(model_name.with_suffix(".tflite"))
+        # an interpreter for each batch size, resizing an interpreter's input
+        # reallocates all of its tensors
+        self.interpreters = {}
+        for batch_size in range(1, max_batch + 1):
+            self.get_interpreter(batch_size)
+        self.interpreter, self.input, self.output = self.interpreters[1]
+
+    def get_interpreter(self, batch_size):
+        """Returns the interpreter, input and output details for batch_size inputs"""
+        if batch_size not in self.interpreters:
+            import tensorflow as tf
+
+            interpreter = tf.lite.Interpreter(self.model_file)
+            # Model has single input and output.
+            input_details = interpreter.get_input_details()[0]
+            if input_details["shape"][0] != batch_size:
+                shape = np.array(input_details["shape"])
+                shape[0] = batch_size
+                interpreter.resize_tensor_input(input_details["index"], shape)
+            interpreter.allocate_tensors()  # Needed before execution!
+            self.interpreters[batch_size] = (
+                interpreter,
+                interpreter.get_input_details()[0],
+                interpreter.get_output_details()[0],
+            )
+        return self.interpreters[batch_size]
 
     def predict(self, input_x):
-        start = time.time()
-        input_x = np.float32(input_x)
-        input_x = input_x[np.newaxis, :]
+        return self.predict_batch([input_x])[0]
 
-        self.interpreter.set_tensor(self.input["index"], input_x)
-        self.interpreter.invoke()
-        pred = self.interpreter.get_tensor(self.output["index"])[0]
-        logging.info("taken %s to predict", time.time() - start)
+    def predict_batch(self, inputs):
+        start = time.time()
+        input_x = np.float32(inputs)
+        interpreter, input_details, output_details = self.get_interpreter(len(input_x))
+        interpreter.set_tensor(input_details["index"], input_x)
+        interpreter.invoke()
+        pred = interpreter.get_tensor(output_details["index"])
+        logging.info("taken %s to predict %s", time.time() - start, len(pred))
 
         return pred
 
@@ -128,11 +147,11 @@ def get_full_classifier(model):
     return classifier
 
 
-def get_classifier(model):
+def get_classifier(model, max_batch=1):
     model_name, model_type = os.path.splitext(model.model_file)
     logging.info("Loading %s", model_name)
     if model_type == ".tflite":
-        classifier = LiteInterpreter(model_name)
+        classifier = LiteInterpreter(model_name, max_batch=max_batch)
     elif model_type == ".xml":
         classifier = NeuralInterpreter(model_name)
     else:
@@ -143,12 +162,28 @@ def get_classifier(model):
 
 
 def run_classifier(
-    frame_queue, config, thermal_config, headers, classify=True, detect_after=None
+    frame_queue,
+    config,
+    thermal_config,
+    headers,
+    classify=True,
+    detect_after=None,
+    frame_ring=None,
 ):
+    """
+    Classifies frames from frame_queue until a stop signal is received.
+    If frame_ring is given the queue holds slot indices of frames in it,
+    rather than frames
+    """
     init_logging()
     try:
         pi_classifier = PiClassifier(
-            config, thermal_config, headers, classify, detect_after
+            config,
+            thermal_config,
+            headers,
+            classify,
+            detect_after,
+            frame_ring=frame_ring,
         )
         while True:
             frame = frame_queue.get()
@@ -160,6 +195,8 @@ def run_classifier(
                 if frame == "skip":
                     pi_classifier.skip_frame()
             else:
+                if frame_ring is not None:
+                    frame = frame_ring.get(frame)
                 pi_classifier.process_frame(frame)
     except:
         logging.error("Error running classifier restarting ..", exc_info=True)
@@ -171,12 +208,9 @@ predictions = None
 class PiClassifier(Processor):
     """Classifies frames from leptond"""
 
-    NUM_CONCURRENT_TRACKS = 1
+    # most tracks classified in one frame, the scheduler decides how many
+    NUM_CONCURRENT_TRACKS = 4
     DEBUG_EVERY = 20
-    MAX_CONSEC = 1
-    # after every MAX_CONSEC frames skip this many frames
-    # this gives the cpu a break
-    SKIP_FRAMES = 10
 
     def __init__(
         self,
@@ -186,16 +220,16 @@ class PiClassifier(Processor):
         classify,
         detect_after=None,
         preview_type=None,
+        frame_ring=None,
     ):
         self._output_dir = thermal_config.recorder.output_dir
+        self.frame_ring = frame_ring
         self.headers = headers
         super().__init__()
         self.frame_num = 0
         self.clip = None
         self.enable_per_track_information = False
         self.rolling_track_classify = {}
-        self.skip_classifying = 0
-        self.classified_consec = 0
         self.classify = classify
         self.config = config
         self.predictions = None
@@ -277,7 +311,9 @@ class PiClassifier(Processor):
 
         if self.classify:
             model = config.classify.models[0]
-            self.classifier = get_classifier(model)
+            self.classifier = get_classifier(
+                model, max_batch=PiClassifier.NUM_CONCURRENT_TRACKS
+            )
             self.frames_per_classify = (
                 self.classifier.params.square_width
                 * self.classifier.params.square_width
@@ -295,7 +331,12 @@ class PiClassifier(Processor):
             except ValueError:
                 self.fp_index = None
             self.preprocess_fn = self.get_preprocess_fn()
-            self.startup_classifier()
+            predict_time = self.startup_classifier()
+            self.scheduler = ClassifyScheduler(
+                headers.fps,
+                PiClassifier.NUM_CONCURRENT_TRACKS,
+                track_cost=predict_time,
+            )
 
     def get_preprocess_fn(self):
         import tensorflow as tf
@@ -355,21 +396,26 @@ class PiClassifier(Processor):
         self.track_extractor.start_tracking(self.clip, preview_frames)
 
     def startup_classifier(self):
-        # classifies an empty frame to force loading of the model into memory
+        # classifies empty frames to force loading of the model into memory, in
+        # each batch size tracks may be classified in
         in_shape = self.classifier.shape()[1:]
         p_frame = np.zeros((in_shape), np.float32)
+        for batch_size in range(1, PiClassifier.NUM_CONCURRENT_TRACKS + 1):
+            self.classifier.predict_batch([p_frame] * batch_size)
+        # then times another as a first guess of how long classifying takes
+        start = time.time()
         self.classifier.predict(p_frame)
+        return time.time() - start
 
-    def get_active_tracks(self):
+    def classifiable_tracks(self):
+        return [track for track in self.clip.active_tracks if len(track) > 10]
+
+    def get_active_tracks(self, max_tracks=NUM_CONCURRENT_TRACKS):
         """
-        Gets current clips active_tracks and returns the top NUM_CONCURRENT_TRACKS order by priority
+        Gets current clips active_tracks and returns the top max_tracks order by priority
         """
-        active_tracks = self.clip.active_tracks
-        active_tracks = [track for track in active_tracks if len(track) > 10]
-        if (
-            len(active_tracks) <= PiClassifier.NUM_CONCURRENT_TRACKS
-            or not self.classify
-        ):
+        active_tracks = self.classifiable_tracks()
+        if len(active_tracks) <= max_tracks or not self.classify:
             return active_tracks
         active_predictions = []
         for track in active_tracks:
@@ -384,44 +430,41 @@ class PiClassifier(Processor):
             reverse=True,
         )
 
-        top_priority = [
-            track.track_id
-            for track in top_priority[: PiClassifier.NUM_CONCURRENT_TRACKS]
-        ]
+        top_priority = [track.track_id for track in top_priority[:max_tracks]]
         classify_tracks = [
             track for track in active_tracks if track.get_id() in top_priority
         ]
         return classify_tracks
 
-    def identify_last_frame(self):
+    def identify_last_frame(self, max_tracks=NUM_CONCURRENT_TRACKS):
         """
         Runs through track identifying segments, and then returns it's prediction of what kind of animal this is.
-        One prediction will be made for every active_track of the last frame.
-        :return: TrackPrediction object
+        The top max_tracks active tracks of the last frame are predicted together in one batch.
+        :return: number of tracks predicted
         """
-
-        prediction_smooth = 0.1
-
-        smooth_prediction = None
-        smooth_novelty = None
-
-        prediction = 0.0
-        novelty = 0.0
-
-        active_tracks = self.get_active_tracks()
-        new_prediction = False
-        for i, track in enumerate(active_tracks):
-            regions = []
+        active_tracks = self.get_active_tracks(max_tracks)
+        to_predict = []
+        for track in active_tracks:
             track_prediction = self.predictions.get_or_create_prediction(
                 track, keep_all=False
             )
             if self.type == "IR":
-                prediction, mass = self.identify_ir(track)
+                preprocessed, mass = self.preprocess_ir(track)
             else:
-                prediction, mass = self.identify_thermal(track)
-            if prediction is None:
+                preprocessed, mass = self.preprocess_thermal(track)
+            if preprocessed is None:
                 track_prediction.last_frame_classified = self.clip.current_frame
                 continue
+            to_predict.append((track, track_prediction, preprocessed, mass))
+        if len(to_predict) == 0:
+            return 0
+
+        predictions = self.classifier.predict_batch(
+            [preprocessed for _, _, preprocessed, _ in to_predict]
+        )
+        for (track, track_prediction, _, mass), prediction in zip(
+            to_predict, predictions
+        ):
             track_prediction.classified_frame(self.clip.current_frame, prediction, mass)
             logging.debug(
                 "Track %s is predicted as %s", track, track_prediction.get_prediction()
@@ -449,21 +492,20 @@ class PiClassifier(Processor):
                         False,
                     )
 
-            new_prediction = True
         if self.bluetooth_beacons:
-            if new_prediction:
-                active_predictions = []
-                for track in self.clip.active_tracks:
-                    track_prediction = self.predictions.prediction_for(track.get_id())
-                    if track_prediction:
-                        active_predictions.append(track_prediction)
-                beacon.classification(active_predictions)
-
-    def identify_ir(self, track):
+            active_predictions = []
+            for track in self.clip.active_tracks:
+                track_prediction = self.predictions.prediction_for(track.get_id())
+                if track_prediction:
+                    active_predictions.append(track_prediction)
+            beacon.classification(active_predictions)
+        return len(to_predict)
+
+    def preprocess_ir(self, track):
         region = track.bounds_history[-1]
         frame = self.clip.frame_buffer.get_last_frame()
         if frame is None:
-            return
+            return None, 1
         params = self.classifier.params
         preprocessed = preprocess_ir(
             frame.copy(),
@@ -474,16 +516,13 @@ class PiClassifier(Processor):
             region=region,
             preprocess_fn=self.preprocess_fn,
         )
-        if preprocessed is None:
-            return None, 1
-        prediction = self.classifier.predict(preprocessed)
-        return prediction, 1
+        return preprocessed, 1
 
-    def identify_thermal(self, track):
+    def preprocess_thermal(self, track):
         regions = track.bounds_history[-self.frames_per_classify * 2 :]
         frames = self.clip.frame_buffer.get_last_x(len(regions))
         if frames is None:
-            return
+            return None, 0
         indices = np.random.choice(
             len(regions),
             min(self.frames_per_classify, len(regions)),
@@ -523,10 +562,7 @@ class PiClassifier(Processor):
             reference_level=refs,
             keep_edge=params.keep_edge,
         )
-        if preprocessed is None:
-            return None, mass
-        prediction = self.classifier.predict(preprocessed)
-        return prediction, mass
+        return preprocessed, mass
 
     def get_recent_frame(self):
         if self.clip:
@@ -558,13 +594,12 @@ class PiClassifier(Processor):
         self.service.quit()
 
     def skip_frame(self):
-        self.skip_classifying -= 1
-
         if self.clip:
             self.clip.current_frame += 1
 
     def process_frame(self, lepton_frame):
         start = time.time()
+        identify_took = 0
         self.motion_detector.process_frame(lepton_frame)
         self.process_time += time.time() - start
 
@@ -620,25 +655,21 @@ class PiClassifier(Processor):
             )
             self.rec_time += time.time() - s_r
             if self.classify:
-                if self.motion_detector.ffc_affected or self.clip.on_preview():
-                    self.skip_classifying = PiClassifier.SKIP_FRAMES
-                    self.classified_consec = 0
-                elif (
-                    self.classify
-                    and self.motion_detector.ffc_affected is False
+                if (
+                    self.motion_detector.ffc_affected is False
                     and self.clip.active_tracks
-                    and self.skip_classifying <= 0
                     and not self.clip.on_preview()
                 ):
-                    id_start = time.time()
-                    self.identify_last_frame()
-                    self.identify_time += time.time() - id_start
-                    self.classified_consec += 1
-                    if self.classified_consec == PiClassifier.MAX_CONSEC:
-                        self.skip_classifying = PiClassifier.SKIP_FRAMES
-                        self.classified_consec = 0
-                else:
-                    self.classified_consec = 0
+                    num_tracks = self.scheduler.tracks_to_classify(
+                        len(self.classifiable_tracks()),
+                        time.time() - lepton_frame.received_at,
+                    )
+                    if num_tracks > 0:
+                        id_start = time.time()
+                        classified = self.identify_last_frame(num_tracks)
+                        identify_took = time.time() - id_start
+                        self.identify_time += identify_took
+                        self.scheduler.classified(classified, identify_took)
             elif self.tracking is None and self.tracking_events:
                 active_tracks = self.get_active_tracks()
 
@@ -668,7 +699,8 @@ class PiClassifier(Processor):
         elif self.clip is not None:
             self.end_clip()
 
-        self.skip_classifying -= 1
+        if self.classify:
+            self.scheduler.frame_processed(time.time() - start - identify_took)
         self.frame_num += 1
         self.total_time += time.time() - start
         if (
@@ -676,9 +708,16 @@ class PiClassifier(Processor):
             and self.frame_num % PiClassifier.DEBUG_EVERY == 0
         ):
             average = np.mean(self.fps_timer.get_frames())
-
+            extra_stats = ""
+            if self.frame_ring is not None:
+                extra_stats = " queued {} frames dropped {}".format(
+                    self.frame_ring.behind, self.frame_ring.dropped
+                )
+            if self.classify:
+                extra_stats += " {}".format(self.scheduler)
+                self.scheduler.reset_stats()
             logging.info(
-                "tracking {}% process {}%  identify {}% rec{}%s fps {}/sec  cpu % {} memory % {} behind by {} seconds".format(
+                "tracking {}% process {}%  identify {}% rec{}%s fps {}/sec  cpu % {} memory % {} behind by {} seconds{}".format(
                     round(100 * self.tracking_time / self.total_time, 3),
                     round(100 * self.process_time / self.total_time, 3),
                     round(100 * self.identify_time / self.total_time, 3),
@@ -687,6 +726,7 @@ class PiClassifier(Processor):
                     psutil.cpu_percent(),
                     psutil.virtual_memory()[2],
                     time.time() - lepton_frame.received_at,
+                    extra_stats,
                 )
             )
             self.tracking_time = 0
@@ -23,6 +23,7 @@ from ml_tools import tools
 from .motiondetector import MotionDetector
 from .piclassifier import PiClassifier, run_classifier
 from .cameras import lepton3
+from .framering import FrameRing
 from .cameras.irframe import IRFrame
 import multiprocessing
 from cptv import Frame
@@ -180,7 +181,7 @@ def parse_cptv(file, config, thermal_config_file, preview_type):
         pi_classifier.disconnected()
 
 
-def get_processor(process_queue, config, thermal_config, headers):
+def get_processor(process_queue, config, thermal_config, headers, frame_ring=None):
     p_processor = multiprocessing.Process(
         target=run_classifier,
         args=(
@@ -190,6 +191,7 @@ def get_processor(process_queue, config, thermal_config, headers):
             headers,
             thermal_config.motion.run_classifier,
         ),
+        kwargs={"frame_ring": frame_ring},
     )
     return p_processor
 
@@ -216,8 +218,11 @@ def handle_connection(connection, config, thermal_config_file):
     )
 
     process_queue = multiprocessing.Queue()
+    frame_ring = FrameRing(headers)
 
-    processor = get_processor(process_queue, config, thermal_config, headers)
+    processor = get_processor(
+        process_queue, config, thermal_config, headers, frame_ring
+    )
     processor.start()
 
     edge = config.tracking.edge_pixels
@@ -249,9 +254,14 @@ def handle_connection(connection, config, thermal_config_file):
             except:
                 pass
             read += 1
-            frame = raw_frame.parse(data)
-            frame.received_at = time.time()
-            cropped_frame = crop_rectangle.subimage(frame.pix)
+            slot = frame_ring.acquire()
+            if slot is None:
+                # classifier is too far behind
+                process_queue.put(SKIP_SIGNAL)
+                continue
+            telemetry = raw_frame.parse_into(data, frame_ring.pix[slot])
+            received_at = time.time()
+            cropped_frame = crop_rectangle.subimage(frame_ring.pix[slot])
             t_max = np.amax(cropped_frame)
             t_min = np.amin(cropped_frame)
             # seems to happen if pi is working hard
@@ -261,12 +271,18 @@ def handle_connection(connection, config, thermal_config_file):
                         t_max, t_min, psutil.cpu_percent(), psutil.virtual_memory()[2]
                     )
                 )
+                frame_ring.release(slot)
                 process_queue.put(SKIP_SIGNAL)
             elif read < 100:
+                frame_ring.release(slot)
                 process_queue.put(SKIP_SIGNAL)
             else:
-                process_queue.put(frame)
+                frame_ring.publish(slot, telemetry, received_at)
+                process_queue.put(slot)
     finally:
         time.sleep(5)
         # give it a moment to close down properly
         processor.terminate()
+        logging.info("frame ring %s", frame_ring.stats())
+        frame_ring.close()
+        frame_ring.unlink()
@@ -0,0 +1,47 @@
+from piclassifier.classifyscheduler import ClassifyScheduler
+
+
+def simulate(frame_cost, track_cost, num_tracks=3, frames=90, scheduler=None):
+    """Returns tracks classified per frame over frames frames at 9 fps"""
+    if scheduler is None:
+        scheduler = ClassifyScheduler(9, max_tracks=4, track_cost=track_cost)
+    counts = []
+    for _ in range(frames):
+        count = scheduler.tracks_to_classify(num_tracks)
+        if count > 0:
+            scheduler.classified(count, count * track_cost)
+        scheduler.frame_processed(frame_cost)
+        counts.append(count)
+    return counts
+
+
+class TestClassifyScheduler:
+    def test_quiet_pi_classifies_more(self):
+        quiet = simulate(0.01, 0.2)
+        busy = simulate(0.09, 0.2)
+        assert sum(quiet) > 3 * sum(busy) > 0
+        # classifying never uses more time than the frames allowed
+        for counts, frame_cost in [(quiet, 0.01), (busy, 0.09)]:
+            used = len(counts) * frame_cost + sum(counts) * 0.2
+            assert used <= len(counts) / 9
+
+    def test_limits(self):
+        assert max(simulate(0, 0.01, num_tracks=2)) == 2
+        assert max(simulate(0, 0.01, num_tracks=10)) == 4
+        assert sum(simulate(0.2, 0.01)) == 0
+
+    def test_nothing_when_behind(self):
+        scheduler = ClassifyScheduler(9, max_tracks=4)
+        assert scheduler.tracks_to_classify(2) == 1
+        assert scheduler.tracks_to_classify(2, behind=5) == 0
+        assert scheduler.behind_frames == 1
+
+    def test_resumes_after_overload(self):
+        scheduler = ClassifyScheduler(9, max_tracks=4, track_cost=0.2)
+        # ten minutes of frames over budget
+        assert sum(simulate(0.131, 0.2, frames=5400, scheduler=scheduler)) == 0
+        assert scheduler.credit >= -ClassifyScheduler.MAX_CREDIT
+        counts = simulate(0.06, 0.2, frames=90, scheduler=scheduler)
+        # only the capped debt and one track's cost need to be made up, 5 seconds
+        spare = 1 / 9 - 0.06
+        assert counts.index(1) <= (ClassifyScheduler.MAX_CREDIT + 0.2) / spare + 1
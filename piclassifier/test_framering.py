@@ -0,0 +1,92 @@
+import multiprocessing
+
+import numpy as np
+
+from piclassifier.cameras.lepton3 import Lepton3
+from piclassifier.framering import FrameRing
+from piclassifier.headerinfo import HeaderInfo
+
+HEADERS = HeaderInfo(
+    res_x=160,
+    res_y=120,
+    fps=9,
+    brand="flir",
+    model="lepton3.5",
+    frame_size=160 * 120 * 2 + 640,
+    pixel_bits=16,
+    serial="",
+    firmware="",
+)
+
+
+def classify(frame_ring, slots, results):
+    for slot in iter(slots.get, None):
+        results.put(int(np.sum(frame_ring.get(slot).pix, dtype=np.int64)))
+
+
+def raw_frame(rng):
+    telemetry = rng.integers(0, 256, 640, dtype=np.uint8).tobytes()
+    pix = rng.integers(0, 2**16, (120, 160), dtype=np.uint16)
+    return telemetry + pix.astype(">u2").tobytes()
+
+
+class TestFrameRing:
+    def test_frames_match_parse(self):
+        rng = np.random.default_rng(6)
+        lepton = Lepton3(HEADERS)
+        ring = FrameRing(HEADERS, slots=4)
+        try:
+            for i in range(10):
+                data = raw_frame(rng)
+                slot = ring.acquire()
+                telemetry = lepton.parse_into(data, ring.pix[slot])
+                ring.publish(slot, telemetry, float(i))
+                frame = ring.get(slot)
+                expected = lepton.parse(data)
+                assert np.array_equal(frame.pix, expected.pix)
+                assert frame.time_on == expected.time_on
+                assert frame.last_ffc_time == expected.last_ffc_time
+                assert frame.temp_c == expected.temp_c
+                assert frame.received_at == i
+            assert ring.stats() == {
+                "written": 10,
+                "read": 10,
+                "waited": 0,
+                "dropped": 0,
+            }
+        finally:
+            ring.close()
+            ring.unlink()
+
+    def test_drops_when_full(self):
+        rng = np.random.default_rng(7)
+        lepton = Lepton3(HEADERS)
+        ring = FrameRing(HEADERS, slots=2, max_wait=0)
+        try:
+            slots = []
+            for i in range(3):
+                slot = ring.acquire()
+                if slot is None:
+                    continue
+                telemetry = lepton.parse_into(raw_frame(rng), ring.pix[slot])
+                ring.publish(slot, telemetry, float(i))
+                slots.append(slot)
+            assert slots == [0, 1]
+            assert ring.behind == 2
+            assert ring.dropped == 1
+
+            queue = multiprocessing.Queue()
+            results = multiprocessing.Queue()
+            classifier = multiprocessing.Process(
+                target=classify, args=(ring, queue, results)
+            )
+            classifier.start()
+            queue.put(slots[0])
+            assert results.get(timeout=30) == np.sum(ring.pix[slots[0]], dtype=np.int64)
+            queue.put(None)
+            classifier.join(timeout=30)
+            assert ring.behind == 1
+            assert ring.acquire() == 0
+        finally:
+            ring.close()
+            ring.unlink()
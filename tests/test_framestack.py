@@ -0,0 +1,41 @@
+import json
+import os
+import numpy as np
+from load.clip import Clip
+from load.cliptrackextractor import ClipTrackExtractor
+from config.config import Config
+
+
+class TrackRecorder(ClipTrackExtractor):
+    """Records the bounds of each track before tracks are filtered"""
+
+    def apply_track_filtering(self, clip):
+        self.tracks = [
+            [region.to_array().tolist() for region in track.bounds_history]
+            for track in clip.tracks
+        ]
+        super().apply_track_filtering(clip)
+
+
+class TestFrameStack:
+    CPTV_FILES = ["clips/possum.cptv", "clips/hedgehog.cptv"]
+    # bounds of each track before filtering
+    TRACKS_FILE = "clips/tracks.json"
+
+    def test_single_pass_matches_two_pass(self):
+        config = Config.get_defaults()
+        dir_name = os.path.dirname(os.path.realpath(__file__))
+        with open(os.path.join(dir_name, TestFrameStack.TRACKS_FILE), "r") as f:
+            expected_tracks = json.load(f)
+        for cptv_file in TestFrameStack.CPTV_FILES:
+            file_name = os.path.join(dir_name, cptv_file)
+            backgrounds = []
+            for single_pass in [False, True]:
+                track_extractor = TrackRecorder(
+                    config.tracking, False, single_pass=single_pass
+                )
+                clip = Clip(config.tracking["thermal"], file_name, clip_id=1)
+                track_extractor.parse_clip(clip)
+                assert track_extractor.tracks == expected_tracks[cptv_file]
+                backgrounds.append(clip.background)
+            assert np.array_equal(backgrounds[0], backgrounds[1])
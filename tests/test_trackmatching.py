@@ -0,0 +1,29 @@
+from track.track import optimal_matches
+
+
+class TestTrackMatching:
+    def test_optimal_matches_most_tracks(self):
+        # greedily track_a takes region_1, leaving track_b unmatched
+        scores = [
+            (1, "track_a", "region_1"),
+            (2, "track_a", "region_2"),
+            (3, "track_b", "region_1"),
+        ]
+        matches = optimal_matches(scores)
+        assert sorted(matches) == [
+            (2, "track_a", "region_2"),
+            (3, "track_b", "region_1"),
+        ]
+
+    def test_optimal_matches_lowest_distance(self):
+        scores = [
+            (1, "track_a", "region_1"),
+            (5, "track_a", "region_2"),
+            (2, "track_b", "region_1"),
+            (9, "track_b", "region_2"),
+        ]
+        matches = optimal_matches(scores)
+        assert sorted(matches) == [
+            (2, "track_b", "region_1"),
+            (5, "track_a", "region_2"),
+        ]
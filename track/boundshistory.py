@@ -0,0 +1,252 @@
+"""
+classifier-pipeline - this is a server side component that manipulates cptv
+files and to create a classification model of animals present
+Copyright (C) 2018, The Cacophony Project
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import deque
+
+import numpy as np
+
+from track_extraction.track.region import Region
+
+# frame number stored for regions without one
+NO_FRAME = -1
+
+
+class BoundsHistory:
+    """
+    Regions of a track stored as columns of arrays which grow by doubling, so
+    appending is O(1) and each frame takes a few dozen bytes rather than a Region
+    object.
+
+    Behaves like a list of Region, regions are created when they are read so any
+    changes made to a region must be saved by setting it back e.g.
+    history[i] = region
+    """
+
+    # number of non blank regions averaged by average_mass and average_area
+    AVERAGE_COUNT = 5
+
+    COLUMNS = {
+        "ltwh": (np.int32, (4,)),
+        "centroid": (np.float64, (2,)),
+        "mass": (np.int64, ()),
+        "pixel_variance": (np.float32, ()),
+        "frame_number": (np.int32, ()),
+        "id": (np.int32, ()),
+        "was_cropped": (np.bool_, ()),
+        "blank": (np.bool_, ()),
+        "is_along_border": (np.bool_, ()),
+    }
+
+    def __init__(self, regions=None, capacity=16):
+        self._size = 0
+        self._columns = {
+            name: np.zeros((capacity,) + shape, dtype=dtype)
+            for name, (dtype, shape) in BoundsHistory.COLUMNS.items()
+        }
+        # indices of the last non blank regions and their mass and area sums
+        self._recent = deque()
+        self._recent_mass = 0
+        self._recent_area = 0
+        if regions is not None:
+            for region in regions:
+                self.append(region)
+
+    @classmethod
+    def _from_columns(cls, columns):
+        history = cls(capacity=0)
+        history._columns = columns
+        history._size = len(columns["mass"])
+        history._count_recent()
+        return history
+
+    def _grow(self):
+        capacity = max(16, 2 * len(self._columns["mass"]))
+        for name, column in self._columns.items():
+            grown = np.zeros((capacity,) + column.shape[1:], dtype=column.dtype)
+            grown[: self._size] = column[: self._size]
+            self._columns[name] = grown
+
+    def _set(self, i, region):
+        columns = self._columns
+        columns["ltwh"][i] = (region.x, region.y, region.width, region.height)
+        columns["centroid"][i] = region.centroid
+        columns["mass"][i] = region.mass
+        columns["pixel_variance"][i] = region.pixel_variance
+        columns["frame_number"][i] = (
+            NO_FRAME if region.frame_number is None else region.frame_number
+        )
+        columns["id"][i] = region.id
+        columns["was_cropped"][i] = region.was_cropped
+        columns["blank"][i] = region.blank
+        columns["is_along_border"][i] = region.is_along_border
+
+    def _area(self, i):
+        _, _, width, height = self._columns["ltwh"][i]
+        return int(width) * int(height)
+
+    def _add_recent(self, i):
+        self._recent.append(i)
+        self._recent_mass += int(self._columns["mass"][i])
+        self._recent_area += self._area(i)
+        if len(self._recent) > BoundsHistory.AVERAGE_COUNT:
+            oldest = self._recent.popleft()
+            self._recent_mass -= int(self._columns["mass"][oldest])
+            self._recent_area -= self._area(oldest)
+
+    def _count_recent(self):
+        """Recalculates the sums of the last non blank regions"""
+        self._recent = deque()
+        self._recent_mass = 0
+        self._recent_area = 0
+        non_blank = np.flatnonzero(~self.blank)[-BoundsHistory.AVERAGE_COUNT :]
+        for i in non_blank:
+            self._add_recent(int(i))
+
+    def append(self, region):
+        if self._size == len(self._columns["mass"]):
+            self._grow()
+        i = self._size
+        self._set(i, region)
+        self._size += 1
+        if not region.blank:
+            self._add_recent(i)
+
+    def _index(self, i):
+        if i < 0:
+            i += self._size
+        if i < 0 or i >= self._size:
+            raise IndexError("bounds history index out of range")
+        return i
+
+    def __setitem__(self, i, region):
+        i = self._index(i)
+        self._set(i, region)
+        if i >= self._recent_start():
+            self._count_recent()
+
+    def _recent_start(self):
+        if len(self._recent) < BoundsHistory.AVERAGE_COUNT:
+            return 0
+        return self._recent[0]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return BoundsHistory._from_columns(
+                {
+                    name: column[: self._size][i].copy()
+                    for name, column in self._columns.items()
+                }
+            )
+        i = self._index(i)
+        columns = self._columns
+        x, y, width, height = columns["ltwh"][i].tolist()
+        frame_number = int(columns["frame_number"][i])
+        return Region(
+            x,
+            y,
+            width,
+            height,
+            centroid=columns["centroid"][i].tolist(),
+            mass=int(columns["mass"][i]),
+            frame_number=None if frame_number == NO_FRAME else frame_number,
+            pixel_variance=columns["pixel_variance"][i],
+            id=int(columns["id"][i]),
+            was_cropped=bool(columns["was_cropped"][i]),
+            blank=bool(columns["blank"][i]),
+            is_along_border=bool(columns["is_along_border"][i]),
+        )
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield self[i]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.regions()
+
+    def regions(self):
+        """Returns an object array of Region"""
+        regions = np.empty(self._size, dtype=object)
+        for i, region in enumerate(self):
+            regions[i] = region
+        return regions
+
+    def average_mass(self):
+        """Average mass of last 5 regions that weren't blank"""
+        if len(self._recent) == 0:
+            return 0
+        return self._recent_mass / len(self._recent)
+
+    def average_area(self):
+        """Average area of last 5 regions that weren't blank"""
+        if len(self._recent) == 0:
+            return 0
+        return self._recent_area / len(self._recent)
+
+    def to_array(self):
+        """Returns the rows of Region.to_array for every region"""
+        x, y, width, height = self.ltwh.T
+        return np.stack(
+            [
+                x,
+                y,
+                x + width,
+                y + height,
+                self.frame_number,
+                self.mass,
+                self.blank,
+            ],
+            axis=1,
+        ).astype(np.uint16)
+
+    # the column properties are views which are only valid until the next append
+
+    @property
+    def ltwh(self):
+        return self._columns["ltwh"][: self._size]
+
+    @property
+    def centroid(self):
+        return self._columns["centroid"][: self._size]
+
+    @property
+    def mass(self):
+        return self._columns["mass"][: self._size]
+
+    @property
+    def pixel_variance(self):
+        return self._columns["pixel_variance"][: self._size]
+
+    @property
+    def frame_number(self):
+        return self._columns["frame_number"][: self._size]
+
+    @property
+    def blank(self):
+        return self._columns["blank"][: self._size]
+
+    @property
+    def is_along_border(self):
+        return self._columns["is_along_border"][: self._size]
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self._columns.values())
@@ -5,7 +5,12 @@ import cv2
 import numpy as np
 
 from track_extraction.ml_tools.tools import Rectangle
-from track_extraction.track.track import Track
+from track_extraction.track.track import (
+    Track,
+    match_regions,
+    optimal_matches,
+    track_movement_statistics,
+)
 from track_extraction.track.region import Region
 from track_extraction.ml_tools.imageprocessing import normalize
 
@@ -35,6 +40,8 @@ class ClipTracker(ABC):
         self.calc_stats = calc_stats
         self._tracking_time = None
         self.min_dimension = config.min_dimension
+        # match tracks to regions with the lowest total distance, rather than greedily
+        self.optimal_assignment = config.params.get("assignment", "greedy") == "optimal"
         # if self.config.dilation_pixels > 0:
         #     size = self.config.dilation_pixels * 2 + 1
         #     self.dilate_kernel = np.ones((size, size), np.uint8)
@@ -85,12 +92,24 @@ class ClipTracker(ABC):
         :return: uint8 filtered frame and adjusted clip threshold for normalized frame
         """
 
-        filtered = np.float32(thermal.copy())
+        workspace = clip.get_workspace(thermal.shape)
+        filtered = workspace.get("thermal", np.float32)
+        np.copyto(filtered, thermal, casting="unsafe")
         avg_change = int(round(np.average(thermal) - clip.stats.mean_background_value))
-        np.clip(filtered - clip.background - avg_change, 0, None, out=filtered)
-        filtered, stats = normalize(filtered, new_max=255)
+        subtracted = workspace.get(
+            "subtracted", np.result_type(filtered, clip.background)
+        )
+        np.subtract(filtered, clip.background, out=subtracted)
+        np.subtract(subtracted, avg_change, out=subtracted)
+        np.clip(subtracted, 0, None, out=filtered)
+        # the filtered frame is kept by the frame buffer so needs its own array
+        filtered, stats = normalize(
+            filtered, new_max=255, out=np.empty(thermal.shape, np.float32)
+        )
         if self.config.denoise:
-            filtered = cv2.fastNlMeansDenoising(np.uint8(filtered), None)
+            image = workspace.get("image", np.uint8)
+            np.copyto(image, filtered, casting="unsafe")
+            filtered = cv2.fastNlMeansDenoising(image, None)
         if stats[1] == stats[2]:
             mapped_thresh = clip.background_thresh
         else:
@@ -103,6 +122,11 @@ class ClipTracker(ABC):
         Create any new tracks required.
         """
         unmatched_regions, matched_tracks = self._match_existing_tracks(clip, regions)
+        # regions hash by address, so iterating the set would make new tracks
+        # depend on memory layout, create them in the order they were detected
+        unmatched_regions = [
+            region for region in regions if region in unmatched_regions
+        ]
         new_tracks = self._create_new_tracks(clip, unmatched_regions)
 
         unactive_tracks = clip.active_tracks - matched_tracks - new_tracks
@@ -111,13 +135,13 @@ class ClipTracker(ABC):
         return
 
     def _match_existing_tracks(self, clip, regions):
-        scores = []
         used_regions = set()
         unmatched_regions = set(regions)
         active = list(clip.active_tracks)
         active.sort(key=lambda x: x.get_id())
-        for track in active:
-            scores.extend(track.match(regions))
+        scores = match_regions(active, regions)
+        if self.optimal_assignment:
+            scores = optimal_matches(scores)
 
         # makes tracking consistent by ordering by score then by frame since target then track id
         scores.sort(
@@ -324,7 +348,7 @@ class ClipTracker(ABC):
             track.trim()
             track.set_end_s(clip.frames_per_second)
 
-        track_stats = [(track.get_stats(), track) for track in clip.tracks]
+        track_stats = list(zip(track_movement_statistics(clip.tracks), clip.tracks))
         track_stats.sort(reverse=True, key=lambda record: record[0].score)
         if self.verbose:
             for stats, track in track_stats:
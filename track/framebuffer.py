@@ -55,6 +55,17 @@ class FrameBuffer:
         if self.opt_flow is None:
             self.opt_flow = get_optical_flow_function(self.high_quality_flow)
 
+    def __getstate__(self):
+        # optical flow functions can't be pickled, they are recreated on load
+        state = self.__dict__.copy()
+        state["opt_flow"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.calc_flow:
+            self.set_optical_flow()
+
     def add_frame(self, thermal, filtered, mask, frame_number, ffc_affected=False):
         self.prev_frame = self.current_frame
         frame = Frame(thermal, filtered, mask, frame_number, ffc_affected=ffc_affected)
@@ -0,0 +1,67 @@
+import numpy as np
+
+from track.boundshistory import BoundsHistory
+from track_extraction.track.region import Region
+
+
+def make_region(rng, frame_number):
+    x, y = rng.integers(0, 100, 2)
+    width, height = rng.integers(1, 40, 2)
+    return Region(
+        int(x),
+        int(y),
+        int(width),
+        int(height),
+        centroid=[x + width / 2, y + height / 2],
+        mass=int(rng.integers(0, 500)),
+        frame_number=frame_number,
+        pixel_variance=np.float32(rng.random()),
+        blank=bool(rng.random() < 0.3),
+    )
+
+
+def scan_average(regions, attribute):
+    """Average of the last 5 non blank regions"""
+    values = [getattr(r, attribute) for r in regions if not r.blank][-5:]
+    if len(values) == 0:
+        return 0
+    return sum(values) / len(values)
+
+
+class TestBoundsHistory:
+    def test_behaves_like_list_of_regions(self):
+        rng = np.random.default_rng(1)
+        regions = []
+        history = BoundsHistory(capacity=2)
+        for frame_number in range(40):
+            region = make_region(rng, frame_number)
+            regions.append(region)
+            history.append(region)
+            assert history.average_mass() == scan_average(regions, "mass")
+            assert history.average_area() == scan_average(regions, "area")
+
+        assert len(history) == len(regions)
+        for expected, actual in zip(regions, history):
+            assert np.array_equal(expected.to_array(), actual.to_array())
+            assert actual.centroid == list(expected.centroid)
+            assert actual.pixel_variance == expected.pixel_variance
+        assert history[-1].frame_number == regions[-1].frame_number
+        assert np.array_equal(
+            history.to_array(), [region.to_array() for region in regions]
+        )
+
+        trimmed = history[3:20]
+        assert [r.frame_number for r in trimmed] == list(range(3, 20))
+        assert trimmed.average_mass() == scan_average(regions[3:20], "mass")
+
+    def test_set_region_updates_averages(self):
+        rng = np.random.default_rng(2)
+        regions = [make_region(rng, frame_number) for frame_number in range(10)]
+        history = BoundsHistory(regions)
+        region = history[-1]
+        region.mass += 100
+        region.blank = not region.blank
+        history[-1] = region
+        regions[-1] = region
+        assert history.average_mass() == scan_average(regions, "mass")
+        assert history.average_area() == scan_average(regions, "area")
@@ -0,0 +1,147 @@
+import math
+
+import numpy as np
+
+from config.config import Config
+from ml_tools.tools import eucl_distance
+from track.track import Track, TrackMovementStatistics, track_movement_statistics
+from track_extraction.track.region import Region
+
+
+def make_track(rng, frames):
+    tracking_config = Config.get_defaults().tracking["thermal"]
+    track = Track(1, tracking_config=tracking_config)
+    track.start_frame = 0
+    for frame_number in range(frames):
+        x, y = rng.integers(0, 100, 2)
+        width, height = rng.integers(5, 40, 2)
+        region = Region(
+            int(x),
+            int(y),
+            int(width),
+            int(height),
+            centroid=[x + width / 2, y + height / 2],
+            mass=int(rng.integers(1, 500)),
+            frame_number=frame_number,
+            pixel_variance=np.float32(rng.random() * 10),
+            blank=frame_number > 0 and bool(rng.random() < 0.2),
+            is_along_border=bool(rng.random() < 0.2),
+        )
+        track.add_region(region)
+    return track
+
+
+def frame_stats(track):
+    """The original per frame Track.get_stats"""
+    if len(track) <= 1:
+        return TrackMovementStatistics()
+    bounds_history = list(track.bounds_history)
+    non_blank = [bound for bound in bounds_history if not bound.blank]
+    mass_history = [int(bound.mass) for bound in non_blank]
+    variance_history = [
+        bound.pixel_variance for bound in non_blank if bound.pixel_variance
+    ]
+    movement = 0
+    max_offset = 0
+
+    frames_moved = 0
+    avg_vel = 0
+    first_point = bounds_history[0].mid
+    for i, (vx, vy) in enumerate(zip(track.vel_x, track.vel_y)):
+        region = bounds_history[i]
+        if not region.blank:
+            avg_vel += abs(vx) + abs(vy)
+        if i == 0:
+            continue
+
+        if region.blank or bounds_history[i - 1].blank:
+            continue
+        if region.has_moved(bounds_history[i - 1]) or region.is_along_border:
+            distance = (vx**2 + vy**2) ** 0.5
+            movement += distance
+            offset = eucl_distance(first_point, region.mid)
+            max_offset = max(max_offset, offset)
+            frames_moved += 1
+    avg_vel = avg_vel / len(mass_history)
+    max_offset = math.sqrt(max_offset)
+    delta_std = float(np.mean(variance_history)) ** 0.5
+    jitter_bigger = 0
+    jitter_smaller = 0
+    for i, bound in enumerate(bounds_history[1:]):
+        prev_bound = bounds_history[i]
+        if prev_bound.is_along_border or bound.is_along_border:
+            continue
+        height_diff = bound.height - prev_bound.height
+        width_diff = prev_bound.width - bound.width
+        thresh_h = max(
+            Track.MIN_JITTER_CHANGE, prev_bound.height * Track.JITTER_THRESHOLD
+        )
+        thresh_v = max(
+            Track.MIN_JITTER_CHANGE, prev_bound.width * Track.JITTER_THRESHOLD
+        )
+        if abs(height_diff) > thresh_h:
+            if height_diff > 0:
+                jitter_bigger += 1
+            else:
+                jitter_smaller += 1
+        elif abs(width_diff) > thresh_v:
+            if width_diff > 0:
+                jitter_bigger += 1
+            else:
+                jitter_smaller += 1
+
+    movement_points = (movement**0.5) + max_offset
+    delta_points = delta_std * 25.0
+    jitter_percent = int(
+        round(100 * (jitter_bigger + jitter_smaller) / float(track.frames))
+    )
+
+    blank_percent = int(round(100.0 * track.blank_frames / track.frames))
+    score = (
+        min(movement_points, 100)
+        + min(delta_points, 100)
+        + (100 - jitter_percent)
+        + (100 - blank_percent)
+    )
+    return TrackMovementStatistics(
+        movement=float(movement),
+        max_offset=float(max_offset),
+        average_mass=float(np.mean(mass_history)),
+        median_mass=float(np.median(mass_history)),
+        delta_std=float(delta_std),
+        score=float(score),
+        region_jitter=jitter_percent,
+        jitter_bigger=jitter_bigger,
+        jitter_smaller=jitter_smaller,
+        blank_percent=blank_percent,
+        frames_moved=frames_moved,
+        mass_std=float(np.std(mass_history)),
+        average_velocity=float(avg_vel),
+    )
+
+
+class TestTrackStats:
+    def test_batch_matches_each_track(self):
+        rng = np.random.default_rng(4)
+        tracks = [make_track(rng, frames) for frames in [1, 12, 2, 30, 7]]
+        batch = track_movement_statistics(tracks)
+        assert batch[0] == TrackMovementStatistics()
+        for track, stats in zip(tracks, batch):
+            expected = frame_stats(track)
+            assert np.allclose(expected, stats, rtol=1e-12, atol=0)
+            assert track.get_stats() == stats
+
+    def test_jitter(self):
+        rng = np.random.default_rng(5)
+        track = make_track(rng, 3)
+        for i, height in enumerate([10, 20, 10]):
+            region = track.bounds_history[i]
+            region.width = 10
+            region.height = height
+            region.blank = False
+            region.is_along_border = False
+            track.bounds_history[i] = region
+        stats = track.get_stats()
+        assert stats.jitter_bigger == 1
+        assert stats.jitter_smaller == 1
+        assert stats.region_jitter == 67
@@ -23,11 +23,12 @@ from collections import namedtuple
 
 from track_extraction.ml_tools.tools import Rectangle
 from track_extraction.track.region import Region
+from track_extraction.track.boundshistory import BoundsHistory
 from track_extraction.kalman.kalman import Kalman
-from track_extraction.ml_tools.tools import eucl_distance
 from track_extraction.ml_tools.datasetstructures import get_segments, SegmentHeader, SegmentType
 import cv2
 import logging
+from scipy.optimize import linear_sum_assignment
 from track_extraction.track.tracker import Tracker
 
 
@@ -116,77 +117,32 @@ class RegionTracker(Tracker):
         return size_difference
 
     def match(self, regions, track):
-        scores = []
-        avg_mass = track.average_mass()
-        max_distances = self.get_max_distance_change(track)
-        for region in regions:
-            size_change = self.get_size_change(track.average_area(), region)
-            distances = self.last_bound.average_distance(region)
-
-            max_size_change = get_max_size_change(track, region)
-            max_mass_change = self.get_max_mass_change_percent(track, avg_mass)
-
-            logging.debug(
-                "Track %s %s has max size change %s, distances %s to region %s size change %s max distance %s",
-                track,
-                track.last_bound,
-                max_size_change,
-                distances,
-                region,
-                size_change,
-                max_distances,
-            )
-            # only for thermal
-            if type == "thermal":
-                # GP should figure out good values for the 3 distances rather than the mean
-                distances = [np.mean(distances)]
-                max_distances = max_distances[:1]
-            else:
-                distances = [(distances[0] + distances[2]) / 2]
-                max_distances = max_distances[:1]
-
-            if max_mass_change and abs(avg_mass - region.mass) > max_mass_change:
-                logging.info(
-                    "track {} region mass {} deviates too much from {}".format(
-                        track.get_id(),
-                        region.mass,
-                        avg_mass,
-                    )
-                )
-                continue
-            skip = False
-            for distance, max_distance in zip(distances, max_distances):
-                if max_distance is None:
-                    continue
-                if distance > max_distance:
-
-                    logging.info(
-                        "track {} distance score {} bigger than max distance {}".format(
-                            track.get_id(), distance, max_distance
-                        )
-                    )
-                    skip = True
-                    break
-                    # continue
-            if skip:
-                continue
-
-            if size_change > max_size_change:
-                logging.info(
-                    "track {} size_change {} bigger than max size_change {}".format(
-                        track.get_id(), size_change, max_size_change
-                    )
-                )
-                continue
-            # only for thermal
-            if type == "ir":
-                distance_score = np.mean(distances)
-            else:
-                # GP should figure out good values for the 3 distances rather than the mean
-                distance_score = distances[0]
+        return match_regions([track], regions)
 
-            scores.append((distance_score, track, region))
-        return scores
+    def match_stats(self, track):
+        """
+        Statistics of track used to match it against every region in a frame
+        :return: tuple of MATCH_STATS values
+        """
+        avg_mass = track.average_mass()
+        # only the top left max distance is used
+        max_distance = self.get_max_distance_change(track)[0]
+        max_mass_change = self.get_max_mass_change_percent(track, avg_mass)
+        size_change, border_size_change = get_max_size_change(track)
+        last_bound = self.last_bound
+        return (
+            last_bound.x,
+            last_bound.y,
+            last_bound.right,
+            last_bound.bottom,
+            last_bound.is_along_border,
+            avg_mass,
+            track.average_area(),
+            max_distance,
+            max_mass_change or 0,
+            size_change,
+            border_size_change,
+        )
 
     def add_region(self, region):
         self.frames += 1
@@ -298,22 +254,251 @@ class RegionTracker(Tracker):
             return None
 
 
-def get_max_size_change(track, region):
-    exiting = region.is_along_border and not track.last_bound.is_along_border
-    entering = not exiting and track.last_bound.is_along_border
+def get_max_size_change(track):
+    """
+    Max size change allowed for a region matching track
+    :return: (size change, size change when the track or region is along the border)
+    """
     region_percent = 1.5
     if len(track) < 5:
         # may increase at first
         region_percent = 2
-    logging.info("Track %s entering %s exiting %s", track, entering, exiting)
     vel = np.sum(np.abs(track.velocity))
-    if entering or exiting:
-        region_percent = 2
-        if vel > 10:
-            region_percent *= 3
-    elif vel > 10:
+    # entering or exiting
+    border_percent = 2
+    if vel > 10:
+        border_percent *= 3
         region_percent *= 2
-    return region_percent
+    return region_percent, border_percent
+
+
+MATCH_STATS = [
+    "x",
+    "y",
+    "right",
+    "bottom",
+    "is_along_border",
+    "avg_mass",
+    "avg_area",
+    "max_distance",
+    "max_mass_change",
+    "size_change",
+    "border_size_change",
+]
+STAT_INDEX = {stat: i for i, stat in enumerate(MATCH_STATS)}
+
+
+def match_regions(tracks, regions):
+    """
+    Scores every track against every region in one pass.  Each track's statistics
+    are calculated once, then pairs where the region is further than the track could
+    have moved, or its mass or size changed too much, are pruned.
+    The distance is the average of the squared distances between the top left and
+    bottom right corners.
+    :return: list of (distance score, track, region) in track then region order
+    """
+    if len(tracks) == 0 or len(regions) == 0:
+        return []
+    stats = np.array(
+        [track.tracker.match_stats(track) for track in tracks], dtype=np.float64
+    )
+    stats = {stat: stats[:, i, np.newaxis] for stat, i in STAT_INDEX.items()}
+    region_stats = np.array(
+        [
+            (
+                region.x,
+                region.y,
+                region.right,
+                region.bottom,
+                region.is_along_border,
+                region.mass,
+                region.area,
+            )
+            for region in regions
+        ],
+        dtype=np.float64,
+    ).T
+    x, y, right, bottom, is_along_border, mass, area = region_stats
+
+    top_left = (np.trunc(x) - stats["x"]) ** 2 + (np.trunc(y) - stats["y"]) ** 2
+    bottom_right = (right - stats["right"]) ** 2 + (bottom - stats["bottom"]) ** 2
+    distances = (top_left + bottom_right) / 2
+    valid = distances <= stats["max_distance"]
+
+    max_mass_change = stats["max_mass_change"]
+    valid &= (max_mass_change == 0) | (
+        np.abs(stats["avg_mass"] - mass) <= max_mass_change
+    )
+
+    size_change = np.abs(area - stats["avg_area"]) / (stats["avg_area"] + 50)
+    max_size_change = np.where(
+        (stats["is_along_border"] > 0) | (is_along_border > 0),
+        stats["border_size_change"],
+        stats["size_change"],
+    )
+    valid &= size_change <= max_size_change
+    logging.debug(
+        "Pruned %s of %s track region pairs", valid.size - np.sum(valid), valid.size
+    )
+    return [
+        (float(distances[t_i, r_i]), tracks[t_i], regions[r_i])
+        for t_i, r_i in zip(*np.nonzero(valid))
+    ]
+
+
+def optimal_matches(scores):
+    """
+    Chooses the track region pairs from scores which match the most tracks with
+    the lowest total distance, rather than greedily taking the closest pairs first
+    :param scores: list of (distance score, track, region)
+    :return: the chosen subset of scores
+    """
+    if len(scores) == 0:
+        return scores
+    tracks = list(dict.fromkeys(score[1] for score in scores))
+    regions = list(dict.fromkeys(score[2] for score in scores))
+    track_index = {track: i for i, track in enumerate(tracks)}
+    region_index = {region: i for i, region in enumerate(regions)}
+    # unmatchable pairs cost more than every matchable pair together so are only
+    # chosen when there is nothing else left
+    unmatchable = sum(score[0] for score in scores) + 1
+    costs = np.full((len(tracks), len(regions)), unmatchable, dtype=np.float64)
+    pairs = {}
+    for score in scores:
+        t_i = track_index[score[1]]
+        r_i = region_index[score[2]]
+        costs[t_i, r_i] = score[0]
+        pairs[(t_i, r_i)] = score
+    rows, cols = linear_sum_assignment(costs)
+    return [pairs[(t_i, r_i)] for t_i, r_i in zip(rows, cols) if (t_i, r_i) in pairs]
+
+
+def track_movement_statistics(tracks):
+    """
+    Calculates Track.get_stats for every track in one pass, the frames of all tracks
+    are concatenated so movement, offset, velocity and jitter are array operations
+    and only the per track totals are reduced by track.
+    :return: list of TrackMovementStatistics in track order
+    """
+    stats = [TrackMovementStatistics()] * len(tracks)
+    scored = [i for i, track in enumerate(tracks) if len(track) > 1]
+    if len(scored) == 0:
+        return stats
+    histories = [tracks[i].bounds_history for i in scored]
+    lengths = np.array([len(history) for history in histories])
+    starts = np.cumsum(lengths) - lengths
+    track_i = np.repeat(np.arange(len(scored)), lengths)
+    follows = np.arange(len(track_i)) != starts[track_i]
+
+    ltwh = np.concatenate([history.ltwh for history in histories]).astype(np.int64)
+    x, y, width, height = ltwh.T
+    right = x + width
+    bottom = y + height
+    mid_x = x + width / 2
+    mid_y = y + height / 2
+    blank = np.concatenate([history.blank for history in histories])
+    along_border = np.concatenate([history.is_along_border for history in histories])
+    mass = np.concatenate([history.mass for history in histories])
+    variance = np.concatenate([history.pixel_variance for history in histories])
+
+    # velocities are only used up to the shortest of vel_x, vel_y and the bounds
+    vel_x = np.zeros(len(track_i))
+    vel_y = np.zeros(len(track_i))
+    has_vel = np.zeros(len(track_i), dtype=bool)
+    for i, start in zip(scored, starts):
+        track = tracks[i]
+        count = min(len(track.vel_x), len(track.vel_y), len(track))
+        vel_x[start : start + count] = track.vel_x[:count]
+        vel_y[start : start + count] = track.vel_y[:count]
+        has_vel[start : start + count] = True
+
+    def previous(values):
+        return np.roll(values, 1)
+
+    # get movement vectors only from non blank regions
+    speed = np.where(has_vel & ~blank, np.abs(vel_x) + np.abs(vel_y), 0)
+    has_moved = ((x != previous(x)) & (right != previous(right))) | (
+        (y != previous(y)) & (bottom != previous(bottom))
+    )
+    moving = has_vel & follows & ~blank & ~previous(blank) & (has_moved | along_border)
+    distance = np.sqrt(vel_x**2 + vel_y**2)
+    first_x = mid_x[starts][track_i]
+    first_y = mid_y[starts][track_i]
+    offset = (first_x - mid_x) ** 2 + (first_y - mid_y) ** 2
+    max_offset = np.zeros(len(scored))
+    np.maximum.at(max_offset, track_i[moving], offset[moving])
+    # bincount adds in frame order so totals match summing frame by frame
+    movement = np.bincount(
+        track_i, weights=np.where(moving, distance, 0), minlength=len(scored)
+    )
+    total_speed = np.bincount(track_i, weights=speed, minlength=len(scored))
+    frames_moved = np.bincount(track_i[moving], minlength=len(scored))
+
+    height_diff = height - previous(height)
+    width_diff = previous(width) - width
+    thresh_h = np.maximum(
+        Track.MIN_JITTER_CHANGE, previous(height) * Track.JITTER_THRESHOLD
+    )
+    thresh_v = np.maximum(
+        Track.MIN_JITTER_CHANGE, previous(width) * Track.JITTER_THRESHOLD
+    )
+    jitter_h = np.abs(height_diff) > thresh_h
+    jitter_v = ~jitter_h & (np.abs(width_diff) > thresh_v)
+    can_jitter = follows & ~along_border & ~previous(along_border)
+    bigger = can_jitter & (
+        (jitter_h & (height_diff > 0)) | (jitter_v & (width_diff > 0))
+    )
+    smaller = can_jitter & (
+        (jitter_h & (height_diff <= 0)) | (jitter_v & (width_diff <= 0))
+    )
+    jitter_bigger = np.bincount(track_i[bigger], minlength=len(scored))
+    jitter_smaller = np.bincount(track_i[smaller], minlength=len(scored))
+
+    non_blank_counts = np.bincount(track_i[~blank], minlength=len(scored))
+    mass_histories = np.split(mass[~blank], np.cumsum(non_blank_counts)[:-1])
+    has_variance = ~blank & (variance != 0)
+    variance_histories = np.split(
+        variance[has_variance],
+        np.cumsum(np.bincount(track_i[has_variance], minlength=len(scored)))[:-1],
+    )
+    for s_i, i in enumerate(scored):
+        track = tracks[i]
+        mass_history = mass_histories[s_i]
+        avg_vel = float(total_speed[s_i]) / len(mass_history)
+        # the standard deviation is calculated by averaging the per frame variances.
+        # this ends up being slightly different as I'm using /n rather than /(n-1) but that
+        # shouldn't make a big difference as n = width*height*frames which is large.
+        track_max_offset = math.sqrt(max_offset[s_i])
+        delta_std = float(np.mean(variance_histories[s_i])) ** 0.5
+        track_movement = float(movement[s_i])
+        movement_points = (track_movement**0.5) + track_max_offset
+        delta_points = delta_std * 25.0
+        jitter = int(jitter_bigger[s_i] + jitter_smaller[s_i])
+        jitter_percent = int(round(100 * jitter / float(track.frames)))
+
+        blank_percent = int(round(100.0 * track.blank_frames / track.frames))
+        score = (
+            min(movement_points, 100)
+            + min(delta_points, 100)
+            + (100 - jitter_percent)
+            + (100 - blank_percent)
+        )
+        stats[i] = TrackMovementStatistics(
+            movement=track_movement,
+            max_offset=float(track_max_offset),
+            average_mass=float(np.mean(mass_history)),
+            median_mass=float(np.median(mass_history)),
+            delta_std=float(delta_std),
+            score=float(score),
+            region_jitter=jitter_percent,
+            jitter_bigger=int(jitter_bigger[s_i]),
+            jitter_smaller=int(jitter_smaller[s_i]),
+            blank_percent=blank_percent,
+            frames_moved=int(frames_moved[s_i]),
+            mass_std=float(np.std(mass_history)),
+            average_velocity=float(avg_vel),
+        )
+    return stats
 
 
 class Track:
@@ -356,7 +541,7 @@ class Track:
         self.current_frame_num = None
         self.frame_list = []
         # our bounds over time
-        self.bounds_history = []
+        self.bounds_history = BoundsHistory()
         # number frames since we lost target.
 
         self.vel_x = []
@@ -430,11 +615,11 @@ class Track:
         segment_type=SegmentType.ALL_RANDOM,
     ):
 
-        regions = np.array(self.bounds_history)
+        regions = self.bounds_history.regions()
         frame_temp_median = np.uint16(frame_temp_median)
         segments = []
         if segment_frames is not None:
-            mass_history = np.uint16([region.mass for region in regions])
+            mass_history = np.uint16(self.bounds_history.mass)
             for frames in segment_frames:
                 relative_frames = frames - self.start_frame
                 mass_slice = mass_history[relative_frames]
@@ -454,7 +639,7 @@ class Track:
                 )
                 segments.append(segment)
         else:
-            has_mass = any([region.mass for region in regions if region.mass > 0])
+            has_mass = np.any(self.bounds_history.mass > 0)
             segments, _ = get_segments(
                 self.clip_id,
                 self._id,
@@ -522,7 +707,7 @@ class Track:
         positions = track_meta.get("positions")
         if not positions:
             return False
-        self.bounds_history = []
+        self.bounds_history = BoundsHistory()
         self.frame_list = []
         for i, position in enumerate(positions):
             if isinstance(position, list):
@@ -598,8 +783,9 @@ class Track:
         if self.crop_rectangle is None:
             logging.info("No crop rectangle to crop with")
             return
-        for region in self.bounds_history:
+        for i, region in enumerate(self.bounds_history):
             region.crop(self.crop_rectangle)
+            self.bounds_history[i] = region
 
     def add_frame_for_existing_region(self, frame, mass_delta_threshold, prev_filtered):
         region = self.bounds_history[self.current_frame_num]
@@ -608,6 +794,7 @@ class Track:
         filtered = region.subimage(frame.filtered)
         region.calculate_mass(filtered, mass_delta_threshold)
         region.calculate_variance(filtered, prev_filtered)
+        self.bounds_history[self.current_frame_num] = region
         if self.prev_frame_num and frame.frame_number:
             frame_diff = frame.frame_number - self.prev_frame_num - 1
             for _ in range(frame_diff):
@@ -620,34 +807,12 @@ class Track:
         self.current_frame_num += 1
 
     def average_area(self):
-        """Average mass of last 5 frames that weren't blank"""
-        avg_area = 0
-        count = 0
-        for i in range(len(self.bounds_history)):
-            bound = self.bounds_history[-i - 1]
-            if not bound.blank:
-                avg_area += bound.area
-                count += 1
-            if count == 5:
-                break
-        if count == 0:
-            return 0
-        return avg_area / count
+        """Average area of last 5 frames that weren't blank"""
+        return self.bounds_history.average_area()
 
     def average_mass(self):
         """Average mass of last 5 frames that weren't blank"""
-        avg_mass = 0
-        count = 0
-        for i in range(len(self.bounds_history)):
-            bound = self.bounds_history[-i - 1]
-            if not bound.blank:
-                avg_mass += bound.mass
-                count += 1
-            if count == 5:
-                break
-        if count == 0:
-            return 0
-        return avg_mass / count
+        return self.bounds_history.average_mass()
 
     def add_blank_frame(self):
         """Maintains same bounds as previously, does not reset framce_since_target_seen counter"""
@@ -663,97 +828,7 @@ class Track:
         that this is a good track.
         :return: a TrackMovementStatistics record
         """
-
-        if len(self) <= 1:
-            return TrackMovementStatistics()
-        # get movement vectors only from non blank regions
-        non_blank = [bound for bound in self.bounds_history if not bound.blank]
-        mass_history = [int(bound.mass) for bound in non_blank]
-        variance_history = [
-            bound.pixel_variance for bound in non_blank if bound.pixel_variance
-        ]
-        movement = 0
-        max_offset = 0
-
-        frames_moved = 0
-        avg_vel = 0
-        first_point = self.bounds_history[0].mid
-        for i, (vx, vy) in enumerate(zip(self.vel_x, self.vel_y)):
-            region = self.bounds_history[i]
-            if not region.blank:
-                avg_vel += abs(vx) + abs(vy)
-            if i == 0:
-                continue
-
-            if region.blank or self.bounds_history[i - 1].blank:
-                continue
-            if region.has_moved(self.bounds_history[i - 1]) or region.is_along_border:
-                distance = (vx**2 + vy**2) ** 0.5
-                movement += distance
-                offset = eucl_distance(first_point, region.mid)
-                max_offset = max(max_offset, offset)
-                frames_moved += 1
-        avg_vel = avg_vel / len(mass_history)
-        # the standard deviation is calculated by averaging the per frame variances.
-        # this ends up being slightly different as I'm using /n rather than /(n-1) but that
-        # shouldn't make a big difference as n = width*height*frames which is large.
-        max_offset = math.sqrt(max_offset)
-        delta_std = float(np.mean(variance_history)) ** 0.5
-        jitter_bigger = 0
-        jitter_smaller = 0
-        for i, bound in enumerate(self.bounds_history[1:]):
-            prev_bound = self.bounds_history[i]
-            if prev_bound.is_along_border or bound.is_along_border:
-                continue
-            height_diff = bound.height - prev_bound.height
-            width_diff = prev_bound.width - bound.width
-            thresh_h = max(
-                Track.MIN_JITTER_CHANGE, prev_bound.height * Track.JITTER_THRESHOLD
-            )
-            thresh_v = max(
-                Track.MIN_JITTER_CHANGE, prev_bound.width * Track.JITTER_THRESHOLD
-            )
-            if abs(height_diff) > thresh_h:
-                if height_diff > 0:
-                    jitter_bigger += 1
-                else:
-                    jitter_smaller += 1
-            elif abs(width_diff) > thresh_v:
-                if width_diff > 0:
-                    jitter_bigger += 1
-                else:
-                    jitter_smaller += 1
-
-        movement_points = (movement**0.5) + max_offset
-        delta_points = delta_std * 25.0
-        jitter_percent = int(
-            round(100 * (jitter_bigger + jitter_smaller) / float(self.frames))
-        )
-
-        blank_percent = int(round(100.0 * self.blank_frames / self.frames))
-        score = (
-            min(movement_points, 100)
-            + min(delta_points, 100)
-            + (100 - jitter_percent)
-            + (100 - blank_percent)
-        )
-        stats = TrackMovementStatistics(
-            movement=float(movement),
-            max_offset=float(max_offset),
-            average_mass=float(np.mean(mass_history)),
-            median_mass=float(np.median(mass_history)),
-            delta_std=float(delta_std),
-            score=float(score),
-            region_jitter=jitter_percent,
-            jitter_bigger=jitter_bigger,
-            jitter_smaller=jitter_smaller,
-            blank_percent=blank_percent,
-            frames_moved=frames_moved,
-            mass_std=float(np.std(mass_history)),
-            average_velocity=float(avg_vel),
-        )
-
-        return stats
+        return track_movement_statistics([self])[0]
 
     def smooth(self, frame_bounds: Rectangle):
         """
@@ -792,13 +867,13 @@ class Track:
 
             new_bounds_history.append(frame)
 
-        self.bounds_history = new_bounds_history
+        self.bounds_history = BoundsHistory(new_bounds_history)
 
     def trim(self):
         """
         Removes empty frames from start and end of track
         """
-        mass_history = [int(bound.mass) for bound in self.bounds_history]
+        mass_history = self.bounds_history.mass
         median_mass = np.median(mass_history)
         filter_mass = 0.005 * median_mass
         filter_mass = max(filter_mass, 2)
@@ -818,7 +893,7 @@ class Track:
         self.tracker._frames_since_target_seen = 0
         if end < start:
             self.start_frame = 0
-            self.bounds_history = []
+            self.bounds_history = BoundsHistory()
             self.vel_x = []
             self.vel_y = []
             self.tracker._blank_frames = 0
@@ -913,7 +988,7 @@ class Track:
         track_info["num_frames"] = len(self)
         track_info["frame_start"] = self.start_frame
         track_info["frame_end"] = self.end_frame
-        track_info["positions"] = self.bounds_history
+        track_info["positions"] = list(self.bounds_history)
         prediction_info = []
         if predictions_per_model:
             for model_id, predictions in predictions_per_model.items():